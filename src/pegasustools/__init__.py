@@ -4,13 +4,30 @@ PegasusTools: Analysis package for the Pegasus PIC code.
 """
 
 # Import all relevant modules into the pegasustools namespacess
-from pegasustools.loading_hst import load_hst_file
-from pegasustools.loading_nbf import PegasusNBFData
+from pegasustools.catalog import catalog_directory
+from pegasustools.collation_mpi import (
+    collate_traces_mpi,
+    collate_tracks_from_binary_mpi,
+)
+from pegasustools.loading_hst import (
+    HistoryFollower,
+    load_hst_file,
+    load_hst_runs,
+    scan_hst,
+)
+from pegasustools.loading_nbf import PegasusNBFData, PegasusNBFSeries
 from pegasustools.loading_spectra import PegasusSpectralData
-from pegasustools.loading_traces import collate_traces
+from pegasustools.loading_traces import (
+    PegasusTimeMajorTraces,
+    PegasusTraceStore,
+    collate_traces,
+    trace_frequency_spectra,
+    transpose_traces,
+)
 from pegasustools.loading_tracks import (
     collate_tracks_from_ascii,
     collate_tracks_from_binary,
+    scan_collated_tracks,
 )
 from pegasustools.mpl_setup import _register_hawley_colormap
 from pegasustools.pt_logging import setup_pt_logger
@@ -20,14 +37,26 @@ from ._version import version as __version__
 
 # Setup what gets imported with import *
 __all__ = [
+    "HistoryFollower",
     "PegasusNBFData",
+    "PegasusNBFSeries",
     "PegasusSpectralData",
+    "PegasusTimeMajorTraces",
+    "PegasusTraceStore",
     "__version__",
+    "catalog_directory",
     "collate_traces",
+    "collate_traces_mpi",
     "collate_tracks_from_ascii",
     "collate_tracks_from_binary",
+    "collate_tracks_from_binary_mpi",
     "load_hst_file",
+    "load_hst_runs",
+    "scan_collated_tracks",
+    "scan_hst",
     "setup_pt_logger",
+    "trace_frequency_spectra",
+    "transpose_traces",
 ]
 
 # Create and register the hawley colormap
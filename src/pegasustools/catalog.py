@@ -0,0 +1,347 @@
+"""Provides a persistent index of the files in a Pegasus++ output directory.
+
+This module provides:
+- catalog_directory: Scan an output directory and return the metadata of every file
+"""
+
+import os
+from pathlib import Path
+from typing import Any
+
+import polars as pl
+
+from .pt_logging import setup_pt_logger
+
+# The schema of the catalog. Columns that don't apply to a file type are null
+_CATALOG_SCHEMA = pl.Schema(
+    {
+        "path": pl.String(),
+        "file_type": pl.String(),
+        "size": pl.Int64(),
+        "mtime_ns": pl.Int64(),
+        "time": pl.Float64(),
+        "shape": pl.List(pl.Int64),
+        "num_meshblocks": pl.Int64(),
+        "variables": pl.List(pl.String),
+        "data_offset": pl.Int64(),
+        "data_size": pl.Int64(),
+    }
+)
+
+# Map from file suffix to file type
+_FILE_TYPES = {
+    ".nbf": "nbf",
+    ".hst": "hst",
+    ".spec": "spec",
+    ".specav": "specav",
+    ".edotv_prl_av": "specav",
+    ".edotv_prp_av": "specav",
+    ".spec_fpc": "specav",
+    ".edotv_prl_fpc": "specav",
+    ".edotv_prp_fpc": "specav",
+    ".track_mpiio_optimized": "track_binary",
+    ".trace_mpiio_optimized": "trace_binary",
+}
+
+
+def _get_file_type(name: str) -> str | None:
+    if name.endswith(".track.dat"):
+        return "track_ascii"
+    return _FILE_TYPES.get(Path(name).suffix)
+
+
+def _get_header_size(path: Path, file_type: str) -> int:
+    """Get the number of ASCII header lines of a file.
+
+    Files with more than one header version are told apart by the second line, the
+    same way the loaders do, so binary data is never mistaken for a header line.
+
+    Parameters
+    ----------
+    path : Path
+        The path to the file
+    file_type : str
+        The type of the file, one of the values in _FILE_TYPES or "track_ascii"
+
+    Returns
+    -------
+    int
+        The number of header lines.
+    """
+    match file_type:
+        case "nbf":
+            return 9
+        case "hst" | "track_ascii":
+            return 2
+
+    with path.open(mode="rb") as file:
+        _ = file.readline()
+        line_2 = file.readline()
+
+    match file_type:
+        case "spec":
+            # The new header has the sizes and maximum velocities of the spectra
+            return 5 if line_2.startswith(b"Histogram size in ") else 1
+        case "specav":
+            # Multiple ion species have four lines per species after the count
+            if line_2.startswith(b"Number of minor-ion species = "):
+                return 2 + 4 * (int(line_2.split()[-1]) + 1)
+            return 1
+        case _:
+            # Binary tracks and traces, only the new header lists the columns
+            return 3 if line_2.startswith(b"Number of variables = ") else 1
+
+
+def _read_ascii_header(path: Path, num_lines: int) -> tuple[list[str], int]:
+    """Read the ASCII header lines of a file.
+
+    Parameters
+    ----------
+    path : Path
+        The path to the file
+    num_lines : int
+        The number of lines in the header
+
+    Returns
+    -------
+    tuple[list[str], int]
+        The header lines and the byte offset of the end of the header.
+    """
+    with path.open(mode="rb") as file:
+        lines = [file.readline().decode("ascii").rstrip() for _ in range(num_lines)]
+        return lines, file.tell()
+
+
+def _parse_file(path: Path, file_type: str, size: int) -> dict[str, Any]:
+    """Parse the header of a file and return its catalog entry.
+
+    Parameters
+    ----------
+    path : Path
+        The path to the file
+    file_type : str
+        The type of the file, one of the values in _FILE_TYPES or "track_ascii"
+    size : int
+        The size of the file in bytes
+
+    Returns
+    -------
+    dict[str, Any]
+        The metadata of the file. Keys that can't be determined are None.
+    """
+    entry: dict[str, Any] = {
+        "time": None,
+        "shape": None,
+        "num_meshblocks": None,
+        "variables": None,
+        "data_offset": None,
+    }
+
+    header, offset = _read_ascii_header(path, _get_header_size(path, file_type))
+    match file_type:
+        case "nbf":
+            entry["time"] = float(header[0].split()[-1])
+            entry["num_meshblocks"] = int(header[2].split()[-1])
+            entry["variables"] = header[4].split()[1:]
+            mesh = dict(
+                element.split("=")
+                for element in " ".join(header[5:8]).split()[1:]
+                if element.startswith("nx")
+            )
+            entry["shape"] = [int(mesh["nx1"]), int(mesh["nx2"]), int(mesh["nx3"])]
+            entry["data_offset"] = offset
+        case "hst" | "track_ascii":
+            entry["variables"] = [name.split("=")[-1] for name in header[1].split()[1:]]
+            entry["data_offset"] = offset
+        case "spec" | "specav":
+            entry["time"] = float(header[0].split()[-1])
+            entry["data_offset"] = offset
+            # Only the new .spec header contains the size of each spectrum
+            if file_type == "spec" and len(header) > 1:
+                n_prl = int(header[1].split()[-1])
+                n_prp = int(header[2].split()[-1])
+                block_header_size = 6
+                num_meshblocks = (size - offset) // (
+                    8 * (n_prl * n_prp + block_header_size)
+                )
+                entry["shape"] = [num_meshblocks, n_prp, n_prl]
+                entry["num_meshblocks"] = num_meshblocks
+        case "track_binary" | "trace_binary":
+            entry["time"] = float(header[0].split()[-1])
+            entry["data_offset"] = offset
+            # Only the new header lists the columns
+            if len(header) > 1:
+                num_columns = int(header[1].split()[-1])
+                entry["variables"] = header[2].split()[1:]
+                entry["shape"] = [(size - offset) // (8 * num_columns), num_columns]
+
+    if entry["data_offset"] is not None:
+        entry["data_size"] = size - entry["data_offset"]
+    else:
+        entry["data_size"] = None
+
+    return entry
+
+
+def _scan_directory(directory: Path, *, recursive: bool) -> dict[str, os.stat_result]:
+    """Find all the Pegasus++ output files in a directory and stat them.
+
+    Parameters
+    ----------
+    directory : Path
+        The directory to scan
+    recursive : bool
+        Whether to descend into subdirectories
+
+    Returns
+    -------
+    dict[str, os.stat_result]
+        The stat results indexed by the path relative to `directory`.
+    """
+    found: dict[str, os.stat_result] = {}
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        pending.append(Path(entry.path))
+                elif _get_file_type(entry.name) is not None:
+                    relative_path = Path(entry.path).relative_to(directory)
+                    found[relative_path.as_posix()] = entry.stat()
+    return found
+
+
+def catalog_directory(
+    directory: Path,
+    *,
+    recursive: bool = False,
+    revalidate: bool = True,
+    catalog_name: str = ".pegasustools_catalog.parquet",
+) -> pl.DataFrame:
+    """Build or update the catalog of the Pegasus++ output files in a directory.
+
+    The first call parses the header of every output file and saves the results to
+    a parquet file in `directory`. Subsequent calls load that file and only parse
+    files that are new or whose size or modification time changed. Entries for files
+    that no longer exist are dropped. If the catalog can't be written, e.g. because
+    the directory is read only, a warning is logged and the catalog is still returned.
+
+    Parameters
+    ----------
+    directory : Path
+        The directory to catalog
+    recursive : bool, optional
+        Whether to include files in subdirectories, by default False
+    revalidate : bool, optional
+        Whether to check the existing catalog against the files on disk, by default
+        True. If False and a catalog exists it is returned as is without touching any
+        of the output files.
+    catalog_name : str, optional
+        The name of the catalog file, by default ".pegasustools_catalog.parquet"
+
+    Returns
+    -------
+    pl.DataFrame
+        One row per file, sorted by path. Keys are:
+        - path: The path relative to `directory`
+        - file_type: One of nbf, hst, spec, specav, track_ascii, track_binary, or
+          trace_binary
+        - size: The size of the file in bytes
+        - mtime_ns: The modification time of the file in nanoseconds
+        - time: The simulation time in the header, if there is one
+        - shape: The shape of the data, if it can be determined from the header
+        - num_meshblocks: The number of meshblocks in .nbf and .spec files
+        - variables: The names of the variables or columns, if they are in the header
+        - data_offset: The byte offset of the end of the ASCII header
+        - data_size: The number of bytes after the ASCII header
+    """
+    logger = setup_pt_logger()
+    catalog_path = directory / catalog_name
+
+    # Load the existing catalog, catalogs with a different schema are rebuilt
+    catalog = pl.DataFrame(schema=_CATALOG_SCHEMA)
+    if catalog_path.exists():
+        saved_catalog = pl.read_parquet(catalog_path)
+        if saved_catalog.schema == _CATALOG_SCHEMA:
+            catalog = saved_catalog
+            if not revalidate:
+                return catalog
+        else:
+            logger.info("Rebuilding the outdated catalog at %s", catalog_path)
+
+    # Find which files are unchanged
+    on_disk = _scan_directory(directory, recursive=recursive)
+    known = {
+        row["path"]: (row["size"], row["mtime_ns"])
+        for row in catalog.select("path", "size", "mtime_ns").iter_rows(named=True)
+    }
+    unchanged = [
+        path
+        for path, stat in on_disk.items()
+        if known.get(path) == (stat.st_size, stat.st_mtime_ns)
+    ]
+    changed = sorted(set(on_disk) - set(unchanged))
+
+    # Parse the new and modified files
+    rows = []
+    for path in changed:
+        stat = on_disk[path]
+        file_type = _get_file_type(Path(path).name)
+        assert file_type is not None  # noqa: S101
+        try:
+            metadata = _parse_file(directory / path, file_type, stat.st_size)
+        except (IndexError, KeyError, ValueError):
+            logger.warning("Could not parse the header of %s", directory / path)
+            metadata = {}
+        rows.append(
+            {
+                "path": path,
+                "file_type": file_type,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                **metadata,
+            }
+        )
+
+    updated_catalog = pl.concat(
+        [
+            catalog.filter(pl.col("path").is_in(unchanged)),
+            pl.DataFrame(rows, schema=_CATALOG_SCHEMA),
+        ]
+    ).sort("path")
+
+    # Only write the catalog if something changed
+    if len(rows) > 0 or len(updated_catalog) != len(catalog):
+        try:
+            updated_catalog.write_parquet(catalog_path)
+        except OSError:
+            logger.warning("Could not write the catalog to %s", catalog_path)
+    logger.info(
+        "Catalog of %s: %i files, %i parsed.",
+        directory,
+        len(updated_catalog),
+        len(rows),
+    )
+
+    return updated_catalog
+
+
+def _find_output_files(directory: Path, file_type: str) -> tuple[list[Path], list[int]]:
+    """Find the output files of one type in a directory using its catalog.
+
+    Parameters
+    ----------
+    directory : Path
+        The directory to search
+    file_type : str
+        The type of file to find, one of the types in the catalog
+
+    Returns
+    -------
+    tuple[list[Path], list[int]]
+        The paths to the files, sorted, and their sizes in bytes.
+    """
+    files = catalog_directory(directory).filter(pl.col("file_type") == file_type)
+    return [directory / path for path in files["path"]], files["size"].to_list()
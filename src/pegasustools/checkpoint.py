@@ -0,0 +1,358 @@
+"""Provides checkpointing for long running, multistage collation jobs.
+
+This module provides:
+- CollationCheckpoint: A job manifest that records the completed stages and chunks
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import os
+from collections.abc import Callable
+from pathlib import Path
+from timeit import default_timer
+from typing import Any
+
+import polars as pl
+
+from .execution import run_batch
+from .pt_logging import setup_pt_logger
+
+# The number of bytes read at a time when computing checksums
+_CHECKSUM_BLOCK_SIZE = 1 << 24
+
+
+def _fingerprint(path: Path) -> dict[str, Any]:
+    """Compute the fingerprint used to check that an output file is intact.
+
+    Parquet files are fingerprinted by their size and the number of rows in their
+    footer, which is cheap to read and fails if the file is truncated. Other files are
+    fingerprinted by their size and a BLAKE2 checksum of their contents.
+
+    Parameters
+    ----------
+    path : Path
+        The path to the file
+
+    Returns
+    -------
+    dict[str, Any]
+        The size of the file and either its number of rows or its checksum.
+    """
+    fingerprint: dict[str, Any] = {"size": path.stat().st_size}
+    if path.suffix == ".parquet":
+        fingerprint["num_rows"] = (
+            pl.scan_parquet(path).select(pl.len()).collect().item()
+        )
+    else:
+        checksum = hashlib.blake2b()
+        with path.open(mode="rb") as file:
+            while block := file.read(_CHECKSUM_BLOCK_SIZE):
+                checksum.update(block)
+        fingerprint["checksum"] = checksum.hexdigest()
+    return fingerprint
+
+
+class CollationCheckpoint:
+    """A manifest of the completed work in a collation job.
+
+    The manifest is a JSON file in the destination directory that records each stage
+    of the job and each chunk of work in that stage that has completed, along with the
+    files it wrote, a fingerprint of each file, and the number of rows. Rerunning the
+    same job loads the manifest so that finished chunks are skipped. A chunk is only
+    considered complete if all of the files it wrote still exist with the same
+    fingerprint, see `_fingerprint`. Chunks that failed partway through, or whose
+    output was removed, truncated, or rewritten, are redone.
+
+    If the existing manifest was written by a different job or with different
+    parameters it is discarded and the job starts from scratch. Jobs remove the
+    manifest once they finish so that it isn't mixed in with their output.
+
+    To keep the cost of large jobs with many chunks down the manifest is saved at most
+    once every `save_interval` seconds when chunks complete, and always when a stage
+    completes. Chunks that completed after the last save are redone.
+
+    Parameters
+    ----------
+    destination_dir : Path
+        The directory the job writes to. The manifest is stored here.
+    job : str
+        The name of the job, e.g. the name of the collation function
+    parameters : dict[str, Any]
+        The JSON serializable parameters that determine the output of the job
+    manifest_name : str, optional
+        The name of the manifest file, by default "_checkpoint.json"
+    save_interval : float, optional
+        The minimum time in seconds between saves when chunks complete, by default 10
+    """
+
+    def __init__(
+        self,
+        destination_dir: Path,
+        job: str,
+        parameters: dict[str, Any],
+        manifest_name: str = "_checkpoint.json",
+        save_interval: float = 10.0,
+    ) -> None:
+        """Initialize a CollationCheckpoint and load any existing manifest."""
+        logger = setup_pt_logger()
+        self.__destination_dir = destination_dir
+        self.__manifest_path = destination_dir / manifest_name
+        self.__save_interval = save_interval
+        self.__last_save = default_timer()
+
+        # Normalize the parameters so they compare equal to the ones loaded from JSON
+        parameters = json.loads(json.dumps(parameters, default=str))
+        self.__manifest: dict[str, Any] = {
+            "job": job,
+            "parameters": parameters,
+            "stages": {},
+        }
+
+        if self.__manifest_path.exists():
+            manifest = json.loads(self.__manifest_path.read_text())
+            if manifest.get("job") == job and manifest.get("parameters") == parameters:
+                self.__manifest = manifest
+                logger.info("Resuming from the checkpoint at %s", self.__manifest_path)
+            else:
+                logger.warning(
+                    "The checkpoint at %s is from a different job and is ignored",
+                    self.__manifest_path,
+                )
+
+    def save(self) -> None:
+        """Atomically write the manifest to disk."""
+        self.__destination_dir.mkdir(parents=True, exist_ok=True)
+        temp_path = self.__manifest_path.with_name(self.__manifest_path.name + ".tmp")
+        temp_path.write_text(json.dumps(self.__manifest, indent=1))
+        temp_path.replace(self.__manifest_path)
+        self.__last_save = default_timer()
+
+    def remove(self) -> None:
+        """Delete the manifest, e.g. once the job has finished successfully."""
+        self.__manifest_path.unlink(missing_ok=True)
+
+    def __get_stage(self, stage: str) -> dict[str, Any]:
+        """Get the record of a stage, creating it if it doesn't exist."""
+        stages: dict[str, dict[str, Any]] = self.__manifest["stages"]
+        return stages.setdefault(
+            stage, {"complete": False, "result": None, "chunks": {}}
+        )
+
+    def __outputs_intact(self, outputs: dict[str, dict[str, Any]]) -> bool:
+        """Check that every output file exists and has the recorded fingerprint."""
+        for relative_path, fingerprint in outputs.items():
+            try:
+                if _fingerprint(self.__destination_dir / relative_path) != fingerprint:
+                    return False
+            except (OSError, pl.exceptions.ComputeError):
+                return False
+        return True
+
+    def is_stage_complete(self, stage: str) -> bool:
+        """Check if a stage has completed.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage
+
+        Returns
+        -------
+        bool
+            True if the stage has been marked complete.
+        """
+        return bool(self.__get_stage(stage)["complete"])
+
+    def complete_stage(self, stage: str, result: Any = None) -> None:  # noqa: ANN401
+        """Mark a stage as complete and save the manifest.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage
+        result : Any, optional
+            A JSON serializable result of the stage, by default None
+        """
+        record = self.__get_stage(stage)
+        record["complete"] = True
+        record["result"] = result
+        self.save()
+
+    def stage_result(self, stage: str) -> Any:  # noqa: ANN401
+        """Get the result stored when a stage was completed.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage
+
+        Returns
+        -------
+        Any
+            The result passed to `complete_stage`.
+        """
+        return self.__get_stage(stage)["result"]
+
+    def is_chunk_complete(self, stage: str, chunk: str) -> bool:
+        """Check if a chunk has completed and its output files are intact.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage
+        chunk : str
+            The name of the chunk
+
+        Returns
+        -------
+        bool
+            True if the chunk was completed and all the files it wrote still exist with
+            the same fingerprints.
+        """
+        record = self.__get_stage(stage)["chunks"].get(chunk)
+        return record is not None and self.__outputs_intact(record["outputs"])
+
+    def complete_chunk(
+        self,
+        stage: str,
+        chunk: str,
+        outputs: list[Path],
+        num_rows: int | None = None,
+        result: Any = None,  # noqa: ANN401
+    ) -> None:
+        """Record that a chunk has completed and save the manifest.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage
+        chunk : str
+            The name of the chunk
+        outputs : list[Path]
+            The files the chunk wrote that should be checked when resuming. They must be
+            in the destination directory.
+        num_rows : int | None, optional
+            The number of rows the chunk wrote, by default None
+        result : Any, optional
+            A JSON serializable result of the chunk, by default None
+        """
+        self.__get_stage(stage)["chunks"][chunk] = {
+            "outputs": {
+                Path(os.path.relpath(path, self.__destination_dir)).as_posix(): (
+                    _fingerprint(path)
+                )
+                for path in outputs
+            },
+            "num_rows": num_rows,
+            "result": result,
+        }
+        if default_timer() - self.__last_save >= self.__save_interval:
+            self.save()
+
+    def chunk_result(self, stage: str, chunk: str) -> Any:  # noqa: ANN401
+        """Get the result stored when a chunk was completed.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage
+        chunk : str
+            The name of the chunk
+
+        Returns
+        -------
+        Any
+            The result passed to `complete_chunk`.
+        """
+        return self.__get_stage(stage)["chunks"][chunk]["result"]
+
+    def chunk_outputs(self, stage: str, chunk: str) -> list[Path]:
+        """Get the files written by a chunk.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage
+        chunk : str
+            The name of the chunk
+
+        Returns
+        -------
+        list[Path]
+            The paths to the files.
+        """
+        outputs = self.__get_stage(stage)["chunks"][chunk]["outputs"]
+        return [self.__destination_dir / relative_path for relative_path in outputs]
+
+    def run_stage(
+        self,
+        executor: concurrent.futures.Executor,
+        stage: str,
+        tasks: dict[str, tuple[Callable[..., Any], tuple[Any, ...]]],
+        record: Callable[[Any], tuple[list[Path], int | None, Any]],
+        batch_size: int = 1,
+    ) -> None:
+        """Run the chunks of a stage that haven't completed, then complete the stage.
+
+        Each batch of chunks is recorded as soon as it finishes so that if one fails
+        the others are still recorded.
+
+        Parameters
+        ----------
+        executor : concurrent.futures.Executor
+            The executor to run the chunks on
+        stage : str
+            The name of the stage
+        tasks : dict[str, tuple[Callable[..., Any], tuple[Any, ...]]]
+            The function and arguments of each chunk, indexed by the name of the chunk
+        record : Callable[[Any], tuple[list[Path], int | None, Any]]
+            Converts the return value of a chunk's function into the arguments of
+            `complete_chunk`: the output files, the number of rows, and the result.
+        batch_size : int, optional
+            The number of chunks to run in each task submitted to the executor, by
+            default 1. See `execution.get_batch_size`.
+        """
+        logger = setup_pt_logger()
+        pending = {
+            chunk: task
+            for chunk, task in tasks.items()
+            if not self.is_chunk_complete(stage, chunk)
+        }
+        logger.info(
+            "Stage '%s': %i of %i chunks already complete",
+            stage,
+            len(tasks) - len(pending),
+            len(tasks),
+        )
+
+        chunks = list(pending)
+        batches = [
+            chunks[i : i + batch_size] for i in range(0, len(chunks), batch_size)
+        ]
+        futures = {
+            executor.submit(run_batch, [pending[chunk] for chunk in batch]): batch
+            for batch in batches
+        }
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                for chunk, chunk_result in zip(
+                    futures[future], future.result(), strict=True
+                ):
+                    outputs, num_rows, result = record(chunk_result)
+                    self.complete_chunk(stage, chunk, outputs, num_rows, result)
+        finally:
+            self.save()
+
+        self.complete_stage(stage)
+
+    @property
+    def manifest_path(self) -> Path:
+        """The path to the manifest file.
+
+        Returns
+        -------
+        Path
+            The path to the manifest file.
+        """
+        return self.__manifest_path
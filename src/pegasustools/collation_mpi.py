@@ -0,0 +1,411 @@
+"""Provides MPI versions of the collation functions for runs that span many nodes.
+
+This module requires the optional dependency mpi4py, install it with
+`pip install pegasustools[mpi]`. It is only imported when one of the functions is
+called. Every rank must call the functions with the same arguments, e.g. with
+`mpirun -np 4 python collate.py`.
+
+This module provides:
+- collate_tracks_from_binary_mpi: The MPI version of collate_tracks_from_binary
+- collate_traces_mpi: The MPI version of collate_traces
+"""
+
+import itertools
+import shutil
+import typing
+from pathlib import Path
+from timeit import default_timer
+from types import ModuleType
+
+import numpy as np
+import polars as pl
+
+from .catalog import _find_output_files
+from .loading_traces import (
+    _collect_traces,
+    _get_trace_ranges,
+    _trace_reader,
+    _validate_trace_reduction,
+)
+from .loading_tracks import (
+    _SORT_MEMORY_FACTOR,
+    _binary_track_prescan,
+    _collect_particles_and_compute_delta_mu,
+    _get_binary_track_buckets,
+    _get_bucket_dir,
+    _get_num_buckets,
+    _iter_binary_track_chunks,
+    _merge_row_counts,
+    _verify_binary_track_collation,
+    _write_bucket_buffers,
+)
+from .pt_logging import setup_pt_logger
+
+
+def _import_mpi() -> ModuleType:
+    """Import the MPI module of mpi4py.
+
+    Returns
+    -------
+    ModuleType
+        The mpi4py.MPI module
+
+    Raises
+    ------
+    ImportError
+        Raised if mpi4py isn't installed.
+    """
+    try:
+        from mpi4py import MPI  # noqa: PLC0415
+    except ImportError as error:
+        msg = (
+            "The MPI backend requires mpi4py. Install it with "
+            "`pip install pegasustools[mpi]`."
+        )
+        raise ImportError(msg) from error
+    mpi: ModuleType = MPI
+    return mpi
+
+
+def _get_comm(comm: typing.Any) -> typing.Any:  # noqa: ANN401
+    """Get the communicator to use, COMM_WORLD by default.
+
+    Parameters
+    ----------
+    comm : typing.Any
+        An mpi4py communicator or None
+
+    Returns
+    -------
+    typing.Any
+        The communicator
+    """
+    if comm is not None:
+        return comm
+    return _import_mpi().COMM_WORLD
+
+
+def _reduce_row_counts(
+    comm: typing.Any,  # noqa: ANN401
+    row_counts: pl.DataFrame,
+) -> pl.DataFrame | None:
+    """Merge the row counts of every rank onto rank 0 with a binary tree.
+
+    At each level of the tree half of the remaining ranks send their merged table to a
+    partner, so no rank ever holds more than two merged tables at once.
+
+    Parameters
+    ----------
+    comm : typing.Any
+        The mpi4py communicator
+    row_counts : pl.DataFrame
+        The number of rows of each particle in this rank's files, see
+        `_merge_row_counts`
+
+    Returns
+    -------
+    pl.DataFrame | None
+        The number of rows of each particle in every file on rank 0, None on the other
+        ranks.
+    """
+    rank, size = comm.Get_rank(), comm.Get_size()
+    step = 1
+    while step < size:
+        if rank % (2 * step) == step:
+            comm.send(row_counts, dest=rank - step)
+            return None
+        if rank + step < size:
+            row_counts = _merge_row_counts([row_counts, comm.recv(source=rank + step)])
+        step *= 2
+    return row_counts
+
+
+def _shuffle_binary_track_chunks(
+    comm: typing.Any,  # noqa: ANN401
+    chunks: typing.Iterator[pl.DataFrame],
+    num_buckets: int,
+    bucket_root: Path,
+    buffer_size: int,
+) -> None:
+    """Send every row to the rank that owns its bucket and write it to disk there.
+
+    The shuffle happens in rounds. In each round every rank reads one chunk, splits it
+    by the rank that owns each bucket, and exchanges the pieces with an all-to-all.
+    The chunks must be at most `buffer_size / size` bytes so that the rows a rank
+    receives in one round are bounded no matter how many ranks there are. Each rank
+    buffers the rows it receives and writes them to its buckets' directories whenever
+    the buffer reaches `buffer_size` bytes, so each bucket gets a few large files
+    instead of one per round. The rounds continue until every rank has run out of
+    chunks.
+
+    Parameters
+    ----------
+    comm : typing.Any
+        The mpi4py communicator
+    chunks : typing.Iterator[pl.DataFrame]
+        The chunks of this rank's files, see `_iter_binary_track_chunks`
+    num_buckets : int
+        The number of buckets. Rank `r` owns the buckets `b` with
+        `b * size // num_buckets == r`.
+    bucket_root : Path
+        The directory containing all the bucket directories
+    buffer_size : int
+        The approximate size, in bytes, of the received rows to buffer before writing
+    """
+    size = comm.Get_size()
+    buffers: dict[int, list[pl.DataFrame]] = {}
+    buffered_bytes = 0
+    flush_index = 0
+    while True:
+        chunk = next(chunks, None)
+        if comm.allreduce(chunk is not None) == 0:
+            break
+
+        # Split the chunk by the rank that owns each bucket
+        send = [pl.DataFrame() for _ in range(size)]
+        if chunk is not None:
+            for (owner,), owner_df in (
+                chunk.with_columns(owner=pl.col("bucket") * size // num_buckets)
+                .partition_by("owner", as_dict=True, include_key=False)
+                .items()
+            ):
+                send[int(owner)] = owner_df
+        received = [df for df in comm.alltoall(send) if len(df) > 0]
+
+        # Buffer the rows of each bucket and write them once the buffer is full
+        if len(received) == 0:
+            continue
+        for (bucket,), bucket_df in (
+            pl.concat(received)
+            .partition_by("bucket", as_dict=True, include_key=False)
+            .items()
+        ):
+            buffers.setdefault(int(bucket), []).append(bucket_df)
+            buffered_bytes += int(bucket_df.estimated_size())
+        if buffered_bytes >= buffer_size:
+            _write_bucket_buffers(buffers, bucket_root, f"flush_{flush_index}")
+            buffered_bytes = 0
+            flush_index += 1
+    _write_bucket_buffers(buffers, bucket_root, f"flush_{flush_index}")
+
+
+def collate_tracks_from_binary_mpi(
+    source_dir: Path,
+    destination_dir: Path,
+    *,
+    comm: typing.Any = None,  # noqa: ANN401
+    memory_limit_gb: float = 4.0,
+    columns: typing.Sequence[str] | None = None,
+) -> None:
+    """Collate the .track_mpiio_optimized files in a directory across MPI ranks.
+
+    This is the MPI version of `collate_tracks_from_binary` and writes the same output
+    files. The files are split between the ranks. Each rank counts the rows of each
+    particle in its files and rank 0 splits the global particle IDs into buckets with
+    roughly the same number of rows, which are divided evenly between the ranks. The
+    ranks then read their files in chunks and shuffle the rows to the rank that owns
+    each bucket with an all-to-all, see `_shuffle_binary_track_chunks`. Finally each
+    rank sorts its buckets and writes them to `destination_dir`.
+
+    `source_dir` and `destination_dir` must be on a file system shared by all the ranks.
+    Unlike `collate_tracks_from_binary` there is no checkpoint, a failed job must be
+    rerun from the start. There is also no `num_processes` argument, each rank is one
+    worker process, so launch one rank per core, e.g. `mpirun -np <cores>`, instead.
+
+    Parameters
+    ----------
+    source_dir : Path
+        The path to the directory with the .track_mpiio_optimized files
+    destination_dir : Path
+        The path with filename where the parquet files should be created. It will be
+        created if it doesn't exist.
+    comm : typing.Any, optional
+        The mpi4py communicator to use, by default None which uses COMM_WORLD
+    memory_limit_gb : float, optional
+        The approximate amount of memory, in GB, each rank can use when sorting the
+        particles, by default 4.0
+    columns : typing.Sequence[str] | None, optional
+        The columns to keep in addition to the IDs, time, mu, and delta mu, by default
+        None which keeps every column.
+    """
+    logger = setup_pt_logger()
+    comm = _get_comm(comm)
+    rank, size = comm.Get_rank(), comm.Get_size()
+    start = default_timer()
+
+    # Rank 0 finds the files so that every rank has the same list
+    files_to_read, file_sizes = None, None
+    if rank == 0:
+        logger.info("MPI collation launched with %i ranks", size)
+        files_to_read, file_sizes = _find_output_files(source_dir, "track_binary")
+        destination_dir.mkdir(parents=True, exist_ok=True)
+    files_to_read = comm.bcast(files_to_read, root=0)
+    local_files = files_to_read[rank::size]
+    temp_name = "_".join(files_to_read[0].stem.split(".")) + "_temp"
+    output_prefix = destination_dir / "_".join(temp_name.split("_")[:-2])
+    bucket_root = destination_dir / "temp_buckets"
+
+    # Count the rows of each particle, sum the counts on each rank and then across
+    # the ranks, and choose the buckets on rank 0
+    row_counts = _reduce_row_counts(
+        comm, _merge_row_counts(_binary_track_prescan(path) for path in local_files)
+    )
+    ids = None
+    if rank == 0:
+        assert row_counts is not None  # noqa: S101
+        assert file_sizes is not None  # noqa: S101
+        logger.info(
+            "Scanning IDs complete. Elapsed time: %.2fs", default_timer() - start
+        )
+        shutil.rmtree(bucket_root, ignore_errors=True)
+        ids = _get_binary_track_buckets(
+            row_counts, _get_num_buckets(sum(file_sizes), size, memory_limit_gb)
+        )
+        logger.info("Splitting the particles into %i buckets", len(ids["boundaries"]))
+    ids = comm.bcast(ids, root=0)
+    boundaries = np.array(ids["boundaries"], dtype=np.int64)
+    num_buckets = len(boundaries)
+
+    # Convert the files and shuffle the rows to the rank that owns their bucket
+    conversion_start = default_timer()
+    extrema = (ids["species_min"], ids["species_max"], ids["particles_max"])
+    # A rank can receive a chunk from every rank in each round, so the chunks are sized
+    # so that everything received in one round fits in the memory limit
+    buffer_size = int(memory_limit_gb * 1e9 / _SORT_MEMORY_FACTOR)
+    chunk_size = max(1, buffer_size // size)
+    _shuffle_binary_track_chunks(
+        comm,
+        itertools.chain.from_iterable(
+            _iter_binary_track_chunks(path, extrema, boundaries, chunk_size, columns)
+            for path in local_files
+        ),
+        num_buckets,
+        bucket_root,
+        buffer_size,
+    )
+    if rank == 0:
+        logger.info(
+            "Conversion and shuffle complete. Elapsed time: %.2fs",
+            default_timer() - conversion_start,
+        )
+
+    # Collect this rank's buckets into a single parquet file each
+    bucket_dirs = [
+        _get_bucket_dir(bucket_root, bucket)
+        for bucket in range(num_buckets)
+        if bucket * size // num_buckets == rank
+    ]
+    collected_paths = [
+        _collect_particles_and_compute_delta_mu(bucket_dir, output_prefix)
+        for bucket_dir in bucket_dirs
+        if bucket_dir.exists()
+    ]
+    for bucket_dir in bucket_dirs:
+        shutil.rmtree(bucket_dir, ignore_errors=True)
+
+    # Verify the results on rank 0
+    all_collected_paths = comm.gather(collected_paths, root=0)
+    if rank == 0:
+        _verify_binary_track_collation(
+            list(itertools.chain.from_iterable(all_collected_paths)),
+            sum(len(paths) for paths in all_collected_paths),
+            ids["num_rows"],
+        )
+        shutil.rmtree(bucket_root, ignore_errors=True)
+        logger.info(
+            "Finished sorting and collecting particle data. Total time:: %.2fs",
+            default_timer() - start,
+        )
+    comm.Barrier()
+
+
+def collate_traces_mpi(
+    source_dir: Path,
+    destination_dir: Path,
+    *,
+    comm: typing.Any = None,  # noqa: ANN401
+    columns: typing.Sequence[str] | None = None,
+    float32_columns: typing.Sequence[str] | None = None,
+    time_stride: int = 1,
+    cadence: float | None = None,
+) -> None:
+    """Collate the .trace_mpiio_optimized files in a directory across MPI ranks.
+
+    This is the MPI version of `collate_traces` and writes the same output files. The
+    files are converted and the ranges of traces are collected in parallel with the
+    work split evenly between the ranks.
+
+    `source_dir` and `destination_dir` must be on a file system shared by all the ranks.
+    Unlike `collate_traces` there is no checkpoint, a failed job must be rerun from the
+    start. Like `collate_tracks_from_binary_mpi` each rank is one worker process, so the
+    number of ranks replaces `num_processes`.
+
+    Parameters
+    ----------
+    source_dir : Path
+        The path to the directory with the .trace_mpiio_optimized files
+    destination_dir : Path
+        The path with filename where the parquet files should be created. It will be
+        created if it doesn't exist.
+    comm : typing.Any, optional
+        The mpi4py communicator to use, by default None which uses COMM_WORLD
+    columns : typing.Sequence[str] | None, optional
+        The columns to keep in addition to the block ID and time, by default None
+        which keeps every column.
+    float32_columns : typing.Sequence[str] | None, optional
+        The columns to store as float32 instead of float64, by default None
+    time_stride : int, optional
+        Keep every `time_stride`th sample of each trace, by default 1
+    cadence : float | None, optional
+        If given, only keep the first sample of each trace in each time interval of
+        length `cadence`, by default None. See `collate_traces` for details.
+    """
+    logger = setup_pt_logger()
+    _validate_trace_reduction(time_stride, cadence)
+    comm = _get_comm(comm)
+    rank, size = comm.Get_rank(), comm.Get_size()
+    start = default_timer()
+
+    # Rank 0 finds the files so that every rank has the same list
+    files_to_read = None
+    if rank == 0:
+        logger.info("MPI collation launched with %i ranks", size)
+        files_to_read, _ = _find_output_files(source_dir, "trace_binary")
+        destination_dir.mkdir(parents=True, exist_ok=True)
+    files_to_read = comm.bcast(files_to_read, root=0)
+    parquet_paths = tuple(
+        destination_dir / ("_".join(f.stem.split(".")) + "_temp.parquet")
+        for f in files_to_read
+    )
+
+    # Convert the binary files to parquet
+    for input_path, parquet_path in list(
+        zip(files_to_read, parquet_paths, strict=True)
+    )[rank::size]:
+        _trace_reader(
+            input_path, parquet_path, columns, float32_columns, time_stride, cadence
+        )
+    comm.Barrier()
+
+    # Determine work group ranges on rank 0
+    ranges = None
+    if rank == 0:
+        logger.info(
+            "Initial Conversion complete. Elapsed time: %.2fs", default_timer() - start
+        )
+        ranges = _get_trace_ranges(parquet_paths, len(parquet_paths))
+    ranges = comm.bcast(ranges, root=0)
+
+    # Collect data for each range of traces into a single parquet file
+    for trace_range in ranges[rank::size]:
+        _collect_traces(parquet_paths, trace_range, cadence)
+    comm.Barrier()
+
+    # Clean up the temporary files
+    for path in parquet_paths[rank::size]:
+        path.unlink()
+    if rank == 0:
+        logger.info(
+            "Finished sorting and collecting trace data. Total time:: %.2fs",
+            default_timer() - start,
+        )
@@ -0,0 +1,155 @@
+"""Provides the process pools shared by the loading and collating functions.
+
+Each worker process runs its own Polars thread pool, so running one worker per core
+with the default Polars settings starts one thread per core in every worker and
+oversubscribes the node. The pools created here split a total thread budget between
+the workers instead.
+
+This module provides:
+- get_available_cpus: The number of CPUs this process is allowed to run on
+- get_threads_per_process: Split a thread budget between worker processes
+- get_batch_size: Choose how many small tasks to run in each submitted task
+- process_pool: A context manager that creates a spawn process pool with a thread budget
+- run_batch: Run several tasks in a single worker task
+"""
+
+import concurrent.futures
+import contextlib
+import math
+import multiprocessing
+import os
+import typing
+from collections.abc import Callable, Iterator
+
+from .pt_logging import setup_pt_logger
+
+
+def get_available_cpus() -> int:
+    """Get the number of CPUs this process is allowed to run on.
+
+    This respects CPU affinity, e.g. the CPUs allocated to a Slurm job, where it is
+    supported.
+
+    Returns
+    -------
+    int
+        The number of available CPUs
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def get_threads_per_process(
+    num_processes: int, total_threads: int | None = None
+) -> int:
+    """Split a budget of threads evenly between worker processes.
+
+    Parameters
+    ----------
+    num_processes : int
+        The number of worker processes
+    total_threads : int | None, optional
+        The total number of threads to use, by default None which uses the number of
+        available CPUs
+
+    Returns
+    -------
+    int
+        The number of threads each process should use, at least 1.
+    """
+    if total_threads is None:
+        total_threads = get_available_cpus()
+    return max(1, total_threads // max(1, num_processes))
+
+
+def get_batch_size(
+    num_tasks: int, num_processes: int, batches_per_process: int = 4
+) -> int:
+    """Choose how many tasks to group together so each process gets a few batches.
+
+    Grouping many small tasks amortizes the cost of sending them to the workers, while
+    having a few batches per process still balances the load.
+
+    Parameters
+    ----------
+    num_tasks : int
+        The number of tasks
+    num_processes : int
+        The number of worker processes
+    batches_per_process : int, optional
+        The target number of batches for each process, by default 4
+
+    Returns
+    -------
+    int
+        The number of tasks in each batch, at least 1.
+    """
+    return max(1, math.ceil(num_tasks / (max(1, num_processes) * batches_per_process)))
+
+
+@contextlib.contextmanager
+def process_pool(
+    num_processes: int, *, total_threads: int | None = None
+) -> Iterator[concurrent.futures.ProcessPoolExecutor]:
+    """Create a process pool whose workers share a budget of Polars threads.
+
+    The workers are spawned, since forking is not safe with Polars, with
+    POLARS_MAX_THREADS set so that the total number of Polars threads across all the
+    workers matches the budget. The environment of this process is restored when the
+    pool is shut down.
+
+    Parameters
+    ----------
+    num_processes : int
+        The number of worker processes
+    total_threads : int | None, optional
+        The total number of threads to use, by default None which uses the number of
+        available CPUs
+
+    Yields
+    ------
+    concurrent.futures.ProcessPoolExecutor
+        The process pool
+    """
+    logger = setup_pt_logger()
+    threads_per_process = get_threads_per_process(num_processes, total_threads)
+
+    # Workers inherit the environment when they are spawned, which happens lazily, so
+    # the variable is set for the whole lifetime of the pool
+    previous_max_threads = os.environ.get("POLARS_MAX_THREADS")
+    os.environ["POLARS_MAX_THREADS"] = str(threads_per_process)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=num_processes, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            logger.info(
+                "ProcessPoolExecutor launched with %i processes. "
+                "Using %i Polars threads each.",
+                num_processes,
+                threads_per_process,
+            )
+            yield executor
+    finally:
+        if previous_max_threads is None:
+            del os.environ["POLARS_MAX_THREADS"]
+        else:
+            os.environ["POLARS_MAX_THREADS"] = previous_max_threads
+
+
+def run_batch(
+    tasks: list[tuple[Callable[..., typing.Any], tuple[typing.Any, ...]]],
+) -> list[typing.Any]:
+    """Run several tasks, one after another, in a single worker task.
+
+    Parameters
+    ----------
+    tasks : list[tuple[Callable[..., typing.Any], tuple[typing.Any, ...]]]
+        The function and arguments of each task
+
+    Returns
+    -------
+    list[typing.Any]
+        The return value of each task, in order.
+    """
+    return [function(*args) for function, args in tasks]
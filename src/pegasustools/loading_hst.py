@@ -1,18 +1,25 @@
-"""Provides the utilities required to load .hst files from Pegasus++."""
+"""Provides the utilities required to load .hst files from Pegasus++.
 
+This module provides:
+- scan_hst: Lazily load a .hst file through a parquet cache
+- load_hst_file: Load a .hst file, optionally through a parquet cache
+- load_hst_runs: Load several .hst files and align them onto a common time grid
+- HistoryFollower: Incrementally load a .hst file during a live run
+"""
+
+import os
 from pathlib import Path
 
 import numpy as np
 import polars as pl
 
-from .loading_tracks import _remove_restart_overlaps
-
+from .execution import get_batch_size, process_pool
+from .loading_tracks import _remove_restart_overlaps_expr, _scan_ascii_table
+from .pt_logging import setup_pt_logger
 
-def load_hst_file(hst_path: Path) -> pl.DataFrame:
-    r"""Load the contents of a .hst files as a Polars dataframe.
 
-    Automatically corrects for any overlap due to restarts by only accepting the
-    newest/latest data.
+def _get_hst_column_names(hst_path: Path) -> list[str]:
+    r"""Read and verify the header of a .hst file.
 
     Parameters
     ----------
@@ -21,10 +28,8 @@ def load_hst_file(hst_path: Path) -> pl.DataFrame:
 
     Returns
     -------
-    pl.DataFrame
-        The Polars dataframe that contains the data from the .hst file. Note that the
-        contents are all in FP32 since the .hst files don't contain enough precision for
-        FP64.
+    list[str]
+        The names of the columns in the .hst file
 
     Raises
     ------
@@ -33,7 +38,6 @@ def load_hst_file(hst_path: Path) -> pl.DataFrame:
         the first line is '# Athena++ history data\n' as a quick indicator if this is
         the proper file type.
     """
-    # ===== Get the column names =====
     # load the header lines
     with hst_path.open("r") as hst_file:
         title = next(hst_file)
@@ -47,14 +51,445 @@ def load_hst_file(hst_path: Path) -> pl.DataFrame:
         raise RuntimeError(msg)
 
     # Extract column names from the header
-    column_names = [col_name.split("=")[1] for col_name in header.split()[1:]]
+    return [col_name.split("=")[1] for col_name in header.split()[1:]]
+
+
+def _get_hst_cache_path(hst_path: Path) -> Path:
+    """Get the path of the parquet cache of a .hst file.
+
+    Parameters
+    ----------
+    hst_path : Path
+        The path to the .hst file
+
+    Returns
+    -------
+    Path
+        The path to the cache, the .hst file with '.parquet' appended.
+    """
+    return hst_path.with_name(hst_path.name + ".parquet")
+
+
+def _get_hst_cache_key(hst_path: Path) -> dict[str, str]:
+    """Get the parquet metadata used to check that a cache is still valid.
+
+    Parameters
+    ----------
+    hst_path : Path
+        The path to the .hst file
+
+    Returns
+    -------
+    dict[str, str]
+        The size and modification time of the .hst file.
+    """
+    stat = hst_path.stat()
+    return {
+        "pegasustools_hst_size": str(stat.st_size),
+        "pegasustools_hst_mtime_ns": str(stat.st_mtime_ns),
+    }
+
+
+def _is_hst_cache_valid(cache_path: Path, cache_key: dict[str, str]) -> bool:
+    """Check if the parquet cache exists and matches the current .hst file.
+
+    Parameters
+    ----------
+    cache_path : Path
+        The path to the cache
+    cache_key : dict[str, str]
+        The key computed by `_get_hst_cache_key`
+
+    Returns
+    -------
+    bool
+        True if the cache can be used.
+    """
+    if not cache_path.exists():
+        return False
+    try:
+        metadata = pl.read_parquet_metadata(cache_path)
+    except (OSError, pl.exceptions.ComputeError):
+        return False
+    return all(metadata.get(key) == value for key, value in cache_key.items())
+
+
+def scan_hst(hst_path: Path, *, use_cache: bool = True) -> pl.LazyFrame:
+    r"""Lazily load the contents of a .hst file as a Polars LazyFrame.
+
+    Automatically corrects for any overlap due to restarts by only accepting the
+    newest/latest data.
+
+    When `use_cache` is True the .hst file is parsed once and saved to a parquet file
+    next to it, named '<hst file name>.parquet', and the returned LazyFrame scans that
+    file. Column selections and filters, e.g. on a time window, are then pushed down
+    into the parquet reader. The cache stores the size and modification time of the
+    .hst file and is rebuilt if either changes. The cache is written to a temporary
+    file and then moved into place, so an interrupted write never leaves a truncated
+    cache behind.
+
+    Parameters
+    ----------
+    hst_path : Path
+        The path to the .hst file
+    use_cache : bool, optional
+        Whether to read and write the parquet cache, by default True. If False the
+        LazyFrame parses the .hst file directly.
+
+    Returns
+    -------
+    pl.LazyFrame
+        The Polars LazyFrame of the data in the .hst file. Note that the contents are
+        all in FP32 since the .hst files don't contain enough precision for FP64.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if the .hst files doesn't have the proper header. Namely it checks that
+        the first line is '# Athena++ history data\n' as a quick indicator if this is
+        the proper file type.
+    """
+    logger = setup_pt_logger()
+
+    # ===== Get the column names =====
+    column_names = _get_hst_column_names(hst_path)
+
+    # ===== Check the cache =====
+    cache_path = _get_hst_cache_path(hst_path)
+    cache_key = _get_hst_cache_key(hst_path)
+    if use_cache and _is_hst_cache_valid(cache_path, cache_key):
+        return pl.scan_parquet(cache_path)
+
+    # ===== Parse the data and remove the data duplicated by restarts =====
+    hst_lf = _scan_ascii_table(hst_path, column_names).filter(
+        _remove_restart_overlaps_expr("time")
+    )
+
+    if not use_cache:
+        return hst_lf
+
+    # ===== Save the cache =====
+    # Written to a temporary file and moved into place so that a reader never sees a
+    # partially written cache
+    temp_path = cache_path.with_name(f".{cache_path.name}.{os.getpid()}.tmp")
+    try:
+        hst_lf.sink_parquet(temp_path, metadata=cache_key)
+        temp_path.replace(cache_path)
+    except OSError:
+        temp_path.unlink(missing_ok=True)
+        logger.warning("Could not write the .hst cache to %s", cache_path)
+        return hst_lf
+
+    return pl.scan_parquet(cache_path)
+
+
+def load_hst_file(
+    hst_path: Path, columns: list[str] | None = None, *, use_cache: bool = True
+) -> pl.DataFrame:
+    r"""Load the contents of a .hst files as a Polars dataframe.
+
+    Automatically corrects for any overlap due to restarts by only accepting the
+    newest/latest data. This is `scan_hst` followed by selecting the columns and
+    collecting, see it for the details of the cache.
+
+    Parameters
+    ----------
+    hst_path : Path
+        The path to the .hst file
+    columns : list[str] | None, optional
+        The columns to load, by default None which loads all the columns. Without a
+        cache only these columns and the time column are parsed.
+    use_cache : bool, optional
+        Whether to read and write the parquet cache, by default True
+
+    Returns
+    -------
+    pl.DataFrame
+        The Polars dataframe that contains the data from the .hst file. Note that the
+        contents are all in FP32 since the .hst files don't contain enough precision for
+        FP64.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if the .hst files doesn't have the proper header. Namely it checks that
+        the first line is '# Athena++ history data\n' as a quick indicator if this is
+        the proper file type.
+    ValueError
+        Raised if one of the requested columns isn't in the .hst file.
+    """
+    hst_lf = scan_hst(hst_path, use_cache=use_cache)
+
+    # ===== Select the columns =====
+    column_names = hst_lf.collect_schema().names()
+    if columns is None:
+        columns = column_names
+    for column in columns:
+        if column not in column_names:
+            msg = f"{column} is not a column in {hst_path}."
+            raise ValueError(msg)
+
+    return hst_lf.select(columns).collect()
+
+
+def _get_hst_time_range(hst_path: Path) -> tuple[float, float, int]:
+    """Get the time range and number of rows of a .hst file.
+
+    Parameters
+    ----------
+    hst_path : Path
+        The path to the .hst file
+
+    Returns
+    -------
+    tuple[float, float, int]
+        The minimum time, maximum time, and the number of rows.
+    """
+    time_range = (
+        scan_hst(hst_path)
+        .select(
+            pl.col("time").min().alias("min"),
+            pl.col("time").max().alias("max"),
+            pl.len(),
+        )
+        .collect()
+        .row(0)
+    )
+    return float(time_range[0]), float(time_range[1]), int(time_range[2])
+
+
+def _interpolate_hst_file(
+    hst_path: Path, columns: list[str], time_grid: np.ndarray
+) -> pl.DataFrame:
+    """Load a .hst file and linearly interpolate its columns onto a time grid.
+
+    Times in the grid outside of the time range of the file are NaN rather than
+    extrapolated.
+
+    Parameters
+    ----------
+    hst_path : Path
+        The path to the .hst file
+    columns : list[str]
+        The columns to interpolate, not including the time column
+    time_grid : np.ndarray
+        The times to interpolate to
+
+    Returns
+    -------
+    pl.DataFrame
+        The time column and the interpolated columns in FP32.
+    """
+    hst_df = load_hst_file(hst_path, ["time", *columns])
+    time = hst_df["time"].to_numpy()
+    return pl.DataFrame(
+        {
+            "time": time_grid.astype(np.float32),
+            **{
+                column: np.interp(
+                    time_grid,
+                    time,
+                    hst_df[column].to_numpy(),
+                    left=np.nan,
+                    right=np.nan,
+                ).astype(np.float32)
+                for column in columns
+            },
+        }
+    )
+
+
+def load_hst_runs(
+    runs: dict[str, Path],
+    columns: list[str] | None = None,
+    *,
+    time_grid: np.ndarray | None = None,
+    num_times: int | None = None,
+    num_processes: int = 1,
+) -> pl.DataFrame:
+    """Load several .hst files and align them onto a common time grid.
+
+    The files are loaded in parallel with a process pool and each one is linearly
+    interpolated onto the same times. Each process only returns the interpolated
+    columns so the memory used scales with the size of the time grid, not the size of
+    the .hst files. The files are loaded with `load_hst_file` so the parquet caches are
+    used and created.
+
+    Parameters
+    ----------
+    runs : dict[str, Path]
+        The name of each run and the path to its .hst file
+    columns : list[str] | None, optional
+        The columns to load, by default None which loads all the columns of the first
+        run. The time column is always included.
+    time_grid : np.ndarray | None, optional
+        The times to interpolate to, by default None. If None then a uniformly spaced
+        grid over the time range covered by all of the runs is used. Times outside of
+        the time range of a run are NaN for that run, they are not extrapolated.
+    num_times : int | None, optional
+        The number of points in the default time grid, by default None which uses the
+        largest number of rows in any of the runs. Ignored if `time_grid` is given.
+    num_processes : int, optional
+        The number of processes to use, by default 1
+
+    Returns
+    -------
+    pl.DataFrame
+        The data in long format with a 'run' column containing the name of the run
+        followed by the time and the requested columns. Runs are in the same order as
+        `runs`.
+
+    Raises
+    ------
+    ValueError
+        Raised if the runs don't have any overlap in time.
+    """
+    names = list(runs)
+    paths = [runs[name] for name in names]
+
+    # Determine which columns to interpolate
+    if columns is None:
+        columns = _get_hst_column_names(paths[0])
+    columns = [column for column in columns if column != "time"]
+
+    with process_pool(num_processes) as executor:
+        # Determine the time grid from the range common to all the runs
+        if time_grid is None:
+            time_ranges = list(
+                executor.map(
+                    _get_hst_time_range,
+                    paths,
+                    chunksize=get_batch_size(len(paths), num_processes),
+                )
+            )
+            start = max(time_range[0] for time_range in time_ranges)
+            stop = min(time_range[1] for time_range in time_ranges)
+            if start > stop:
+                msg = "The .hst files do not overlap in time."
+                raise ValueError(msg)
+            if num_times is None:
+                num_times = max(time_range[2] for time_range in time_ranges)
+            time_grid = np.linspace(start, stop, num_times)
+
+        # Load and interpolate each run
+        futures = [
+            executor.submit(_interpolate_hst_file, path, columns, time_grid)
+            for path in paths
+        ]
+        run_dfs = [
+            future.result().insert_column(0, pl.lit(name).alias("run"))
+            for name, future in zip(names, futures, strict=True)
+        ]
+
+    return pl.concat(run_dfs)
+
+
+class HistoryFollower:
+    """Incrementally load a .hst file that is still being written to.
+
+    Each call to `update` only parses the complete lines that were appended since the
+    previous call and applies the restart overlap correction to the new rows, so
+    refreshing the data costs O(new rows) instead of O(file). If the file shrinks,
+    e.g. because it was replaced, it is reloaded from the beginning.
+
+    Parameters
+    ----------
+    hst_path : Path
+        The path to the .hst file
+    columns : list[str] | None, optional
+        The columns to load, by default None which loads all the columns.
+
+    Raises
+    ------
+    ValueError
+        Raised if one of the requested columns isn't in the .hst file.
+    """
+
+    def __init__(self, hst_path: Path, columns: list[str] | None = None) -> None:
+        """Initialize a HistoryFollower object. Doesn't load any data."""
+        self.__hst_path = hst_path
+        self.__column_names = _get_hst_column_names(hst_path)
+        if columns is None:
+            columns = self.__column_names
+        for column in columns:
+            if column not in self.__column_names:
+                msg = f"{column} is not a column in {hst_path}."
+                raise ValueError(msg)
+        self.__columns = columns
+        # The time column is always kept since it's needed to handle restarts
+        self.__kept_columns = [
+            name
+            for name in self.__column_names
+            if name in self.__columns or name == "time"
+        ]
+        self.__reset()
+
+    def __reset(self) -> None:
+        """Forget all the data that has been loaded."""
+        self.__offset = 0
+        self.__data = pl.DataFrame(
+            schema=dict.fromkeys(self.__kept_columns, pl.Float32)
+        )
+
+    def update(self) -> pl.DataFrame:
+        """Load any new data in the .hst file and return all of the data.
+
+        Returns
+        -------
+        pl.DataFrame
+            The data from the .hst file with the restart overlaps removed. Note that
+            the contents are all in FP32, see `load_hst_file`.
+        """
+        with self.__hst_path.open("rb") as hst_file:
+            # Start over if the file was truncated or replaced
+            if hst_file.seek(0, 2) < self.__offset:
+                self.__reset()
+            hst_file.seek(self.__offset)
+            new_bytes = hst_file.read()
+
+        # Only parse complete lines, a partial line is picked up on the next update
+        new_bytes = new_bytes[: new_bytes.rfind(b"\n") + 1]
+        if len(new_bytes) == 0:
+            return self.data
+        self.__offset += len(new_bytes)
+
+        # Parse the new lines and remove the overlaps within them
+        new_data = (
+            _scan_ascii_table(new_bytes, self.__column_names)
+            .select(self.__kept_columns)
+            .filter(_remove_restart_overlaps_expr("time"))
+            .collect()
+        )
+
+        # Remove old rows that were overwritten by a restart in the new lines
+        if len(new_data) > 0:
+            new_min_time = new_data.select(
+                pl.col("time").fill_nan(float("inf")).min()
+            ).item()
+            self.__data = pl.concat(
+                [self.__data.filter(pl.col("time") < new_min_time), new_data]
+            )
+
+        return self.data
+
+    @property
+    def data(self) -> pl.DataFrame:
+        """The data that has been loaded so far.
 
-    # ===== Load data =====
-    hst_arr = np.loadtxt(hst_path, dtype=np.float32)
+        Returns
+        -------
+        pl.DataFrame
+            The data from the .hst file.
+        """
+        return self.__data.select(self.__columns)
 
-    # ===== Look for restarts and remove the duplicated data via masking =====
-    time_idx = column_names.index("time")
-    hst_arr = _remove_restart_overlaps(hst_arr, time_idx)
+    @property
+    def offset(self) -> int:
+        """The byte offset of the end of the data that has been loaded.
 
-    # ===== Convert to Polars dataframe =====
-    return pl.from_numpy(hst_arr, column_names)
+        Returns
+        -------
+        int
+            The byte offset.
+        """
+        return self.__offset
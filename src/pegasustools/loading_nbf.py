@@ -2,17 +2,68 @@
 
 This module provides:
 - PegasusNBFData: A class for holding the data loaded from a NBF file
+- PegasusNBFSeries: A class for lazily accessing a time series of NBF files
 - _load_nbf: A function for loading NBF files
 """
 
+import collections
+import concurrent.futures
+import functools
 import struct
+from collections.abc import Callable, Iterator, Mapping
 from pathlib import Path
-from typing import BinaryIO
+from typing import Any, BinaryIO
 
 import numpy as np
+import polars as pl
 
+from .catalog import catalog_directory
 from .pt_logging import setup_pt_logger
 
+# The layout of the 12 element header at the start of every meshblock
+_MESHBLOCK_HEADER_DTYPE = np.dtype(
+    [
+        ("x1_block_coord", np.int32),
+        ("x2_block_coord", np.int32),
+        ("x3_block_coord", np.int32),
+        ("x1_block_size", np.int32),
+        ("x1min", np.float32),
+        ("x1max", np.float32),
+        ("x2_block_size", np.int32),
+        ("x2min", np.float32),
+        ("x2max", np.float32),
+        ("x3_block_size", np.int32),
+        ("x3min", np.float32),
+        ("x3max", np.float32),
+    ]
+)
+
+
+class _LazyNBFFields(Mapping[str, np.typing.NDArray[np.float32]]):
+    """Read only mapping that assembles each field the first time it is accessed."""
+
+    def __init__(
+        self,
+        keys: list[str],
+        loader: Callable[[str], np.typing.NDArray[np.float32]],
+    ) -> None:
+        self.__keys = keys
+        self.__loader = loader
+        self.__cache: dict[str, np.typing.NDArray[np.float32]] = {}
+
+    def __getitem__(self, key: str) -> np.typing.NDArray[np.float32]:
+        if key not in self.__cache:
+            if key not in self.__keys:
+                raise KeyError(key)
+            self.__cache[key] = self.__loader(key)
+        return self.__cache[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__keys)
+
+    def __len__(self) -> int:
+        return len(self.__keys)
+
 
 class PegasusNBFData:
     """Holds all the data loaded when loading a NBF file.
@@ -20,21 +71,77 @@ class PegasusNBFData:
     It stores all the header data into private variables that are accessible via getters
     and stores the data arrays in a dictionary named `data` which is indexed via the
     variable field names in the NBF file.
+
+    If the file is opened with `mmap=True` then the file is memory mapped instead of
+    read and `data` becomes a read only mapping that only assembles a field the first
+    time it is accessed. Use `load_subvolume` to read part of a field without
+    assembling the whole thing.
+
+    The `fields` and `region` arguments restrict `data` to a subset of the variables
+    and a sub-box of the mesh. Only the meshblocks that intersect the region and only
+    the requested variables within them are read from the file.
     """
 
-    def __init__(self, file_path: Path) -> None:
+    def __init__(
+        self,
+        file_path: Path,
+        *,
+        mmap: bool = False,
+        fields: list[str] | None = None,
+        region: tuple[tuple[int, int], tuple[int, int], tuple[int, int]] | None = None,
+        num_workers: int = 1,
+    ) -> None:
         """Initialize a PegasusNBFData object from the NBF file at `file_path`.
 
         Parameters
         ----------
         file_path : Path
             The path to the NBF files to load
+        mmap : bool, optional
+            If True then memory map the file and only read each field when it is first
+            accessed, by default False
+        fields : list[str] | None, optional
+            The variables to load, by default None which loads every variable in the
+            file. An empty list only loads the header.
+        region : tuple[tuple[int, int], ...] | None, optional
+            The region of the mesh to load given as ((x1_start, x1_stop), (x2_start,
+            x2_stop), (x3_start, x3_stop)) in global cell indices with exclusive stops,
+            by default None which loads the entire mesh.
+        num_workers : int, optional
+            The number of threads used to read meshblocks concurrently, by default 1.
+            Each thread reads a contiguous range of meshblocks through its own file
+            handle. Ignored when `mmap` is True.
+
+        Raises
+        ------
+        ValueError
+            Raised if one of the `fields` is not in the file or if `region` is not
+            contained within the mesh.
         """
+        self.data: Mapping[str, np.typing.NDArray[np.float32]]
+        self.__meshblocks: np.memmap | None = None
+
         # Open the file
         with file_path.open(mode="rb") as nbf_file:
             # Read the header
             self.__load_nbf_header(nbf_file)
 
+            # Determine which fields and what part of the mesh to load
+            if fields is None:
+                fields = self.list_of_variables
+            for key in fields:
+                if key not in self.list_of_variables:
+                    msg = f"{key} is not a variable in {file_path}."
+                    raise ValueError(msg)
+            if region is None:
+                region = (
+                    (0, int(self.mesh_params["nx1"])),
+                    (0, int(self.mesh_params["nx2"])),
+                    (0, int(self.mesh_params["nx3"])),
+                )
+            self.__region = self.__validate_region(region)
+            starts, stops = self.__region
+
             # Compute the required byte offsets and sizes needed to make each iteration
             # independent
 
@@ -58,31 +165,47 @@ class PegasusNBFData:
                 )
             )
 
-            # Setup nbf_data.data member. Note that by the end of the reading these axis
-            # will be swapped to x1, x2, x3
-            self.data: dict[str, np.typing.NDArray[np.float32]] = {}
-            data_shape: tuple[int, int, int] = (
-                int(self.mesh_params["nx3"]),
-                int(self.mesh_params["nx2"]),
-                int(self.mesh_params["nx1"]),
-            )
-            for key in self.list_of_variables:
-                self.data[key] = np.empty(data_shape, dtype=np.float32)
-
-            # loop over all meshblocks and read all variables
-            for meshblock_id in range(self.num_meshblocks):
-                self.__load_nbf_meshblock(
-                    nbf_file,
-                    meshblock_id * meshblock_size + header_size,
-                    meshblock_header_size,
-                )
+        # Every meshblock is a header followed by a (nvar, nx3, nx2, nx1) block of data
+        meshblock_dtype = np.dtype(
+            [
+                ("header", _MESHBLOCK_HEADER_DTYPE),
+                (
+                    "data",
+                    np.float32,
+                    (
+                        self.num_variables,
+                        self.meshblock_params["nx3"],
+                        self.meshblock_params["nx2"],
+                        self.meshblock_params["nx1"],
+                    ),
+                ),
+            ]
+        )
 
-        # Swap axis so the data is formatted as (Nx1, Nx2, Nx3) and remove dimensions of
-        # length 1.
-        # Moving this into _load_nbf_meshblock causes a 30% slowdown
-        for key in self.data:
-            self.data[key] = np.swapaxes(self.data[key], 0, 2)
-            self.data[key] = np.squeeze(self.data[key])
+        if mmap:
+            # Map every meshblock. Nothing beyond the meshblock headers is read until a
+            # field is requested.
+            self.__meshblocks = np.memmap(
+                file_path,
+                dtype=meshblock_dtype,
+                mode="r",
+                offset=header_size,
+                shape=(self.num_meshblocks,),
+            )
+            self.__meshblock_headers = np.array(self.__meshblocks["header"])
+            self.data = _LazyNBFFields(
+                fields, lambda key: self.__assemble_field(key, starts, stops)
+            )
+        else:
+            self.data = self.__load_nbf_data(
+                file_path,
+                fields,
+                header_size,
+                meshblock_size,
+                meshblock_header_size,
+                meshblock_dtype,
+                num_workers,
+            )
 
         # Log the metadata from the NBF file
         logger = setup_pt_logger()
@@ -96,7 +219,156 @@ class PegasusNBFData:
             f"mesh_params       = {self.mesh_params}\n"
             f"meshblock_params  = {self.meshblock_params}\n"
         )
-        logger.info(message)
+        logger.debug(message)
+
+    def load_subvolume(
+        self,
+        key: str,
+        region: tuple[tuple[int, int], tuple[int, int], tuple[int, int]],
+    ) -> np.typing.NDArray[np.float32]:
+        """Load part of a single field.
+
+        When the file was opened with `mmap=True` only the meshblocks that intersect
+        the region are read from disk. Otherwise the region must be within the region
+        that was loaded when the file was opened.
+
+        Parameters
+        ----------
+        key : str
+            The name of the field to load
+        region : tuple[tuple[int, int], tuple[int, int], tuple[int, int]]
+            The region to load given as ((x1_start, x1_stop), (x2_start, x2_stop),
+            (x3_start, x3_stop)) in global cell indices. The stop indices are exclusive.
+
+        Returns
+        -------
+        np.typing.NDArray[np.float32]
+            The requested part of the field formatted as (Nx1, Nx2, Nx3) with dimensions
+            of length 1 removed.
+
+        Raises
+        ------
+        KeyError
+            Raised if `key` is not one of the variables in the file, or was not loaded
+            when the file isn't memory mapped.
+        ValueError
+            Raised if the region is not within the mesh, or not within the loaded region
+            when the file isn't memory mapped.
+        """
+        if key not in self.list_of_variables:
+            raise KeyError(key)
+
+        starts, stops = self.__validate_region(region)
+
+        if self.__meshblocks is None:
+            # The data is already in memory so we slice it directly
+            loaded_starts, loaded_stops = self.__region
+            for start, stop, loaded_start, loaded_stop in zip(
+                starts, stops, loaded_starts, loaded_stops, strict=True
+            ):
+                if start < loaded_start or stop > loaded_stop:
+                    msg = (
+                        f"The region {region} is not contained within the loaded "
+                        f"region {self.region}."
+                    )
+                    raise ValueError(msg)
+
+            # Restore any dimensions of length 1 that were squeezed out. Using order="A"
+            # keeps this a view
+            loaded_shape = tuple(
+                stop - start
+                for start, stop in zip(loaded_starts, loaded_stops, strict=True)
+            )
+            field = self.data[key].reshape(loaded_shape, order="A")
+            subvolume = field[
+                starts[0] - loaded_starts[0] : stops[0] - loaded_starts[0],
+                starts[1] - loaded_starts[1] : stops[1] - loaded_starts[1],
+                starts[2] - loaded_starts[2] : stops[2] - loaded_starts[2],
+            ]
+            return np.squeeze(subvolume)
+
+        return self.__assemble_field(key, starts, stops)
+
+    def __validate_region(
+        self, region: tuple[tuple[int, int], tuple[int, int], tuple[int, int]]
+    ) -> tuple[tuple[int, int, int], tuple[int, int, int]]:
+        mesh_shape = (
+            int(self.mesh_params["nx1"]),
+            int(self.mesh_params["nx2"]),
+            int(self.mesh_params["nx3"]),
+        )
+        num_dims = 3
+        if len(region) != num_dims:
+            msg = f"The region {region} must have one (start, stop) pair per dimension."
+            raise ValueError(msg)
+
+        for (start, stop), size in zip(region, mesh_shape, strict=True):
+            if not 0 <= start < stop <= size:
+                msg = (
+                    f"The region {region} is not contained within the mesh of size "
+                    f"{mesh_shape}."
+                )
+                raise ValueError(msg)
+
+        starts = (int(region[0][0]), int(region[1][0]), int(region[2][0]))
+        stops = (int(region[0][1]), int(region[1][1]), int(region[2][1]))
+        return starts, stops
+
+    def __assemble_field(
+        self,
+        key: str,
+        starts: tuple[int, int, int],
+        stops: tuple[int, int, int],
+    ) -> np.typing.NDArray[np.float32]:
+        # Assemble a field, or part of one, from the memory mapped meshblocks
+        assert self.__meshblocks is not None  # noqa: S101
+        var_idx = self.list_of_variables.index(key)
+        headers = self.__meshblock_headers
+
+        # The global index range of each meshblock
+        i_start = headers["x1_block_coord"] * self.meshblock_params["nx1"]
+        j_start = headers["x2_block_coord"] * self.meshblock_params["nx2"]
+        k_start = headers["x3_block_coord"] * self.meshblock_params["nx3"]
+        i_end = i_start + headers["x1_block_size"]
+        j_end = j_start + headers["x2_block_size"]
+        k_end = k_start + headers["x3_block_size"]
+
+        # Find the meshblocks that intersect the region
+        intersecting = np.flatnonzero(
+            (i_start < stops[0])
+            & (i_end > starts[0])
+            & (j_start < stops[1])
+            & (j_end > starts[1])
+            & (k_start < stops[2])
+            & (k_end > starts[2])
+        )
+
+        field = np.empty(
+            (stops[2] - starts[2], stops[1] - starts[1], stops[0] - starts[0]),
+            dtype=np.float32,
+        )
+        blocks = self.__meshblocks["data"]
+        for mb in intersecting:
+            # Clip the meshblock to the region in global indices
+            i_lo, i_hi = max(i_start[mb], starts[0]), min(i_end[mb], stops[0])
+            j_lo, j_hi = max(j_start[mb], starts[1]), min(j_end[mb], stops[1])
+            k_lo, k_hi = max(k_start[mb], starts[2]), min(k_end[mb], stops[2])
+
+            field[
+                k_lo - starts[2] : k_hi - starts[2],
+                j_lo - starts[1] : j_hi - starts[1],
+                i_lo - starts[0] : i_hi - starts[0],
+            ] = blocks[
+                mb,
+                var_idx,
+                k_lo - k_start[mb] : k_hi - k_start[mb],
+                j_lo - j_start[mb] : j_hi - j_start[mb],
+                i_lo - i_start[mb] : i_hi - i_start[mb],
+            ]
+
+        # Swap axis so the data is formatted as (Nx1, Nx2, Nx3) and remove dimensions of
+        # length 1.
+        return np.squeeze(np.swapaxes(field, 0, 2))
 
     def __load_nbf_header(self, nbf_file: BinaryIO) -> None:
         # Load the header lines and verify it's an NBF file
@@ -148,11 +420,163 @@ class PegasusNBFData:
             key, value = element.split("=")
             self.__meshblock_params[key] = int(value)
 
+    def __load_nbf_data(
+        self,
+        file_path: Path,
+        fields: list[str],
+        header_size: int,
+        meshblock_size: int,
+        meshblock_header_size: int,
+        meshblock_dtype: np.dtype[np.void],
+        num_workers: int,
+    ) -> dict[str, np.typing.NDArray[np.float32]]:
+        starts, stops = self.__region
+        mesh_shape = (
+            int(self.mesh_params["nx1"]),
+            int(self.mesh_params["nx2"]),
+            int(self.mesh_params["nx3"]),
+        )
+        load_everything = set(fields) == set(self.list_of_variables) and (
+            starts == (0, 0, 0) and stops == mesh_shape
+        )
+
+        # Setup the arrays to load into. Note that these are all (x3, x2, x1) and will
+        # be transposed to (x1, x2, x3) at the end
+        data_shape = (
+            stops[2] - starts[2],
+            stops[1] - starts[1],
+            stops[0] - starts[0],
+        )
+        if load_everything:
+            # All variables go into one array so every meshblock can be scattered
+            # with a single assignment
+            all_data = np.empty((self.num_variables, *data_shape), dtype=np.float32)
+            data = {key: all_data[self.list_of_variables.index(key)] for key in fields}
+        else:
+            data = {key: np.empty(data_shape, dtype=np.float32) for key in fields}
+
+        if len(fields) > 0:
+            # Split the meshblocks into one contiguous range per worker. The offset of
+            # every meshblock is known from the header so the ranges are independent
+            meshblock_ranges = [
+                ids
+                for ids in np.array_split(
+                    np.arange(self.num_meshblocks), max(num_workers, 1)
+                )
+                if ids.size > 0
+            ]
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(meshblock_ranges)
+            ) as executor:
+                if load_everything:
+                    futures = [
+                        executor.submit(
+                            self.__scatter_nbf_meshblocks,
+                            file_path,
+                            int(ids[0]) * meshblock_size + header_size,
+                            ids.size,
+                            meshblock_dtype,
+                            all_data,
+                        )
+                        for ids in meshblock_ranges
+                    ]
+                else:
+                    futures = [
+                        executor.submit(
+                            self.__load_nbf_meshblocks,
+                            file_path,
+                            data,
+                            ids * meshblock_size + header_size,
+                            meshblock_header_size,
+                        )
+                        for ids in meshblock_ranges
+                    ]
+                # Check for errors
+                _ = [future.result() for future in futures]
+
+        # Transpose so the data is formatted as (Nx1, Nx2, Nx3) and remove dimensions
+        # of length 1. Both of these return views so the data is not copied
+        return {key: np.squeeze(field.transpose()) for key, field in data.items()}
+
+    def __scatter_nbf_meshblocks(
+        self,
+        file_path: Path,
+        starting_offset: int,
+        num_meshblocks: int,
+        meshblock_dtype: np.dtype[np.void],
+        all_data: np.typing.NDArray[np.float32],
+    ) -> None:
+        # Load a contiguous range of complete meshblocks in large batches. Each batch
+        # is read with a single call, all of its meshblock headers are parsed at once
+        # via the structured dtype, and the data is scattered into all_data with one
+        # fancy indexing assignment
+        nx1 = self.meshblock_params["nx1"]
+        nx2 = self.meshblock_params["nx2"]
+        nx3 = self.meshblock_params["nx3"]
+        num_variables = all_data.shape[0]
+
+        # View all_data as (nvar, nblocks3, nx3, nblocks2, nx2, nblocks1, nx1) and
+        # reorder the axes so that the block coordinates come first
+        blocked_view = all_data.reshape(
+            num_variables,
+            all_data.shape[1] // nx3,
+            nx3,
+            all_data.shape[2] // nx2,
+            nx2,
+            all_data.shape[3] // nx1,
+            nx1,
+        ).transpose(1, 3, 5, 0, 2, 4, 6)
+
+        batch_bytes = 64 * 2**20
+        batch_size = max(1, batch_bytes // meshblock_dtype.itemsize)
+        buffer = np.empty(
+            min(batch_size, num_meshblocks) * meshblock_dtype.itemsize, dtype=np.uint8
+        )
+        with file_path.open(mode="rb") as nbf_file:
+            nbf_file.seek(starting_offset)
+            for batch_start in range(0, num_meshblocks, batch_size):
+                count = min(batch_size, num_meshblocks - batch_start)
+                batch_buffer = buffer[: count * meshblock_dtype.itemsize]
+                if nbf_file.readinto(batch_buffer) != batch_buffer.nbytes:
+                    msg = f"{nbf_file.name} is truncated."
+                    raise OSError(msg)
+
+                meshblocks = np.frombuffer(batch_buffer, dtype=meshblock_dtype)
+                headers = meshblocks["header"]
+                blocked_view[
+                    headers["x3_block_coord"],
+                    headers["x2_block_coord"],
+                    headers["x1_block_coord"],
+                ] = meshblocks["data"]
+
+    def __load_nbf_meshblocks(
+        self,
+        file_path: Path,
+        data: dict[str, np.typing.NDArray[np.float32]],
+        starting_offsets: np.typing.NDArray[np.int64],
+        meshblock_header_size: int,
+    ) -> None:
+        # Load a range of meshblocks with a dedicated file handle and a scratch buffer
+        # that is reused for every read
+        scratch = np.empty(
+            self.meshblock_params["nx1"]
+            * self.meshblock_params["nx2"]
+            * self.meshblock_params["nx3"],
+            dtype=np.float32,
+        )
+        with file_path.open(mode="rb") as nbf_file:
+            for starting_offset in starting_offsets:
+                self.__load_nbf_meshblock(
+                    nbf_file, data, int(starting_offset), meshblock_header_size, scratch
+                )
+
     def __load_nbf_meshblock(
         self,
         nbf_file: BinaryIO,
+        data: dict[str, np.typing.NDArray[np.float32]],
         starting_offset: int,
         meshblock_header_size: int,
+        scratch: np.typing.NDArray[np.float32],
     ) -> None:
         nbf_file.seek(starting_offset)
         # Load the meshblock header, discarding values we don't need
@@ -171,7 +595,7 @@ class PegasusNBFData:
             _,
         ) = struct.unpack("@4i2fi2fi2f", nbf_file.read(meshblock_header_size))
 
-        # Compute the indices to write to
+        # Compute the indices of the meshblock
         i_start = x1_block_coord * self.meshblock_params["nx1"]
         i_end = i_start + x1_block_size
         j_start = x2_block_coord * self.meshblock_params["nx2"]
@@ -179,20 +603,40 @@ class PegasusNBFData:
         k_start = x3_block_coord * self.meshblock_params["nx3"]
         k_end = k_start + x3_block_size
 
+        # Clip the meshblock to the loaded region and skip it if they don't intersect
+        starts, stops = self.__region
+        i_lo, i_hi = max(i_start, starts[0]), min(i_end, stops[0])
+        j_lo, j_hi = max(j_start, starts[1]), min(j_end, stops[1])
+        k_lo, k_hi = max(k_start, starts[2]), min(k_end, stops[2])
+        if i_lo >= i_hi or j_lo >= j_hi or k_lo >= k_hi:
+            return
+
+        # Each variable is stored contiguously as (nx3, nx2, nx1) so we only need to
+        # read the x3 slices that are in the region
+        element_width = 4
         block_size = x1_block_size * x2_block_size * x3_block_size
-
-        data = np.fromfile(
-            nbf_file, dtype=np.float32, count=block_size * self.num_variables, offset=0
-        )
-        data = data.reshape(
-            self.num_variables, x3_block_size, x2_block_size, x1_block_size
-        )
-
-        for nv in range(self.num_variables):
-            field_key = self.list_of_variables[nv]
-
-            self.data[field_key][k_start:k_end, j_start:j_end, i_start:i_end] = data[
-                nv, :, :, :
+        slice_size = x1_block_size * x2_block_size
+        data_offset = starting_offset + meshblock_header_size
+
+        for field_key, field in data.items():
+            nv = self.list_of_variables.index(field_key)
+            nbf_file.seek(
+                data_offset
+                + element_width * (nv * block_size + (k_lo - k_start) * slice_size)
+            )
+            # Read straight into the scratch buffer, this releases the GIL
+            slab = scratch[: (k_hi - k_lo) * slice_size]
+            if nbf_file.readinto(slab) != slab.nbytes:  # type: ignore[attr-defined]
+                msg = f"{nbf_file.name} is truncated."
+                raise OSError(msg)
+            slab = slab.reshape(k_hi - k_lo, x2_block_size, x1_block_size)
+
+            field[
+                k_lo - starts[2] : k_hi - starts[2],
+                j_lo - starts[1] : j_hi - starts[1],
+                i_lo - starts[0] : i_hi - starts[0],
+            ] = slab[
+                :, j_lo - j_start : j_hi - j_start, i_lo - i_start : i_hi - i_start
             ]
 
     # Define getters for header variables
@@ -273,3 +717,230 @@ class PegasusNBFData:
             The mesh block parameters in the NBF file.
         """
         return self.__meshblock_params
+
+    @property
+    def region(self) -> tuple[tuple[int, int], tuple[int, int], tuple[int, int]]:
+        """Get the region of the mesh that was loaded.
+
+        Returns
+        -------
+        tuple[tuple[int, int], tuple[int, int], tuple[int, int]]
+            The loaded region as ((x1_start, x1_stop), (x2_start, x2_stop), (x3_start,
+            x3_stop)) in global cell indices. The stop indices are exclusive.
+        """
+        starts, stops = self.__region
+        return (
+            (starts[0], stops[0]),
+            (starts[1], stops[1]),
+            (starts[2], stops[2]),
+        )
+
+
+class PegasusNBFSeries:
+    """A time series of NBF files that are only read when they are needed.
+
+    All the NBF files in a directory are indexed once from their headers. The headers
+    are taken from the directory's catalog, see `catalog_directory`, so reopening a
+    series only reads the headers of files that are new or have changed.
+    Each field can then be accessed as a lazy (time, x1, x2, x3) array via `field`,
+    which reads snapshots on demand and keeps the most recently used ones in a cache.
+    `iter_snapshots` iterates through the files while a background thread reads ahead.
+    """
+
+    def __init__(
+        self, directory: Path, pattern: str = "*.nbf", cache_size: int = 8
+    ) -> None:
+        """Initialize a PegasusNBFSeries by indexing the NBF files in a directory.
+
+        Parameters
+        ----------
+        directory : Path
+            The directory that contains the NBF files
+        pattern : str, optional
+            The glob pattern used to find the NBF files, by default "*.nbf"
+        cache_size : int, optional
+            The maximum number of fields from individual snapshots to keep in memory,
+            by default 8
+
+        Raises
+        ------
+        FileNotFoundError
+            Raised if no files matching the pattern are found.
+        """
+        paths = sorted(directory.glob(pattern))
+        if len(paths) == 0:
+            msg = f"No files matching {pattern} found in {directory}"
+            raise FileNotFoundError(msg)
+
+        # Index every file from the catalog. Files that aren't in it, e.g. because
+        # they're in a subdirectory, are indexed by reading only their header
+        catalog = {
+            entry["path"]: entry
+            for entry in catalog_directory(directory)
+            .filter(
+                pl.col("file_type") == "nbf", pl.col("num_meshblocks").is_not_null()
+            )
+            .iter_rows(named=True)
+        }
+        rows = []
+        for path in paths:
+            entry = catalog.get(path.relative_to(directory).as_posix())
+            if entry is not None:
+                nx1, nx2, nx3 = entry["shape"]
+                row = {
+                    "time": entry["time"],
+                    "num_meshblocks": entry["num_meshblocks"],
+                    "list_of_variables": entry["variables"],
+                }
+            else:
+                header = PegasusNBFData(path, fields=[])
+                nx1, nx2, nx3 = (int(header.mesh_params[f"nx{i}"]) for i in (1, 2, 3))
+                row = {
+                    "time": float(header.time),
+                    "num_meshblocks": header.num_meshblocks,
+                    "list_of_variables": header.list_of_variables,
+                }
+            rows.append({"path": str(path), **row, "nx1": nx1, "nx2": nx2, "nx3": nx3})
+        self.__index = pl.DataFrame(rows).sort("time")
+        self.__paths = [Path(path) for path in self.__index["path"]]
+
+        self.__read_field = functools.lru_cache(maxsize=cache_size)(
+            self.__read_field_uncached
+        )
+
+    @property
+    def index(self) -> pl.DataFrame:
+        """Get the index of the NBF files.
+
+        Returns
+        -------
+        pl.DataFrame
+            One row per file, sorted by time. Keys are path, time, num_meshblocks,
+            list_of_variables, nx1, nx2, and nx3.
+        """
+        return self.__index
+
+    @property
+    def times(self) -> np.typing.NDArray[np.float64]:
+        """Get the simulation time of each file.
+
+        Returns
+        -------
+        np.typing.NDArray[np.float64]
+            The sorted times of the files in the series.
+        """
+        return self.__index["time"].to_numpy()
+
+    def __len__(self) -> int:
+        """Get the number of files in the series.
+
+        Returns
+        -------
+        int
+            The number of files in the series.
+        """
+        return len(self.__paths)
+
+    def field(self, key: str) -> "_NBFSeriesField":
+        """Get a lazy (time, x1, x2, x3) array of a single field.
+
+        Parameters
+        ----------
+        key : str
+            The name of the field
+
+        Returns
+        -------
+        _NBFSeriesField
+            An array-like object that reads snapshots when it is indexed. Indexing it
+            with only a time index returns the whole field at that time.
+
+        Raises
+        ------
+        KeyError
+            Raised if the field is not in every file of the series.
+        """
+        missing = self.__index.filter(~pl.col("list_of_variables").list.contains(key))
+        if len(missing) > 0:
+            raise KeyError(key)
+        return _NBFSeriesField(key, len(self), self.__read_field)
+
+    def iter_snapshots(
+        self, fields: list[str] | None = None, prefetch: int = 2
+    ) -> Iterator[PegasusNBFData]:
+        """Iterate through the snapshots in time order while reading ahead.
+
+        At most `prefetch` snapshots are read ahead of the one currently being used
+        so the memory used is bounded.
+
+        Parameters
+        ----------
+        fields : list[str] | None, optional
+            The fields to load, by default None which loads every field
+        prefetch : int, optional
+            The number of snapshots to read ahead in a background thread, by default 2
+
+        Yields
+        ------
+        PegasusNBFData
+            Each snapshot in time order.
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            pending: collections.deque[concurrent.futures.Future[PegasusNBFData]] = (
+                collections.deque()
+            )
+            for path in self.__paths:
+                pending.append(executor.submit(PegasusNBFData, path, fields=fields))
+                if len(pending) > prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def __read_field_uncached(
+        self, time_idx: int, key: str
+    ) -> np.typing.NDArray[np.float32]:
+        return PegasusNBFData(self.__paths[time_idx], fields=[key]).data[key]
+
+
+class _NBFSeriesField:
+    """A lazy (time, x1, x2, x3) array of one field from a PegasusNBFSeries."""
+
+    def __init__(
+        self,
+        key: str,
+        num_times: int,
+        reader: Callable[[int, str], np.typing.NDArray[np.float32]],
+    ) -> None:
+        self.__key = key
+        self.__num_times = num_times
+        self.__reader = reader
+
+    def __len__(self) -> int:
+        return self.__num_times
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        """Get the shape of the field, reading the first snapshot if needed.
+
+        Returns
+        -------
+        tuple[int, ...]
+            The shape as (time, x1, x2, x3) with spatial dimensions of length 1 removed.
+        """
+        return (self.__num_times, *self.__reader(0, self.__key).shape)
+
+    def __getitem__(self, index: Any) -> np.typing.NDArray[np.float32]:  # noqa: ANN401
+        # Split the time index from the spatial index
+        if not isinstance(index, tuple):
+            index = (index,)
+        time_index, spatial_index = index[0], index[1:]
+
+        # Indexing a range handles negative indices and raises on out of bounds ones
+        time_ids = np.arange(self.__num_times)[time_index]
+        if np.ndim(time_ids) == 0:
+            field = self.__reader(int(time_ids), self.__key)
+            return np.asarray(field[spatial_index])
+
+        return np.stack(
+            [self.__reader(int(i), self.__key)[spatial_index] for i in time_ids]
+        )
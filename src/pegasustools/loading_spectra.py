@@ -16,6 +16,11 @@ class PegasusSpectralData:
 
     Stores the time data in a private variable accessible via a getter and stores the
     spectra data in a numpy array named `data`
+
+    If a .spec file is opened with `mmap=True` then the file is memory mapped instead
+    of read and `data` is a read only `(num_meshblocks, n_prp, n_prl)` view of the
+    spectra in the file. Only the meshblock headers are read when the file is opened
+    and `reduce_spectra` reads the spectra a chunk of meshblocks at a time.
     """
 
     def __init__(
@@ -25,6 +30,8 @@ class PegasusSpectralData:
         n_prl: int = 400,
         max_w_prp: float = 4.0,
         max_w_prl: float = 4.0,
+        *,
+        mmap: bool = False,
     ) -> None:
         """Initialize a PegasusSpectralData class with the header data.
 
@@ -48,6 +55,9 @@ class PegasusSpectralData:
             The value of max_w_prl used in the peginput file, by default 4.0. This
             argument is ignored if the spectra file is in the new format that contains
             this information in the header.
+        mmap : bool, optional
+            If True then memory map .spec files instead of reading them, by default
+            False. Ignored for other types of spectra files, which are small.
 
         Raises
         ------
@@ -74,16 +84,19 @@ class PegasusSpectralData:
                 except UnicodeDecodeError:
                     spec_file.seek(reset_location)
                     break
+            data_offset = spec_file.tell()
 
-            # Load the entire remaining file
-            self.data = np.fromfile(spec_file, dtype=np.float64)
+            # Load the entire remaining file, .spec files are loaded once the header
+            # has been processed since they can be memory mapped
+            if file_path.suffix != ".spec":
+                self.data = np.fromfile(spec_file, dtype=np.float64)
 
         # Now that we have the data and the header we'll pass it off to routines for
         # spec files and for specav style files
         if file_path.suffix == ".spec":
             self.__file_type = "spec"
             self.__num_ions = 1
-            self.__process_spec_files(file_path, ascii_header)
+            self.__process_spec_files(file_path, ascii_header, data_offset, mmap=mmap)
         elif file_path.suffix in [
             ".specav",
             ".edotv_prl_av",
@@ -98,7 +111,14 @@ class PegasusSpectralData:
             msg = f"Error: {file_path} is not a spectra file."
             raise RuntimeError(msg)
 
-    def __process_spec_files(self, file_path: Path, ascii_header: list[str]) -> None:
+    def __process_spec_files(
+        self,
+        file_path: Path,
+        ascii_header: list[str],
+        data_offset: int,
+        *,
+        mmap: bool,
+    ) -> None:
         """Process .spec files.
 
         Parameters
@@ -107,6 +127,10 @@ class PegasusSpectralData:
             The path to the spec file
         ascii_header : list[str]
             The ascii header to the file.
+        data_offset : int
+            The offset, in bytes, of the meshblocks from the start of the file
+        mmap : bool
+            If True then memory map the meshblocks instead of reading them
 
         Raises
         ------
@@ -132,12 +156,15 @@ class PegasusSpectralData:
         # Get the info to reshape the array
         block_header_size = 6  # The header of each block is 6 elements
         num_row = self.__n_prl * self.__n_prp + block_header_size
-        num_col = self.data.size // num_row
+        num_elements = (file_path.stat().st_size - data_offset) // np.dtype(
+            np.float64
+        ).itemsize
+        num_col = num_elements // num_row
 
         # Check that the file is actually the right size for the number of elements
         # per spectra. Note that this check isn't perfect, it just verifies that the
         # file can be exactly divided by the number of elements provided.
-        if self.data.size % num_row != 0:
+        if num_elements % num_row != 0:
             err_msg = (
                 f"The file {file_path} does not have the right number of "
                 f"elements for the values of {self.__n_prl = } and "
@@ -145,16 +172,30 @@ class PegasusSpectralData:
             )
             raise ValueError(err_msg)
 
-        # Rearrange the data into the correct shape including the header for each
-        # meshblock
-        self.data = self.data.reshape((num_col, num_row))
-
-        # Slice off the header and main data
-        headers = self.data[:, :block_header_size]
-        self.data = self.data[:, block_header_size:]
-
-        # Reshape data now that the headers have been removed
-        self.data = self.data.reshape((num_col, self.__n_prp, self.__n_prl))
+        # Each meshblock is a header with its location followed by its spectra
+        meshblock_dtype = np.dtype(
+            [
+                ("header", np.float64, (block_header_size,)),
+                ("data", np.float64, (self.__n_prp, self.__n_prl)),
+            ]
+        )
+        meshblocks: np.ndarray
+        if mmap:
+            # Only the headers are read, the spectra are a strided view of the file
+            meshblocks = np.memmap(
+                file_path,
+                dtype=meshblock_dtype,
+                mode="r",
+                offset=data_offset,
+                shape=(num_col,),
+            )
+            self.data = meshblocks["data"]
+        else:
+            meshblocks = np.fromfile(
+                file_path, dtype=meshblock_dtype, count=num_col, offset=data_offset
+            )
+            self.data = np.ascontiguousarray(meshblocks["data"])
+        headers = np.array(meshblocks["header"])
 
         # Organize the meshblock headers into a DataFrame
         self._meshblock_locations = pl.from_numpy(
@@ -321,12 +362,20 @@ class PegasusSpectralData:
         """
         return self._meshblock_locations
 
-    def reduce_spectra(self) -> None:
+    def reduce_spectra(self, chunk_size: int = 64) -> None:
         """Reduce the spectra.
 
         Creates two new member variables, spectra_prl and spectra_prp, with
         the parallel and perpendicular averaged spectrum. Depends on `max_w_prp`,
         `max_w_prl`, `n_prp`, and `n_prl` being set correctly.
+
+        The meshblocks are summed a chunk at a time so that memory mapped files are
+        streamed with bounded memory.
+
+        Parameters
+        ----------
+        chunk_size : int, optional
+            The number of meshblocks to read at a time, by default 64
         """
         if self.__file_type != "spec":
             msg = "Reducing is only supported for .spec files."
@@ -338,7 +387,13 @@ class PegasusSpectralData:
         assert isinstance(self.__max_w_prl, float)  # noqa: S101
         assert isinstance(self.__max_w_prp, float)  # noqa: S101
 
-        summed_spectra = self.data.sum(axis=0)
+        # The meshblocks are added in order, like `self.data.sum(axis=0)` does
+        summed_spectra = np.zeros((self.__n_prp, self.__n_prl))
+        for start in range(0, len(self.data), chunk_size):
+            for meshblock in np.ascontiguousarray(
+                self.data[start : start + chunk_size]
+            ):
+                summed_spectra += meshblock
 
         # v_prl array goes from [-vprlmax to vprlmax]
         dv_prl = 2.0 * self.__max_w_prl / self.__n_prl
@@ -1,19 +1,68 @@
-"""Provides the utilities required to deal with trace data."""
+"""Provides the utilities required to deal with trace data.
+
+This module provides:
+- collate_traces: Collate the .trace_mpiio_optimized files into files sorted by trace
+- PegasusTraceStore: Random access to the collated traces by block ID
+- transpose_traces: Write the collated traces as time-major arrays
+- PegasusTimeMajorTraces: Load the time-major arrays written by transpose_traces
+- trace_frequency_spectra: Compute the Welch averaged frequency spectra of the traces
+"""
 
 # pylint: disable=duplicate-code
-import concurrent.futures
-import multiprocessing
+import itertools
+import json
+import math
+import typing
 from pathlib import Path
 from timeit import default_timer
 
 import numpy as np
 import polars as pl
 
-from .loading_tracks import _binary_get_column_names_included_header
+from .catalog import _find_output_files
+from .checkpoint import CollationCheckpoint
+from .execution import get_batch_size, process_pool
+from .loading_tracks import (
+    _binary_get_column_names_included_header,
+    _get_balanced_partitions,
+    _hash_file_names,
+)
 from .pt_logging import setup_pt_logger
 
+# The key of the index of the traces in the metadata of each collated parquet file
+_TRACE_INDEX_KEY = "pegasustools_trace_index"
+
+# The name of the metadata file written with the time-major traces
+_TIME_MAJOR_METADATA_NAME = "metadata.json"
+
+# The number of Welch segments to FFT at once, this bounds the memory used per process
+_WELCH_SEGMENTS_PER_BATCH = 4096
+
+
+def _cadence_bin_expr(cadence: float) -> pl.Expr:
+    """Build an expression with the index of the cadence interval of each sample.
+
+    Parameters
+    ----------
+    cadence : float
+        The length of the time intervals
+
+    Returns
+    -------
+    pl.Expr
+        The index of the interval of length `cadence` that each sample's time is in
+    """
+    return (pl.col("time") / cadence).floor()
+
 
-def _trace_reader(input_file_path: Path, parquet_path: Path) -> pl.DataFrame:
+def _trace_reader(
+    input_file_path: Path,
+    parquet_path: Path,
+    columns: typing.Sequence[str] | None = None,
+    float32_columns: typing.Sequence[str] | None = None,
+    time_stride: int = 1,
+    cadence: float | None = None,
+) -> Path:
     """Convert binary trace file to parquet file.
 
     Parameters
@@ -21,12 +70,29 @@ def _trace_reader(input_file_path: Path, parquet_path: Path) -> pl.DataFrame:
     input_file_path : Path
         The path to the `.trace_mpiio_optimized` file.
     parquet_path : Path
-        The directory to write the parquet file to.
+        The path of the parquet file to write.
+    columns : typing.Sequence[str] | None, optional
+        The columns to keep in addition to the block ID and time, by default None
+        which keeps every column.
+    float32_columns : typing.Sequence[str] | None, optional
+        The columns to store as float32 instead of float64, by default None. Columns
+        that aren't kept are ignored.
+    time_stride : int, optional
+        Keep every `time_stride`th sample of each trace in this file, by default 1
+        which keeps every sample.
+    cadence : float | None, optional
+        If given, only keep the first sample of each trace in each time interval of
+        length `cadence`, by default None
 
     Returns
     -------
-    pl.DataFrame
-        All the unique trace IDs
+    Path
+        The path to the parquet file
+
+    Raises
+    ------
+    ValueError
+        Raised if one of the requested columns isn't in the file.
     """
     logger = setup_pt_logger()
     logger.debug("Starting with file %s", input_file_path)
@@ -37,31 +103,71 @@ def _trace_reader(input_file_path: Path, parquet_path: Path) -> pl.DataFrame:
         _ = trace_file.readline()
         line_2 = trace_file.readline().decode("ascii")
         line_3 = trace_file.readline().decode("ascii")
-
-        # Load the binary part of the file
-        data = np.fromfile(trace_file, dtype=np.float64)
+        header_size = trace_file.tell()
 
     # Build the schema
     num_columns, column_schema = _binary_get_column_names_included_header(
         line_2, line_3
     )
+    column_names = [name for name, _ in column_schema]
 
-    # Reshape to the proper shape
-    num_rows = data.shape[0] // num_columns
-    data = data.reshape((num_rows, num_columns))
+    # Choose the columns to keep, the block ID and time are always kept
+    for name in list(columns or []) + list(float32_columns or []):
+        if name not in column_names:
+            msg = f"{name} is not a column in {input_file_path}."
+            raise ValueError(msg)
+    column_indices = [
+        i
+        for i, name in enumerate(column_names)
+        if columns is None or name in ("block_id", "time") or name in columns
+    ]
+
+    # Map the binary part of the file and only copy the columns that are kept
+    mapped_data = np.memmap(
+        input_file_path, dtype=np.float64, mode="r", offset=header_size
+    )
+    num_rows = mapped_data.shape[0] // num_columns
+    data = mapped_data[: num_rows * num_columns].reshape((num_rows, num_columns))
 
     # Convert to dataframe
-    output_df = pl.from_numpy(data, schema=column_schema)
+    output_df = pl.from_numpy(
+        np.ascontiguousarray(data[:, column_indices]),
+        schema=[column_schema[i] for i in column_indices],
+    )
+    del data, mapped_data
+
+    # Decimate in time, ranking by time so the order of the rows doesn't matter
+    if time_stride > 1:
+        output_df = output_df.filter(
+            (pl.col("time").rank("ordinal").over("block_id") - 1) % time_stride == 0
+        )
+    if cadence is not None:
+        output_df = output_df.filter(
+            pl.col("time")
+            == pl.col("time").min().over("block_id", _cadence_bin_expr(cadence))
+        )
+
+    # Downcast the selected columns
+    if float32_columns:
+        output_df = output_df.with_columns(
+            pl.col(name).cast(pl.Float32)
+            for name in float32_columns
+            if name in output_df.columns
+        )
 
     # Write to disk
     output_df.write_parquet(parquet_path)
 
     logger.debug("Finished with file %s", input_file_path)
 
-    return output_df["block_id"].unique()
+    return parquet_path
 
 
-def _collect_traces(parquet_paths: tuple[Path, ...], chunk: tuple[int, int]) -> None:
+def _collect_traces(
+    parquet_paths: tuple[Path, ...],
+    chunk: tuple[int, int],
+    cadence: float | None = None,
+) -> Path:
     """Gather all data points for traces into single files.
 
     This function takes a list of parquet files and a range of trace IDs then finds
@@ -76,6 +182,20 @@ def _collect_traces(parquet_paths: tuple[Path, ...], chunk: tuple[int, int]) ->
     chunk : tuple[int, int]
         The IDs of the traces to collect. The first element is the low limit and the
         second element is the upper limit, both inclusive.
+    cadence : float | None, optional
+        The cadence the files were decimated to by `_trace_reader`, by default None.
+        Samples from different files can fall in the same time interval, so only the
+        first sample of each trace in each interval is kept.
+
+    Returns
+    -------
+    Path
+        The path to the parquet file
+
+    Notes
+    -----
+    The first row and number of rows of each trace are stored in the metadata of the
+    parquet file so that `PegasusTraceStore` can read single traces directly.
     """
     logger = setup_pt_logger()
     logger.debug("Starting with trace range %i-%i", chunk[0], chunk[1])
@@ -89,21 +209,103 @@ def _collect_traces(parquet_paths: tuple[Path, ...], chunk: tuple[int, int]) ->
 
     # Sort the particle data
     selected_particles = selected_particles.sort(["block_id", "time"])
+    if cadence is not None:
+        selected_particles = selected_particles.filter(
+            _cadence_bin_expr(cadence).is_first_distinct().over("block_id")
+        )
 
     # Write the results
     output_name = (
         "_".join(parquet_paths[0].stem.split("_")[:-2])
     ) + f"_traces_{chunk[0]}_{chunk[1]}.parquet"
     output_path = parquet_paths[0].parent / output_name
-    selected_particles.write_parquet(output_path)
+    index = selected_particles.group_by("block_id", maintain_order=True).len()
+    num_rows = index["len"].to_numpy()
+    index_json = json.dumps(
+        {
+            "block_id": index["block_id"].to_list(),
+            "row_offset": (np.cumsum(num_rows) - num_rows).tolist(),
+            "num_rows": num_rows.tolist(),
+        }
+    )
+    selected_particles.write_parquet(
+        output_path, metadata={_TRACE_INDEX_KEY: index_json}
+    )
 
     logger.debug("Finished with trace range %i-%i", chunk[0], chunk[1])
 
+    return output_path
+
+
+def _get_trace_ranges(
+    parquet_paths: tuple[Path, ...], num_chunks: int
+) -> list[tuple[int, int]]:
+    """Split the trace IDs into ranges with roughly the same number of rows in each.
+
+    Parameters
+    ----------
+    parquet_paths : tuple[Path, ...]
+        The paths to the parquet files
+    num_chunks : int
+        The number of ranges
+
+    Returns
+    -------
+    list[tuple[int, int]]
+        The first and last trace ID, both inclusive, of each range.
+    """
+    # Count the rows of each trace
+    row_counts = (
+        pl.scan_parquet(list(parquet_paths))
+        .group_by("block_id")
+        .len()
+        .sort("block_id")
+        .collect()
+    )
+
+    unique_ids = row_counts["block_id"].to_numpy()
+    starts = _get_balanced_partitions(
+        unique_ids, row_counts["len"].to_numpy(), num_chunks
+    )
+    stops = np.append(starts[1:], len(unique_ids)) - 1
+    return [
+        (int(unique_ids[start_idx]), int(unique_ids[stop_idx]))
+        for start_idx, stop_idx in zip(starts, stops, strict=True)
+    ]
+
+
+def _validate_trace_reduction(time_stride: int, cadence: float | None) -> None:
+    """Check the time decimation options of the trace collation functions.
+
+    Parameters
+    ----------
+    time_stride : int
+        Keep every `time_stride`th sample
+    cadence : float | None
+        The length of the time intervals to keep one sample in
+
+    Raises
+    ------
+    ValueError
+        Raised if `time_stride` is less than 1 or `cadence` isn't positive.
+    """
+    if time_stride < 1:
+        msg = f"time_stride must be at least 1, got {time_stride}."
+        raise ValueError(msg)
+    if cadence is not None and cadence <= 0:
+        msg = f"cadence must be positive, got {cadence}."
+        raise ValueError(msg)
+
 
 def collate_traces(
     num_processes: int,
     source_dir: Path,
     destination_dir: Path,
+    *,
+    columns: typing.Sequence[str] | None = None,
+    float32_columns: typing.Sequence[str] | None = None,
+    time_stride: int = 1,
+    cadence: float | None = None,
 ) -> None:
     """Collate the .trace_mpiio_optimized files in a directory into ordered files.
 
@@ -116,13 +318,45 @@ def collate_traces(
     destination_dir : Path
         The path with filename where the parquet files should be created. It will be
         created if it doesn't exist.
+    columns : typing.Sequence[str] | None, optional
+        The columns to keep in addition to the block ID and time, by default None
+        which keeps every column. E.g. `["B1", "B2", "B3"]`.
+    float32_columns : typing.Sequence[str] | None, optional
+        The columns to store as float32 instead of float64, by default None which
+        keeps every column at float64.
+    time_stride : int, optional
+        Keep every `time_stride`th sample of each trace, by default 1 which keeps every
+        sample. The stride is applied to each file separately, so when the samples of a
+        trace are split between files the spacing can be uneven at the file boundaries.
+    cadence : float | None, optional
+        If given, only keep the first sample of each trace in each time interval
+        `[n * cadence, (n + 1) * cadence)`, by default None. Samples are kept at their
+        original times, they aren't interpolated. Can be combined with `time_stride`.
+
+    Raises
+    ------
+    ValueError
+        Raised if `time_stride` is less than 1, `cadence` isn't positive, or one of the
+        columns isn't in the files.
+
+    Notes
+    -----
+    The columns are dropped, downcast, and decimated while each file is converted, so
+    the temporary files, the memory needed to collect the traces, and the output all
+    shrink accordingly.
+
+    The progress is recorded in a checkpoint, '_checkpoint.json' in
+    `destination_dir`, until the collation finishes. Rerunning a failed collation with
+    the same arguments skips every file and range of traces that already finished, see
+    `CollationCheckpoint`.
     """
     # Setup logging
     logger = setup_pt_logger()
+    _validate_trace_reduction(time_stride, cadence)
 
-    # Get list of binary files
+    # Get list of binary files from the catalog
     logger.info("Gathering list of .trace_mpiio_optimized files.")
-    files_to_read = sorted(source_dir.glob("*.trace_mpiio_optimized"))
+    files_to_read, _ = _find_output_files(source_dir, "trace_binary")
 
     # Create destination directory if it doesn't already exist
     destination_dir.mkdir(parents=True, exist_ok=True)
@@ -133,55 +367,70 @@ def collate_traces(
         for f in files_to_read
     )
 
-    # Spawning new processes instead of forking is required for polars
-    with concurrent.futures.ProcessPoolExecutor(
-        max_workers=num_processes, mp_context=multiprocessing.get_context("spawn")
-    ) as executor:
-        logger.info(
-            "ProcessPoolExecutor launched with %i processes. "
-            "Using %i Polars threads each.",
-            num_processes,
-            pl.thread_pool_size(),
-        )
+    # Load the checkpoint
+    checkpoint = CollationCheckpoint(
+        destination_dir,
+        "collate_traces",
+        {
+            "source_dir": source_dir.resolve(),
+            "source_files": _hash_file_names(files_to_read),
+            "num_processes": num_processes,
+            "columns": None if columns is None else list(columns),
+            "float32_columns": None
+            if float32_columns is None
+            else list(float32_columns),
+            "time_stride": time_stride,
+            "cadence": cadence,
+        },
+    )
+
+    with process_pool(num_processes) as executor:
         # Convert the binary files to parquet
         start = default_timer()
-        futures = [
-            executor.submit(
-                _trace_reader,
-                files_to_read[i],
-                parquet_paths[i],
-            )
-            for i in range(len(files_to_read))
-        ]
+        checkpoint.run_stage(
+            executor,
+            "convert",
+            {
+                input_path.name: (
+                    _trace_reader,
+                    (
+                        input_path,
+                        parquet_path,
+                        columns,
+                        float32_columns,
+                        time_stride,
+                        cadence,
+                    ),
+                )
+                for input_path, parquet_path in zip(
+                    files_to_read, parquet_paths, strict=True
+                )
+            },
+            lambda parquet_path: ([parquet_path], None, None),
+            get_batch_size(len(files_to_read), num_processes),
+        )
 
-        # Get a list of all the unique trace IDs
-        unique_ids = pl.concat([future.result() for future in futures]).unique().sort()
         logger.info(
             "Initial Conversion complete. Elapsed time: %.2fs",
             default_timer() - start,
         )
 
-        # Determine work group ranges
-        num_chunks = len(parquet_paths)
-        start_idx = 0
-        step = int(np.ceil(len(unique_ids) / num_chunks))
-
-        ranges = []
-        while True:
-            stop = start_idx + step
-            if stop < len(unique_ids):
-                ranges.append((unique_ids[start_idx], unique_ids[stop]))
-                start_idx = stop + 1
-            else:
-                ranges.append((unique_ids[start_idx], unique_ids[-1]))
-                break
+        # Determine work group ranges with roughly the same number of rows in each
+        ranges = _get_trace_ranges(parquet_paths, len(parquet_paths))
         logger.info("Finished with determining work group ranges")
 
         # Collect data for each block of particles into a single parquet file
         collect_start = default_timer()
-        futures = [executor.submit(_collect_traces, parquet_paths, r) for r in ranges]
-        # Check for errors and collect results
-        _ = [future.result() for future in futures]
+        checkpoint.run_stage(
+            executor,
+            "collect",
+            {
+                f"{r[0]}_{r[1]}": (_collect_traces, (parquet_paths, r, cadence))
+                for r in ranges
+            },
+            lambda output_path: ([output_path], None, None),
+            get_batch_size(len(ranges), num_processes),
+        )
         logger.info(
             "Collecting particles into their own files complete. Elapsed time: %.2fs",
             default_timer() - collect_start,
@@ -191,6 +440,7 @@ def collate_traces(
     delete_temps_start = default_timer()
     for path in parquet_paths:
         path.unlink()
+    checkpoint.remove()
     logger.info(
         "Deleting temporary files complete. Elapsed time: %.2fs",
         default_timer() - delete_temps_start,
@@ -200,3 +450,782 @@ def collate_traces(
         "Finished sorting and collecting particle data. Total time:: %.2fs",
         default_timer() - start,
     )
+
+
+def _transpose_trace_file(
+    parquet_path: Path,
+    output_dir: Path,
+    probe_chunk: int,
+    probe_range: tuple[int, int],
+    variables: list[str],
+    times_per_chunk: int,
+    dtype: str,
+) -> list[Path]:
+    """Write the traces in one collated file as time-major chunks.
+
+    Parameters
+    ----------
+    parquet_path : Path
+        The path to the collated parquet file
+    output_dir : Path
+        The directory with the times and block IDs to write the chunks to
+    probe_chunk : int
+        The index of this file's chunk along the probe axis
+    probe_range : tuple[int, int]
+        The indices of the first and one past the last block ID of this file in the
+        block IDs of every file
+    variables : list[str]
+        The columns to write
+    times_per_chunk : int
+        The number of times in each chunk
+    dtype : str
+        The name of the numpy dtype to write
+
+    Returns
+    -------
+    list[Path]
+        The paths to the chunks, one for each window of times.
+    """
+    logger = setup_pt_logger()
+    logger.debug("Starting with file %s", parquet_path)
+
+    times = np.load(output_dir / "times.npy", mmap_mode="r")
+    block_ids = np.load(output_dir / "block_ids.npy", mmap_mode="r")[
+        probe_range[0] : probe_range[1]
+    ]
+    traces = pl.read_parquet(parquet_path, columns=["block_id", "time", *variables])
+
+    # Order the samples by their index on the time axis so that the samples in each
+    # window of times are a contiguous range
+    time_idx = np.searchsorted(times, traces["time"].to_numpy())
+    order = np.argsort(time_idx, kind="stable")
+    time_idx = time_idx[order]
+    probe_idx = np.searchsorted(block_ids, traces["block_id"].to_numpy())[order]
+    values = traces.select(variables).to_numpy()[order]
+    del traces
+
+    # Scatter each window of times into a dense array, times without a sample are NaN,
+    # and write it to its own chunk
+    chunk_paths = []
+    for time_chunk, start in enumerate(range(0, len(times), times_per_chunk)):
+        stop = min(start + times_per_chunk, len(times))
+        first, last = np.searchsorted(time_idx, [start, stop])
+        dense = np.full((stop - start, len(block_ids), len(variables)), np.nan, dtype)
+        dense[time_idx[first:last] - start, probe_idx[first:last]] = values[first:last]
+
+        chunk_path = output_dir / f"chunk_{time_chunk}_{probe_chunk}.npy"
+        np.save(chunk_path, dense)
+        chunk_paths.append(chunk_path)
+
+    logger.debug("Finished with file %s", parquet_path)
+
+    return chunk_paths
+
+
+def transpose_traces(
+    num_processes: int,
+    collated_dir: Path,
+    output_dir: Path,
+    *,
+    columns: typing.Sequence[str] | None = None,
+    times_per_chunk: int = 1024,
+) -> None:
+    """Write the traces collated by `collate_traces` as time-major arrays.
+
+    The traces are stored as a dense `(time, probe, variable)` array on the times of
+    every sample of every trace, so the time axis is aligned across the probes and
+    FFTs or correlations can be computed over every probe at once. Probes without a
+    sample at a time are NaN there. The array is split into `.npy` chunks on a grid
+    of windows of `times_per_chunk` times by the probes of each collated file, and
+    each collated file is transposed in parallel. Use `PegasusTimeMajorTraces` to
+    load the array.
+
+    `output_dir` contains `times.npy`, `block_ids.npy`, the chunks,
+    `chunk_{time chunk}_{probe chunk}.npy`, and `metadata.json` describing the grid.
+
+    Parameters
+    ----------
+    num_processes : int
+        The number of processes to use.
+    collated_dir : Path
+        The directory the traces were collated into
+    output_dir : Path
+        The directory to write the chunks to. It will be created if it doesn't exist.
+    columns : typing.Sequence[str] | None, optional
+        The variables to write, by default None which writes every column except the
+        block ID and time.
+    times_per_chunk : int, optional
+        The number of times in each chunk, by default 1024
+
+    Raises
+    ------
+    ValueError
+        Raised if `times_per_chunk` is less than 1 or one of the columns isn't in the
+        collated files.
+
+    Notes
+    -----
+    Each process holds the samples of one collated file and the dense array of one
+    window of times for the probes of that file, so the memory used doesn't depend on
+    how well the times of different probes line up. The time axis itself is every
+    unique time, found with the streaming engine. Like `collate_traces`, the progress
+    is recorded in a checkpoint so that a failed job can be resumed.
+    """
+    logger = setup_pt_logger()
+    if times_per_chunk < 1:
+        msg = f"times_per_chunk must be at least 1, got {times_per_chunk}."
+        raise ValueError(msg)
+
+    parquet_paths = PegasusTraceStore(collated_dir).paths
+    output_dir.mkdir(parents=True, exist_ok=True)
+    start = default_timer()
+
+    # Choose the variables and a dtype that holds all of them
+    traces = pl.scan_parquet(parquet_paths)
+    schema = traces.collect_schema()
+    if columns is None:
+        variables = [
+            name for name in schema.names() if name not in ("block_id", "time")
+        ]
+    else:
+        variables = list(columns)
+        for name in variables:
+            if name not in schema:
+                msg = f"{name} is not a column in the collated traces."
+                raise ValueError(msg)
+    dtype = (
+        "float32"
+        if all(schema[name] == pl.Float32 for name in variables)
+        else "float64"
+    )
+
+    # Find every time and block ID, the probe axis is split by collated file
+    times, block_ids = pl.collect_all(
+        [
+            traces.select(pl.col("time").unique().sort()),
+            traces.select(pl.col("block_id").unique().sort()),
+        ],
+        engine="streaming",
+    )
+    np.save(output_dir / "times.npy", times["time"].to_numpy())
+    np.save(output_dir / "block_ids.npy", block_ids["block_id"].to_numpy())
+    probe_offsets = [
+        *np.searchsorted(
+            block_ids["block_id"].to_numpy(),
+            [int(path.stem.split("_")[-2]) for path in parquet_paths],
+        ).tolist(),
+        len(block_ids),
+    ]
+    with (output_dir / _TIME_MAJOR_METADATA_NAME).open("w") as metadata_file:
+        json.dump(
+            {
+                "variables": variables,
+                "dtype": dtype,
+                "times_per_chunk": times_per_chunk,
+                "num_time_chunks": math.ceil(len(times) / times_per_chunk),
+                "probe_offsets": probe_offsets,
+            },
+            metadata_file,
+        )
+    logger.info(
+        "Found %i times and %i probes. Elapsed time: %.2fs",
+        len(times),
+        len(block_ids),
+        default_timer() - start,
+    )
+
+    # Transpose each collated file
+    checkpoint = CollationCheckpoint(
+        output_dir,
+        "transpose_traces",
+        {
+            "collated_dir": collated_dir.resolve(),
+            "collated_files": _hash_file_names(parquet_paths),
+            "variables": variables,
+            "times_per_chunk": times_per_chunk,
+        },
+    )
+    with process_pool(num_processes) as executor:
+        checkpoint.run_stage(
+            executor,
+            "transpose",
+            {
+                path.name: (
+                    _transpose_trace_file,
+                    (
+                        path,
+                        output_dir,
+                        probe_chunk,
+                        (probe_offsets[probe_chunk], probe_offsets[probe_chunk + 1]),
+                        variables,
+                        times_per_chunk,
+                        dtype,
+                    ),
+                )
+                for probe_chunk, path in enumerate(parquet_paths)
+            },
+            lambda chunk_paths: (chunk_paths, None, None),
+        )
+    checkpoint.remove()
+
+    logger.info(
+        "Finished transposing trace data. Total time:: %.2fs", default_timer() - start
+    )
+
+
+class PegasusTraceStore:
+    """Random access to the traces written by `collate_traces`, keyed by block ID.
+
+    The range of block IDs in each file is parsed from the file names, and the first
+    row and number of rows of each trace are read from the index stored in the
+    metadata of each file, which is cached after the first access. Reading a trace
+    only opens the one file that contains it, and only the row groups with its rows
+    are read, regardless of the size of the dataset.
+
+    Parameters
+    ----------
+    destination_dir : Path
+        The directory the traces were collated into
+
+    Raises
+    ------
+    FileNotFoundError
+        Raised if there aren't any collated trace files in `destination_dir`.
+    """
+
+    def __init__(self, destination_dir: Path) -> None:
+        """Initialize a PegasusTraceStore object. Only lists the files."""
+        paths = list(destination_dir.glob("*_traces_*_*.parquet"))
+        if len(paths) == 0:
+            msg = f"There are no collated trace files in {destination_dir}."
+            raise FileNotFoundError(msg)
+
+        # The file names end with the first and last block ID in the file
+        id_ranges = np.array(
+            [[int(part) for part in path.stem.split("_")[-2:]] for path in paths]
+        )
+        order = np.argsort(id_ranges[:, 0])
+        self.__paths = [paths[i] for i in order]
+        self.__id_min = id_ranges[order, 0]
+        self.__id_max = id_ranges[order, 1]
+        self.__indices: dict[int, tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+
+    def __get_index(self, file_idx: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Get the index of the traces in a file, loading it if it isn't cached.
+
+        Files collated before the index was added don't have it in their metadata, in
+        which case it is computed from the block IDs in the file.
+
+        Parameters
+        ----------
+        file_idx : int
+            The index of the file in `paths`
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray, np.ndarray]
+            The sorted block IDs, the first row of each trace, and the number of rows
+            of each trace.
+        """
+        if file_idx not in self.__indices:
+            path = self.__paths[file_idx]
+            metadata = pl.read_parquet_metadata(path)
+            if _TRACE_INDEX_KEY in metadata:
+                index = json.loads(metadata[_TRACE_INDEX_KEY])
+                block_ids = np.array(index["block_id"], dtype=np.int64)
+                row_offsets = np.array(index["row_offset"], dtype=np.int64)
+                num_rows = np.array(index["num_rows"], dtype=np.int64)
+            else:
+                counts = (
+                    pl.scan_parquet(path)
+                    .group_by("block_id", maintain_order=True)
+                    .len()
+                    .collect()
+                )
+                block_ids = counts["block_id"].to_numpy()
+                num_rows = counts["len"].to_numpy().astype(np.int64)
+                row_offsets = np.cumsum(num_rows) - num_rows
+            self.__indices[file_idx] = (block_ids, row_offsets, num_rows)
+        return self.__indices[file_idx]
+
+    def __locate(self, block_id: int) -> tuple[int, int, int]:
+        """Find the file and rows of a trace.
+
+        Parameters
+        ----------
+        block_id : int
+            The block ID of the trace
+
+        Returns
+        -------
+        tuple[int, int, int]
+            The index of the file in `paths`, the first row of the trace, and the
+            number of rows of the trace.
+
+        Raises
+        ------
+        KeyError
+            Raised if there isn't a trace with this block ID.
+        """
+        file_idx = int(np.searchsorted(self.__id_min, block_id, side="right")) - 1
+        if file_idx >= 0 and block_id <= self.__id_max[file_idx]:
+            block_ids, row_offsets, num_rows = self.__get_index(file_idx)
+            idx = int(np.searchsorted(block_ids, block_id))
+            if idx < len(block_ids) and block_ids[idx] == block_id:
+                return file_idx, int(row_offsets[idx]), int(num_rows[idx])
+        msg = f"There is no trace with block ID {block_id}."
+        raise KeyError(msg)
+
+    def get(self, block_id: int) -> pl.DataFrame:
+        """Read a single trace.
+
+        Parameters
+        ----------
+        block_id : int
+            The block ID of the trace
+
+        Returns
+        -------
+        pl.DataFrame
+            The trace, sorted by time.
+        """
+        file_idx, row_offset, num_rows = self.__locate(block_id)
+        return (
+            pl.scan_parquet(self.__paths[file_idx])
+            .slice(row_offset, num_rows)
+            .collect()
+        )
+
+    def get_many(self, block_ids: typing.Iterable[int]) -> dict[int, pl.DataFrame]:
+        """Read several traces, reading each file only once.
+
+        The requested traces in a file are merged into ranges of adjacent or
+        overlapping rows, each range is read with a single slice, and each trace is a
+        zero-copy slice of its range. Rows between requested traces are never read.
+
+        Parameters
+        ----------
+        block_ids : typing.Iterable[int]
+            The block IDs of the traces
+
+        Returns
+        -------
+        dict[int, pl.DataFrame]
+            The traces, sorted by time, keyed by block ID.
+        """
+        # Group the traces by file
+        block_ids = list(block_ids)
+        locations: dict[int, list[tuple[int, int, int]]] = {}
+        for block_id in block_ids:
+            file_idx, row_offset, num_rows = self.__locate(block_id)
+            locations.setdefault(file_idx, []).append((block_id, row_offset, num_rows))
+
+        traces = {}
+        for file_idx, file_locations in locations.items():
+            file_locations.sort(key=lambda location: location[1])
+
+            # Merge the traces into ranges of adjacent or overlapping rows
+            ranges: list[tuple[int, int, list[tuple[int, int, int]]]] = []
+            for location in file_locations:
+                _, row_offset, num_rows = location
+                if ranges and row_offset <= ranges[-1][1]:
+                    range_start, range_stop, range_locations = ranges[-1]
+                    range_locations.append(location)
+                    ranges[-1] = (
+                        range_start,
+                        max(range_stop, row_offset + num_rows),
+                        range_locations,
+                    )
+                else:
+                    ranges.append((row_offset, row_offset + num_rows, [location]))
+
+            # Read each range and slice the traces out of it
+            collated = pl.scan_parquet(self.__paths[file_idx])
+            for range_start, range_stop, range_locations in ranges:
+                rows = collated.slice(range_start, range_stop - range_start).collect()
+                for block_id, row_offset, num_rows in range_locations:
+                    traces[block_id] = rows.slice(row_offset - range_start, num_rows)
+        return {block_id: traces[block_id] for block_id in block_ids}
+
+    @property
+    def paths(self) -> list[Path]:
+        """Get the paths to the collated files, sorted by block ID.
+
+        Returns
+        -------
+        list[Path]
+            The paths to the collated files
+        """
+        return self.__paths
+
+
+class PegasusTimeMajorTraces:
+    """Load the time-major traces written by `transpose_traces`.
+
+    The chunks are memory mapped and only the chunks that overlap the requested
+    times are read.
+
+    Parameters
+    ----------
+    directory : Path
+        The directory the time-major traces were written to
+    """
+
+    def __init__(self, directory: Path) -> None:
+        """Initialize a PegasusTimeMajorTraces object. Only loads the metadata."""
+        self.__directory = directory
+        metadata = json.loads((directory / _TIME_MAJOR_METADATA_NAME).read_text())
+        self.__variables: list[str] = metadata["variables"]
+        self.__times_per_chunk: int = metadata["times_per_chunk"]
+        self.__num_time_chunks: int = metadata["num_time_chunks"]
+        self.__num_probe_chunks = len(metadata["probe_offsets"]) - 1
+        self.__times: np.ndarray = np.load(directory / "times.npy")
+        self.__block_ids: np.ndarray = np.load(directory / "block_ids.npy")
+
+    def load_chunk(self, time_chunk: int) -> np.ndarray:
+        """Load one window of times for every probe.
+
+        Parameters
+        ----------
+        time_chunk : int
+            The index of the window of times
+
+        Returns
+        -------
+        np.ndarray
+            The traces formatted as (time, probe, variable)
+        """
+        return np.concatenate(
+            [
+                np.load(
+                    self.__directory / f"chunk_{time_chunk}_{probe_chunk}.npy",
+                    mmap_mode="r",
+                )
+                for probe_chunk in range(self.__num_probe_chunks)
+            ],
+            axis=1,
+        )
+
+    def load(self, start: int = 0, stop: int | None = None) -> np.ndarray:
+        """Load a range of times for every probe.
+
+        Parameters
+        ----------
+        start : int, optional
+            The index of the first time to load, by default 0
+        stop : int | None, optional
+            One past the index of the last time to load, by default None which loads
+            up to the last time.
+
+        Returns
+        -------
+        np.ndarray
+            The traces formatted as (time, probe, variable), with the times
+            `times[start:stop]`.
+        """
+        start, stop, _ = slice(start, stop).indices(len(self.__times))
+        first_chunk = min(start // self.__times_per_chunk, self.__num_time_chunks - 1)
+        last_chunk = max(first_chunk, (stop - 1) // self.__times_per_chunk)
+        data = np.concatenate(
+            [self.load_chunk(i) for i in range(first_chunk, last_chunk + 1)], axis=0
+        )
+        offset = first_chunk * self.__times_per_chunk
+        return data[start - offset : stop - offset]
+
+    @property
+    def times(self) -> np.ndarray:
+        """Get the times of the time axis.
+
+        Returns
+        -------
+        np.ndarray
+            The times
+        """
+        return self.__times
+
+    @property
+    def block_ids(self) -> np.ndarray:
+        """Get the block IDs of the probe axis.
+
+        Returns
+        -------
+        np.ndarray
+            The block IDs
+        """
+        return self.__block_ids
+
+    @property
+    def variables(self) -> list[str]:
+        """Get the names of the variables of the variable axis.
+
+        Returns
+        -------
+        list[str]
+            The names of the variables
+        """
+        return self.__variables
+
+    @property
+    def num_time_chunks(self) -> int:
+        """Get the number of windows of times.
+
+        Returns
+        -------
+        int
+            The number of windows of times
+        """
+        return self.__num_time_chunks
+
+
+def _hann_window(nperseg: int) -> np.ndarray:
+    """Build the periodic Hann window used for spectral estimates.
+
+    Parameters
+    ----------
+    nperseg : int
+        The number of samples in the window
+
+    Returns
+    -------
+    np.ndarray
+        The window
+    """
+    window: np.ndarray = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(nperseg) / nperseg)
+    return window
+
+
+def _resample_trace(time: np.ndarray, values: np.ndarray, dt: float) -> np.ndarray:
+    """Linearly interpolate a trace onto a uniform cadence.
+
+    Duplicate times, e.g. from a restart, are dropped before interpolating.
+
+    Parameters
+    ----------
+    time : np.ndarray
+        The sorted times of the samples
+    values : np.ndarray
+        The samples formatted as (time, field)
+    dt : float
+        The cadence to interpolate to
+
+    Returns
+    -------
+    np.ndarray
+        The samples at `time[0] + k * dt` for every `k` up to the last time, formatted
+        as (time, field).
+    """
+    time, unique_idx = np.unique(time, return_index=True)
+    values = values[unique_idx]
+    # The small tolerance keeps the last sample when the times are already uniform
+    num_times = int(np.floor((time[-1] - time[0]) / dt * (1 + 1e-9))) + 1
+    grid = time[0] + dt * np.arange(num_times)
+    return np.stack(
+        [np.interp(grid, time, values[:, i]) for i in range(values.shape[1])], axis=1
+    )
+
+
+def _welch_power_sum(segments: list[np.ndarray], window: np.ndarray) -> np.ndarray:
+    """Sum the power spectra of a batch of segments.
+
+    Parameters
+    ----------
+    segments : list[np.ndarray]
+        The segments, each formatted as (segment, field, time)
+    window : np.ndarray
+        The window function
+
+    Returns
+    -------
+    np.ndarray
+        The sum of the squared magnitude of the FFT of every windowed, mean-subtracted
+        segment, formatted as (field, frequency).
+    """
+    stacked = np.concatenate(segments, axis=0)
+    stacked = (stacked - stacked.mean(axis=-1, keepdims=True)) * window
+    spectra = np.fft.rfft(stacked, axis=-1)
+    power: np.ndarray = (spectra.real**2 + spectra.imag**2).sum(axis=0)
+    return power
+
+
+def _trace_file_power(
+    parquet_path: Path,
+    fields: list[str],
+    nperseg: int,
+    noverlap: int,
+    dt: float,
+) -> tuple[np.ndarray, int]:
+    """Sum the Welch power spectra of every segment of every trace in a file.
+
+    Parameters
+    ----------
+    parquet_path : Path
+        The path to the collated parquet file
+    fields : list[str]
+        The columns to compute the spectra of
+    nperseg : int
+        The number of samples in each segment
+    noverlap : int
+        The number of samples shared by consecutive segments
+    dt : float
+        The cadence the traces are resampled to
+
+    Returns
+    -------
+    tuple[np.ndarray, int]
+        The summed power formatted as (field, frequency), unnormalized, and the number
+        of segments.
+    """
+    logger = setup_pt_logger()
+    logger.debug("Starting with file %s", parquet_path)
+
+    traces = pl.read_parquet(parquet_path, columns=["block_id", "time", *fields])
+    block_ids = traces["block_id"].to_numpy()
+    time = traces["time"].to_numpy().astype(np.float64)
+    values = traces.select(fields).to_numpy().astype(np.float64)
+
+    # The rows are sorted by block ID, so each trace is a contiguous range of rows
+    starts = np.flatnonzero(np.diff(block_ids, prepend=block_ids[0] - 1))
+    stops = np.append(starts[1:], len(block_ids))
+
+    window = _hann_window(nperseg)
+    power = np.zeros((len(fields), nperseg // 2 + 1))
+    num_segments = 0
+    batch: list[np.ndarray] = []
+    batch_size = 0
+    for start, stop in zip(starts, stops, strict=True):
+        resampled = _resample_trace(time[start:stop], values[start:stop], dt)
+        if len(resampled) < nperseg:
+            continue
+
+        # Views of the overlapping segments, formatted as (segment, field, time)
+        segments = np.lib.stride_tricks.sliding_window_view(resampled, nperseg, axis=0)
+        segments = segments[:: nperseg - noverlap]
+        batch.append(segments)
+        batch_size += len(segments)
+        num_segments += len(segments)
+        if batch_size >= _WELCH_SEGMENTS_PER_BATCH:
+            power += _welch_power_sum(batch, window)
+            batch, batch_size = [], 0
+    if batch:
+        power += _welch_power_sum(batch, window)
+
+    logger.debug("Finished with file %s", parquet_path)
+
+    return power, num_segments
+
+
+def trace_frequency_spectra(
+    trace_dir: Path,
+    fields: typing.Sequence[str],
+    nperseg: int = 256,
+    overlap: float = 0.5,
+    *,
+    dt: float | None = None,
+    num_processes: int = 1,
+) -> pl.DataFrame:
+    """Compute the Welch averaged frequency spectra of collated traces.
+
+    Each trace is linearly interpolated onto a uniform cadence, which handles gaps and
+    duplicated times from restarts, and split into overlapping segments. Each segment
+    has its mean subtracted and is multiplied by a Hann window. The segments of many
+    traces are stacked and FFT'd together. The power spectral densities of every
+    segment of every trace are then averaged. Traces shorter than one segment are
+    skipped. The collated files are processed in parallel.
+
+    Parameters
+    ----------
+    trace_dir : Path
+        The directory the traces were collated into with `collate_traces`
+    fields : typing.Sequence[str]
+        The columns to compute the spectra of, e.g. `["B1", "B2", "B3"]`
+    nperseg : int, optional
+        The number of samples in each segment, by default 256
+    overlap : float, optional
+        The fraction of each segment that overlaps the next segment, by default 0.5
+    dt : float | None, optional
+        The cadence to resample the traces to, by default None which uses the median
+        time step of the traces.
+    num_processes : int, optional
+        The number of processes to use, by default 1
+
+    Returns
+    -------
+    pl.DataFrame
+        A 'frequency' column followed by the one-sided power spectral density of each
+        field.
+
+    Raises
+    ------
+    ValueError
+        Raised if `nperseg` is less than 2, `overlap` isn't in [0, 1), `dt` is None
+        and no trace has two samples to determine it from, or no trace is long enough
+        for a single segment.
+    """
+    logger = setup_pt_logger()
+    if nperseg < 2:  # noqa: PLR2004
+        msg = f"nperseg must be at least 2, got {nperseg}."
+        raise ValueError(msg)
+    if not 0 <= overlap < 1:
+        msg = f"overlap must be in [0, 1), got {overlap}."
+        raise ValueError(msg)
+    noverlap = min(int(overlap * nperseg), nperseg - 1)
+    fields = list(fields)
+
+    parquet_paths = PegasusTraceStore(trace_dir).paths
+    start = default_timer()
+
+    # The time steps between consecutive samples of the same trace
+    if dt is None:
+        time_steps = pl.scan_parquet(parquet_paths).select(
+            pl.col("time")
+            .diff()
+            .filter((pl.col("block_id").diff() == 0) & (pl.col("time").diff() > 0))
+            .median()
+        )
+        median_step = time_steps.collect().item()
+        if median_step is None:
+            msg = (
+                "No trace has two samples at increasing times, so the cadence can't "
+                "be determined. Pass dt instead."
+            )
+            raise ValueError(msg)
+        dt = float(median_step)
+    logger.info("Resampling the traces to a cadence of %g", dt)
+
+    with process_pool(num_processes) as executor:
+        results = list(
+            executor.map(
+                _trace_file_power,
+                parquet_paths,
+                itertools.repeat(fields),
+                itertools.repeat(nperseg),
+                itertools.repeat(noverlap),
+                itertools.repeat(dt),
+                chunksize=get_batch_size(len(parquet_paths), num_processes),
+            )
+        )
+
+    num_segments = sum(segments for _, segments in results)
+    if num_segments == 0:
+        msg = f"No trace has at least nperseg={nperseg} samples."
+        raise ValueError(msg)
+
+    # Average and scale to a one-sided power spectral density
+    window = _hann_window(nperseg)
+    power = sum(power for power, _ in results) * dt / (np.sum(window**2) * num_segments)
+    power[:, 1:] *= 2
+    if nperseg % 2 == 0:
+        power[:, -1] /= 2
+
+    logger.info(
+        "Averaged %i segments. Elapsed time: %.2fs",
+        num_segments,
+        default_timer() - start,
+    )
+
+    return pl.DataFrame(
+        {
+            "frequency": np.fft.rfftfreq(nperseg, dt),
+            **{field: power[i] for i, field in enumerate(fields)},
+        }
+    )
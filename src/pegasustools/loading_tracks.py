@@ -1,7 +1,10 @@
 """Provides the utilities required to deal with particle track data."""
 
 import concurrent.futures
-import multiprocessing
+import hashlib
+import io
+import json
+import shutil
 import typing
 from pathlib import Path
 from timeit import default_timer
@@ -10,24 +13,167 @@ from typing import Any
 import numpy as np
 import polars as pl
 
+from .catalog import _find_output_files
+from .checkpoint import CollationCheckpoint
+from .execution import get_batch_size, process_pool
 from .pt_logging import setup_pt_logger
 
+# The name of the manifest written with hive partitioned track datasets
+_HIVE_MANIFEST_NAME = "_manifest.json"
+
+# Sorting or converting data takes roughly this many times its size in memory
+_SORT_MEMORY_FACTOR = 3
+
 
 def _remove_restart_overlaps(
     overlapped_arr: np.typing.ArrayLike, time_idx: int
 ) -> np.typing.ArrayLike:
-    mask = np.ones(overlapped_arr.shape[0], dtype="bool")
-    # Generate the mask by iterating through the time array backwards and only choosing
-    # rows that monotonically decrease in time
-    current_min_time = np.inf
-    for i, time in reversed(list(enumerate(overlapped_arr[:, time_idx]))):
-        if time < current_min_time:
-            current_min_time = time
-        else:
-            mask[i] = False
+    """Remove the rows that were overwritten by a restart.
+
+    A row is kept only if its time is strictly less than the time of every row after
+    it, i.e. only the newest data is kept when a restart rewinds the time.
+
+    Parameters
+    ----------
+    overlapped_arr : np.typing.ArrayLike
+        The 2D array of data with one row per time step
+    time_idx : int
+        The index of the time column
+
+    Returns
+    -------
+    np.typing.ArrayLike
+        The rows of `overlapped_arr` with the overlapping data removed
+    """
+    time = overlapped_arr[:, time_idx]
+
+    # The minimum time of all the rows after each row, computed as a reverse
+    # cumulative minimum. NaNs are never kept so they're ignored in the minimum
+    later_min_time = np.full_like(time, np.inf)
+    later_min_time[:-1] = np.minimum.accumulate(
+        np.where(np.isnan(time[:0:-1]), np.inf, time[:0:-1])
+    )[::-1]
 
     # Mask out the overlapping data
-    return overlapped_arr[mask]
+    return overlapped_arr[time < later_min_time]
+
+
+def _remove_restart_overlaps_expr(time_column: str = "time") -> pl.Expr:
+    """Polars version of `_remove_restart_overlaps` for use with `filter`.
+
+    Parameters
+    ----------
+    time_column : str, optional
+        The name of the time column, by default "time"
+
+    Returns
+    -------
+    pl.Expr
+        A boolean expression that is True for the rows to keep.
+    """
+    time = pl.col(time_column)
+    # NaNs and nulls are never kept so they're ignored in the minimum
+    later_min_time = (
+        time.fill_nan(float("inf"))
+        .fill_null(float("inf"))
+        .reverse()
+        .cum_min()
+        .reverse()
+        .shift(-1, fill_value=float("inf"))
+    )
+    return (time < later_min_time).fill_null(value=False)
+
+
+def _is_single_space_separated(source: Path | bytes) -> bool:
+    """Check if the first line of data in an ASCII table is separated by single spaces.
+
+    Parameters
+    ----------
+    source : Path | bytes
+        The path to the ASCII file or the contents of the file
+
+    Returns
+    -------
+    bool
+        True if the first line that isn't a comment has no leading, trailing, or
+        repeated whitespace.
+    """
+    with io.BytesIO(source) if isinstance(source, bytes) else source.open("rb") as file:
+        for line in file:
+            if line.startswith(b"#") or len(line.strip()) == 0:
+                continue
+            entries = line.rstrip(b"\r\n")
+            return b" ".join(entries.split()) == entries
+    return False
+
+
+def _scan_ascii_table(
+    source: Path | bytes | list[Path],
+    column_names: list[str],
+    dtype: type[pl.DataType] = pl.Float32,
+    include_file_paths: str | None = None,
+) -> pl.LazyFrame:
+    """Lazily parse a whitespace separated ASCII table with Polars.
+
+    If the entries are separated by single spaces, as in .track.dat files, the table is
+    parsed directly by Polars' multithreaded CSV reader. Otherwise each line is read as
+    a single string and then split on spaces. Lines starting with '#' are skipped. Since
+    the result is lazy only the columns that are selected downstream are converted to
+    numbers.
+
+    Parameters
+    ----------
+    source : Path | bytes | list[Path]
+        The path to the ASCII file, the contents of the file, or a list of paths to
+        files with the same columns
+    column_names : list[str]
+        The names of the columns in the file, in order
+    dtype : type[pl.DataType], optional
+        The data type of every column, by default pl.Float32
+    include_file_paths : str | None, optional
+        The name of a column to add with the path of the file each row came from, by
+        default None which doesn't add one
+
+    Returns
+    -------
+    pl.LazyFrame
+        The lazy frame containing the table. Missing entries are null.
+    """
+    if _is_single_space_separated(source[0] if isinstance(source, list) else source):
+        return pl.scan_csv(
+            source,
+            has_header=False,
+            separator=" ",
+            comment_prefix="#",
+            quote_char=None,
+            schema=dict.fromkeys(column_names, dtype),
+            raise_if_empty=False,
+            include_file_paths=include_file_paths,
+        )
+
+    tokens = (
+        pl.col("line").str.split(" ").list.eval(pl.element().filter(pl.element() != ""))
+    )
+    return (
+        pl.scan_csv(
+            source,
+            has_header=False,
+            separator="\x1f",
+            comment_prefix="#",
+            quote_char=None,
+            schema={"line": pl.String},
+            raise_if_empty=False,
+            include_file_paths=include_file_paths,
+        )
+        .with_columns(tokens)
+        .select(
+            *(
+                pl.col("line").list.get(i, null_on_oob=True).cast(dtype).alias(name)
+                for i, name in enumerate(column_names)
+            ),
+            *([] if include_file_paths is None else [include_file_paths]),
+        )
+    )
 
 
 def _get_ascii_particle_ids(path: Path) -> tuple[int, int, int]:
@@ -60,85 +206,157 @@ def _get_ascii_particle_ids(path: Path) -> tuple[int, int, int]:
     return species_id, particle_id, block_id
 
 
-def _ascii_track_reader(
-    file_path: Path, particle_id_max: int, species_id_min: int, species_id_max: int
-) -> pl.DataFrame:
-    """Load the track data from an ascii file at file_path.
+def _magnetic_moment_expr() -> pl.Expr:
+    """Polars version of `_compute_magnetic_moment`.
+
+    The operations are in the same order as the numpy version so that the results are
+    identical, even in single precision.
+
+    Returns
+    -------
+    pl.Expr
+        An expression that computes the magnetic moment, named mu.
+    """
+
+    def dot(a: list[pl.Expr], b: list[pl.Expr]) -> pl.Expr:
+        return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+    # specific velocities
+    specific_velocities = [pl.col(f"v{i}") - pl.col(f"U{i}") for i in range(1, 4)]
+
+    # Magnetic fields
+    magnetic_fields = [pl.col(f"B{i}") for i in range(1, 4)]
+
+    velocities_sqr = dot(specific_velocities, specific_velocities)
+    magnetic_magnitude = dot(magnetic_fields, magnetic_fields).sqrt()
+
+    # specific field-parallel velocity
+    velocity_prl = dot(specific_velocities, magnetic_fields) / magnetic_magnitude
+
+    # mu invariant
+    return (
+        0.5 * (velocities_sqr - velocity_prl * velocity_prl) / magnetic_magnitude
+    ).alias("mu")
+
+
+def _read_ascii_track_header(file_path: Path) -> list[str]:
+    """Read the column names from the header of a .track.dat file.
 
     Parameters
     ----------
     file_path : Path
         The path to the .track.dat file
-    particle_id_max : int
-        The maximum value of the particle ID in the entire dataset.
-    species_id_min : int
-        The minimum value of the species ID in the entire dataset.
-    species_id_max : int
-        The maximum value of the species ID in the entire dataset.
+
+    Returns
+    -------
+    list[str]
+        The names of the columns
     """
     logger = setup_pt_logger()
-    # ===== Load the data =====
     with file_path.open() as track_file:
         # Read the header
         header = track_file.readline().split()
         column_headers = track_file.readline().split()
 
-        # Verify the headers
-        fiducial_header_start = [
-            "#",
-            "Pegasus++",
-            "track",
-            "data",
-            "for",
-        ]
-        if header[:5] != fiducial_header_start:
-            logger.critical(
-                "The file at %s is not a Pegasus++ .track.dat file.", str(file_path)
-            )
-
-        # Parse column names
-        column_headers = column_headers[1:]  # cut out the comment character
-        column_schema = tuple(
-            (name.split("=")[-1], pl.datatypes.Float32) for name in column_headers
+    # Verify the headers
+    fiducial_header_start = [
+        "#",
+        "Pegasus++",
+        "track",
+        "data",
+        "for",
+    ]
+    if header[:5] != fiducial_header_start:
+        logger.critical(
+            "The file at %s is not a Pegasus++ .track.dat file.", str(file_path)
         )
 
-        # Load the file
-        data = np.loadtxt(track_file, dtype=np.float32)
+    # Parse column names, cutting out the comment character
+    return [name.split("=")[-1] for name in column_headers[1:]]
 
-    # ===== Look for restarts and remove the duplicated data via masking =====
-    time_idx = column_schema.index(("time", pl.datatypes.Float32))
-    data = _remove_restart_overlaps(data, time_idx)
 
-    # ===== Compute mu, convert to dataframe, and compute delta mu =====
-    # Compute mu
-    data, column_schema = _compute_magnetic_moment(data, column_schema)
+def _scan_ascii_tracks(
+    files_to_read: typing.Sequence[Path],
+    particle_id_max: int,
+    species_id_min: int,
+    species_id_max: int,
+) -> pl.LazyFrame:
+    """Lazily load the track data from many .track.dat files.
 
-    # Convert to dataframe
-    data_df = pl.from_numpy(data, schema=column_schema)
+    All the files are parsed by a single multithreaded Polars scan, see
+    `_scan_ascii_table`, so that files are read and parsed concurrently. Restarts are
+    removed and delta mu is computed within each file. The files must all have the
+    same columns as the first one.
 
-    # Compute delta mu
-    data_df = data_df.with_columns(
-        delta_mu_abs=(pl.col("mu") - pl.col("mu").shift()).abs()
-    )
+    Parameters
+    ----------
+    files_to_read : typing.Sequence[Path]
+        The paths to the .track.dat files
+    particle_id_max : int
+        The maximum value of the particle ID in the entire dataset.
+    species_id_min : int
+        The minimum value of the species ID in the entire dataset.
+    species_id_max : int
+        The maximum value of the species ID in the entire dataset.
 
-    # Determine the various particle IDs
-    species_id, particle_id, block_id = _get_ascii_particle_ids(file_path)
+    Returns
+    -------
+    pl.LazyFrame
+        The data of all the files, in the same order, with the global particle ID, the
+        block ID, the species, mu, and delta mu.
+    """
+    column_names = _read_ascii_track_header(files_to_read[0])
 
-    # Compute the global particle ID
+    # Determine the various particle IDs of each file
+    species_ids, particle_ids, block_ids = zip(
+        *(_get_ascii_particle_ids(path) for path in files_to_read), strict=True
+    )
     n_particles = particle_id_max + 1
     n_species = species_id_max - species_id_min + 1
-    global_particle_id = (
-        (species_id - species_id_min)
-        + particle_id * n_species
-        + block_id * n_species * n_particles
+    file_ids = pl.LazyFrame(
+        {
+            "file": [str(path) for path in files_to_read],
+            "block_id": block_ids,
+            "species": species_ids,
+            "particle_id": particle_ids,
+        },
+        schema_overrides={"file": pl.String},
+    ).with_columns(
+        particle_id=(pl.col("species") - species_id_min)
+        + pl.col("particle_id") * n_species
+        + pl.col("block_id") * n_species * n_particles
     )
 
-    # Add in the ID columns
-    data_df = data_df.insert_column(0, pl.lit(species_id).alias("species"))
-    data_df = data_df.insert_column(0, pl.lit(block_id).alias("block_id"))
-    data_df = data_df.insert_column(0, pl.lit(global_particle_id).alias("particle_id"))
-
-    return data_df  # noqa: RET504
+    # The IDs are 32 bit integers unless they don't fit
+    global_id_max = (
+        (max(species_ids) - species_id_min)
+        + max(particle_ids) * n_species
+        + max(block_ids) * n_species * n_particles
+    )
+    id_dtype = pl.Int32 if global_id_max <= np.iinfo(np.int32).max else pl.Int64
+
+    return (
+        _scan_ascii_table(list(files_to_read), column_names, include_file_paths="file")
+        # Look for restarts and remove the duplicated data
+        .filter(_remove_restart_overlaps_expr("time").over("file"))
+        # Compute mu and delta mu
+        .with_columns(_magnetic_moment_expr())
+        .with_columns(
+            delta_mu_abs=(pl.col("mu") - pl.col("mu").shift()).abs().over("file")
+        )
+        # Add in the ID columns
+        .join(
+            file_ids.with_columns(
+                pl.col("particle_id", "block_id", "species").cast(id_dtype)
+            ),
+            on="file",
+            how="left",
+            maintain_order="left",
+        )
+        .select(
+            "particle_id", "block_id", "species", *column_names, "mu", "delta_mu_abs"
+        )
+    )
 
 
 def _ascii_tracks_to_parquet(
@@ -147,33 +365,57 @@ def _ascii_tracks_to_parquet(
     particle_id_max: int,
     species_id_min: int,
     species_id_max: int,
-) -> None:
-    # Convert the ascii track files to parquet and get the mins & maxes for IDs
-    particle_data = pl.concat(
-        [
-            _ascii_track_reader(f, particle_id_max, species_id_min, species_id_max)
-            for f in files_to_read
-        ]
+) -> Path:
+    # Convert the ascii track files to parquet, streaming the data to disk
+    temp_path = output_directory / f"{files_to_read[0].stem}_temp.parquet"
+    _scan_ascii_tracks(
+        files_to_read, particle_id_max, species_id_min, species_id_max
+    ).sink_parquet(temp_path)
+
+    # Name the parquet file after the range of IDs it contains
+    id_min, id_max = (
+        pl.scan_parquet(temp_path)
+        .select(
+            pl.col("particle_id").min().alias("min"),
+            pl.col("particle_id").max().alias("max"),
+        )
+        .collect()
+        .row(0)
     )
-
-    # Write the dataframe to a parquet file.
-    id_min = particle_data["particle_id"].min()
-    id_max = particle_data["particle_id"].max()
     output_name = (
         (files_to_read[0].stem.split(".")[0]) + f"_particles_{id_min}_{id_max}.parquet"
     )
-    particle_data.write_parquet(output_directory / output_name)
+    output_path = output_directory / output_name
+    temp_path.replace(output_path)
+
+    return output_path
+
+
+def _hash_file_names(paths: typing.Sequence[Path]) -> str:
+    """Hash the names of a list of files to identify a dataset in a checkpoint.
+
+    Parameters
+    ----------
+    paths : typing.Sequence[Path]
+        The paths to the files
+
+    Returns
+    -------
+    str
+        The hexadecimal SHA-256 hash of the file names.
+    """
+    return hashlib.sha256("\n".join(path.name for path in paths).encode()).hexdigest()
 
 
 def _process_ascii_filenames(
     source_dir: Path, num_processes: int, max_parquet_size: int
-) -> tuple[np.typing.ArrayLike, int, int, int]:
+) -> tuple[list[np.ndarray], int, int, int]:
     # Setup logging
     logger = setup_pt_logger()
 
-    # Get list of binary files
+    # Get list of ascii files and their sizes from the catalog
     logger.info("Gathering list of .track.dat files.")
-    files_to_read = list(source_dir.glob("*.track.dat"))
+    files_to_read, file_sizes = _find_output_files(source_dir, "track_ascii")
 
     # Check that it actually found some .track.dat files
     if len(files_to_read) == 0:
@@ -209,9 +451,8 @@ def _process_ascii_filenames(
 
     # Maximum file sizes
     max_parquet_size = max_parquet_size * int(1e6)  # Convert from MB to Bytes
-    max_ascii_size = np.array([f.stat().st_size for f in files_to_read]).max()
     # divide by 3 to account for space savings when converting from ascii to binary
-    max_ascii_size = max_ascii_size / 3
+    max_ascii_size = max(file_sizes) / 3
 
     # Determine the number of chunks so that the files aren't too large and it's an
     # exact multiple of num_processes
@@ -249,6 +490,13 @@ def collate_tracks_from_ascii(
     max_parquet_size : int, optional
         The maximum parquet file size in MB. This is only approximate and the actual
         file size might be smaller to help with load balancing. By default 2000MB
+
+    Notes
+    -----
+    The progress is recorded in a checkpoint, '_checkpoint.json' in
+    `destination_dir`, until the collation finishes. Rerunning a failed collation with
+    the same arguments only converts the blocks of files that didn't finish, see
+    `CollationCheckpoint`.
     """
     # Setup logging
     logger = setup_pt_logger()
@@ -261,32 +509,43 @@ def collate_tracks_from_ascii(
     # Create destination directory if it doesn't already exist
     destination_dir.mkdir(parents=True, exist_ok=True)
 
-    # Spawning new processes instead of forking is required for polars
-    with concurrent.futures.ProcessPoolExecutor(
-        max_workers=num_processes, mp_context=multiprocessing.get_context("spawn")
-    ) as executor:
-        logger.info(
-            "ProcessPoolExecutor launched with %i processes. "
-            "Using %i Polars threads each.",
-            num_processes,
-            pl.thread_pool_size(),
-        )
+    # Load the checkpoint. Each block is identified by its first file
+    checkpoint = CollationCheckpoint(
+        destination_dir,
+        "collate_tracks_from_ascii",
+        {
+            "source_dir": source_dir.resolve(),
+            "source_files": _hash_file_names(
+                [path for block in file_blocks for path in block]
+            ),
+            "num_processes": num_processes,
+            "max_parquet_size": max_parquet_size,
+        },
+    )
+
+    with process_pool(num_processes) as executor:
         # Convert the binary files to parquet and get the mins & maxes for IDs
         logger.info("Starting to convert ASCII track files into parquet.")
         start = default_timer()
-        futures = [
-            executor.submit(
-                _ascii_tracks_to_parquet,
-                f,
-                destination_dir,
-                particle_id_max,
-                species_id_min,
-                species_id_max,
-            )
-            for f in file_blocks
-        ]
-        # Check for exceptions
-        _ = [future.result() for future in futures]
+        checkpoint.run_stage(
+            executor,
+            "convert",
+            {
+                block[0].name: (
+                    _ascii_tracks_to_parquet,
+                    (
+                        block,
+                        destination_dir,
+                        particle_id_max,
+                        species_id_min,
+                        species_id_max,
+                    ),
+                )
+                for block in file_blocks
+            },
+            lambda output_path: ([output_path], None, None),
+        )
+    checkpoint.remove()
     logger.info("Conversion complete. Elapsed time: %.2fs", default_timer() - start)
 
 
@@ -456,28 +715,26 @@ def _estimate_num_rows(
     return num_columns, column_schema
 
 
-def _binary_track_reader(input_file_path: Path, parquet_path: Path) -> pl.DataFrame:
-    """Convert binary track file to parquet file. Computes the magnetic moment too.
+def _read_binary_track_header(
+    input_file_path: Path,
+) -> tuple[int, int, tuple[tuple[str, Any], ...]]:
+    """Read the header of a binary track file.
 
     Parameters
     ----------
     input_file_path : Path
         The path to the `.track_mpiio_optimized` file.
-    parquet_path : Path
-        The directory to write the parquet file to.
 
     Returns
     -------
-    pl.DataFrame
-        The species min & max and the particle_id max
+    tuple[int, int, tuple[tuple[str, Any], ...]]
+        The byte offset of the binary data, the number of columns, and the schema of the
+        columns.
     """
-    logger = setup_pt_logger()
-    logger.debug("Starting with file %s", input_file_path)
-
-    # Open the file
     with input_file_path.open(mode="rb") as track_file:
         # first read the header, accounting for the two different possible versions
         _ = track_file.readline()
+        offset = track_file.tell()
         line_2_bytes = track_file.readline()
 
         # Check if line_2 is binary or part of the header
@@ -489,123 +746,411 @@ def _binary_track_reader(input_file_path: Path, parquet_path: Path) -> pl.DataFr
 
         if is_ascii and "Number of variables = " in line_2:
             # This is the new version of track files with the complete header
-
-            # Finish processing the header info
             line_3 = track_file.readline().decode("ascii")
             num_columns, column_schema = _binary_get_column_names_included_header(
                 line_2, line_3
             )
+            return track_file.tell(), num_columns, column_schema
 
-            # Load the binary part of the file
-            data = np.fromfile(track_file, dtype=np.float64)
+    # This is the old version of track files with the incomplete header. Determine the
+    # number of columns and generate the schema from the start of the data
+    data = np.memmap(input_file_path, dtype=np.float64, mode="r", offset=offset)
+    num_columns, column_schema = _estimate_num_rows(data)
 
-        else:
-            # This is the old version of track files with the incomplete header
-            track_file.seek(0)
-            _ = track_file.readline()
+    return offset, num_columns, column_schema
 
-            # Load the entire remaining file
-            data = np.fromfile(track_file, dtype=np.float64)
 
-            # Determine the number of columns and generate the schema
-            num_columns, column_schema = _estimate_num_rows(data)
+def _binary_track_prescan(input_file_path: Path) -> pl.DataFrame:
+    """Count the number of rows for each particle in a binary track file.
 
-    # Reshape to the proper shape
-    num_rows = data.shape[0] // num_columns
-    data = data.reshape((num_rows, num_columns))
+    Only the ID columns are read, as strided views into a memory map of the file.
 
-    # Compute mu
-    data, column_schema = _compute_magnetic_moment(data, column_schema)
+    Parameters
+    ----------
+    input_file_path : Path
+        The path to the `.track_mpiio_optimized` file.
 
-    # Convert to dataframe
-    output_df = pl.from_numpy(data, schema=column_schema)
+    Returns
+    -------
+    pl.DataFrame
+        The species, particle_id, and block_id of each particle and its number of rows,
+        num_rows.
+    """
+    offset, num_columns, column_schema = _read_binary_track_header(input_file_path)
+    column_names = [name for name, _ in column_schema]
+
+    # Memory map the data as a 2D array of rows
+    raw_data = np.memmap(input_file_path, dtype=np.float64, mode="r", offset=offset)
+    num_rows = raw_data.shape[0] // num_columns
+    data = raw_data[: num_rows * num_columns].reshape((num_rows, num_columns))
+
+    # Convert the IDs to integers the same way Polars does, by truncating
+    id_names = ["species", "particle_id", "block_id"]
+    return (
+        pl.DataFrame(
+            {
+                name: data[:, column_names.index(name)].astype(np.int64)
+                for name in id_names
+            }
+        )
+        .group_by(id_names)
+        .agg(num_rows=pl.len().cast(pl.Int64))
+    )
 
-    # Get mins and maxes
-    mins = output_df.select(pl.col("species")).min()
-    maxes = output_df.select(pl.col("particle_id"), pl.col("species")).max()
 
-    # Write to disk
-    output_df.write_parquet(parquet_path)
+def _merge_row_counts(row_counts: typing.Iterable[pl.DataFrame]) -> pl.DataFrame:
+    """Merge tables of the number of rows of each particle into a single table.
 
-    logger.debug("Finished with file %s", input_file_path)
+    The tables are folded into a running total as they are produced, which is merged
+    again whenever the tables waiting to be folded in are larger than it. The memory
+    used is therefore a few times the number of unique particles instead of the total
+    size of all the tables.
 
-    return pl.DataFrame(
-        {
-            "species_mins": mins["species"].item(),
-            "species_maxes": maxes["species"].item(),
-            "particle_id_maxes": maxes["particle_id"].item(),
-            "num_rows": num_rows,
-        }
+    Parameters
+    ----------
+    row_counts : typing.Iterable[pl.DataFrame]
+        Tables of the number of rows of each particle, see `_binary_track_prescan`.
+
+    Returns
+    -------
+    pl.DataFrame
+        The species, particle_id, and block_id of each unique particle and its total
+        number of rows, num_rows.
+    """
+    id_names = ["species", "particle_id", "block_id"]
+    merged = pl.DataFrame(schema=dict.fromkeys([*id_names, "num_rows"], pl.Int64))
+    pending: list[pl.DataFrame] = []
+    pending_rows = 0
+    for table in row_counts:
+        pending.append(table)
+        pending_rows += len(table)
+        if pending_rows >= len(merged):
+            merged = (
+                pl.concat([merged, *pending])
+                .group_by(id_names)
+                .agg(pl.col("num_rows").sum())
+            )
+            pending, pending_rows = [], 0
+    return (
+        pl.concat([merged, *pending]).group_by(id_names).agg(pl.col("num_rows").sum())
     )
 
 
-def _compute_global_ids(
-    parquet_path: Path, species_min: int, species_max: int, particles_max: int
-) -> pl.DataFrame:
-    """Compute a global particle ID based on the species, particle, and block IDs.
+def _get_balanced_partitions(
+    ids: np.ndarray, counts: np.ndarray, num_partitions: int
+) -> np.ndarray:
+    """Split sorted IDs into contiguous partitions with roughly equal numbers of rows.
+
+    The rows of a single ID are never split, so there can be fewer partitions than
+    requested if a few IDs hold most of the rows.
 
     Parameters
     ----------
-    parquet_path : Path
-        The path to the parquet file.
-    species_min : int
-        The minimum value in the species column.
-    species_max : int
-        The maximum value in the species column.
-    particles_max : int
-        The maximum value in the particle_id column.
+    ids : np.ndarray
+        The unique IDs, sorted in ascending order
+    counts : np.ndarray
+        The number of rows for each ID
+    num_partitions : int
+        The number of partitions
 
     Returns
     -------
-    pl.DataFrame
-        The unique global IDs in this file.
+    np.ndarray
+        The index into `ids` of the first ID in each partition. Partition `i` holds the
+        IDs from `ids[starts[i]]` up to, but not including, `ids[starts[i+1]]`.
     """
-    logger = setup_pt_logger()
+    if len(ids) == 0:
+        return np.zeros(1, dtype=np.int64)
+
+    # Assign each ID to the partition that contains the middle of its rows
+    num_partitions = max(1, num_partitions)
+    midpoints = np.cumsum(counts) - counts / 2
+    partitions = np.floor(midpoints * num_partitions / counts.sum())
+    return np.flatnonzero(np.diff(partitions, prepend=-1))
+
+
+def _get_bucket_dir(bucket_root: Path, bucket: int) -> Path:
+    """Get the directory that holds the temporary files of one ID bucket.
+
+    Parameters
+    ----------
+    bucket_root : Path
+        The directory containing all the bucket directories
+    bucket : int
+        The index of the bucket
+
+    Returns
+    -------
+    Path
+        The path to the bucket directory.
+    """
+    return bucket_root / f"bucket_{bucket}"
+
 
-    # Load the dataframe
-    logger.debug("Starting %s", parquet_path)
-    output_df = pl.read_parquet(parquet_path)
+def _iter_binary_track_chunks(
+    input_file_path: Path,
+    extrema: tuple[int, int, int],
+    boundaries: np.ndarray,
+    chunk_size: int,
+    columns: typing.Sequence[str] | None = None,
+) -> typing.Iterator[pl.DataFrame]:
+    """Read a binary track file in chunks of rows and assign each row to a bucket.
 
-    # Compute new IDs
+    Computes the magnetic moment and the global particle ID too. The global ID is
+    computed from the species, particle, and block IDs. The file is memory mapped and
+    processed in chunks of rows so that the whole file is never in memory.
+
+    Parameters
+    ----------
+    input_file_path : Path
+        The path to the `.track_mpiio_optimized` file.
+    extrema : tuple[int, int, int]
+        The minimum value in the species column, the maximum value in the species
+        column, and the maximum value in the particle_id column for the whole dataset.
+    boundaries : np.ndarray
+        The first global ID in each bucket. Bucket `i` holds the IDs from
+        `boundaries[i]` up to, but not including, `boundaries[i+1]`.
+    chunk_size : int
+        The approximate size of each chunk in bytes
+    columns : typing.Sequence[str] | None, optional
+        The columns to keep in addition to the IDs, time, and mu, by default None which
+        keeps every column
+
+    Yields
+    ------
+    pl.DataFrame
+        Each chunk of rows sorted by global ID and time, with the bucket of each row in
+        the bucket column.
+
+    Raises
+    ------
+    ValueError
+        Raised if one of the requested columns isn't in the file.
+    """
+    species_min, species_max, particles_max = extrema
     n_species = species_max - species_min + 1
     n_particles = particles_max + 1
-    output_df = output_df.with_columns(
-        particle_id=(pl.col("species") - species_min)
-        + (pl.col("particle_id") * n_species)
-        + (pl.col("block_id") * n_species * n_particles)
+
+    # Memory map the binary part of the file as a 2D array of rows
+    offset, num_columns, column_schema = _read_binary_track_header(input_file_path)
+    raw_data = np.memmap(input_file_path, dtype=np.float64, mode="r", offset=offset)
+    num_rows = int(raw_data.shape[0]) // num_columns
+    data = raw_data[: num_rows * num_columns].reshape((num_rows, num_columns))
+
+    # Determine which columns to read. The velocities and fields are needed for mu
+    column_names = [name for name, _ in column_schema]
+    if columns is None:
+        columns = column_names
+    for name in columns:
+        if name not in column_names:
+            msg = f"{name} is not a column in {input_file_path}."
+            raise ValueError(msg)
+    output_columns = {"particle_id", "block_id", "species", "time", "mu", *columns}
+    read_columns = [
+        i
+        for i, name in enumerate(column_names)
+        if name in output_columns or name[0] in "vBU"
+    ]
+    read_schema = tuple(column_schema[i] for i in read_columns)
+
+    # Process the file in chunks of rows
+    chunk_rows = max(1, chunk_size // (8 * (len(read_columns) + 1)))
+    for chunk_start in range(0, num_rows, chunk_rows):
+        # Copy only the needed columns of this chunk out of the memory map
+        chunk = data[chunk_start : chunk_start + chunk_rows, read_columns]
+
+        # Compute mu
+        chunk_with_mu, chunk_schema = _compute_magnetic_moment(chunk, read_schema)
+
+        # Convert to dataframe, compute the global IDs, and which bucket each row is in
+        yield (
+            pl.from_numpy(np.asarray(chunk_with_mu), schema=chunk_schema)
+            .select(name for name, _ in chunk_schema if name in output_columns)
+            .with_columns(
+                particle_id=(pl.col("species") - species_min)
+                + (pl.col("particle_id") * n_species)
+                + (pl.col("block_id") * n_species * n_particles)
+            )
+            .with_columns(
+                bucket=pl.lit(pl.Series(boundaries)).search_sorted(
+                    pl.col("particle_id"), side="right"
+                )
+                - 1
+            )
+            .sort(["particle_id", "time"])
+        )
+
+
+def _write_bucket_buffers(
+    buffers: dict[int, list[pl.DataFrame]], bucket_root: Path, file_name: str
+) -> list[Path]:
+    """Write the buffered rows of each bucket to a file in the bucket's directory.
+
+    Each file is sorted by particle ID and time so that the files in a bucket can be
+    merged by `_scan_sorted_bucket` without sorting the whole bucket.
+
+    Parameters
+    ----------
+    buffers : dict[int, list[pl.DataFrame]]
+        The buffered rows of each bucket. It is emptied.
+    bucket_root : Path
+        The directory containing all the bucket directories
+    file_name : str
+        The name of the files to write, without the extension
+
+    Returns
+    -------
+    list[Path]
+        The paths to the files that were written.
+    """
+    output_paths = []
+    for bucket, bucket_dfs in buffers.items():
+        bucket_dir = _get_bucket_dir(bucket_root, bucket)
+        bucket_dir.mkdir(parents=True, exist_ok=True)
+        output_path = bucket_dir / f"{file_name}.parquet"
+        pl.concat(bucket_dfs).sort(["particle_id", "time"]).write_parquet(output_path)
+        output_paths.append(output_path)
+    buffers.clear()
+    return output_paths
+
+
+def _binary_track_reader(
+    input_file_paths: list[Path],
+    parquet_path: Path,
+    extrema: tuple[int, int, int],
+    boundaries: np.ndarray,
+    chunk_size: int,
+    columns: typing.Sequence[str] | None = None,
+) -> tuple[list[Path], int]:
+    """Convert binary track files to parquet files split into buckets of particle IDs.
+
+    The files are read in chunks with `_iter_binary_track_chunks` and the rows of each
+    bucket are buffered across all the chunks of all the files. Whenever the buffer
+    reaches `chunk_size` bytes the rows of each bucket are written to a file named
+    `<parquet_path.stem>_<flush>.parquet` in the bucket's directory,
+    `parquet_path.parent / bucket_<bucket>`. Converting many small files together
+    therefore writes a few large files per bucket instead of one per file. Any files
+    left over from a previous, failed, conversion are removed first.
+
+    Parameters
+    ----------
+    input_file_paths : list[Path]
+        The paths to the `.track_mpiio_optimized` files.
+    parquet_path : Path
+        The bucket root directory and the name of the parquet files to write.
+    extrema : tuple[int, int, int]
+        The minimum value in the species column, the maximum value in the species
+        column, and the maximum value in the particle_id column for the whole dataset.
+    boundaries : np.ndarray
+        The first global ID in each bucket. Bucket `i` holds the IDs from
+        `boundaries[i]` up to, but not including, `boundaries[i+1]`.
+    chunk_size : int
+        The approximate size in bytes of the buffer. The files are read in chunks of
+        half this size, so the memory used stays within the same budget as before.
+    columns : typing.Sequence[str] | None, optional
+        The columns to keep in addition to the IDs, time, and mu, by default None which
+        keeps every column
+
+    Returns
+    -------
+    tuple[list[Path], int]
+        The paths to the files that were written and the number of rows in them.
+    """
+    logger = setup_pt_logger()
+    logger.debug(
+        "Starting with %i files from %s", len(input_file_paths), input_file_paths[0]
+    )
+
+    # Remove the output of any previous attempt
+    for stale_path in parquet_path.parent.glob(f"bucket_*/{parquet_path.stem}_*"):
+        stale_path.unlink()
+
+    num_rows = 0
+    output_paths: list[Path] = []
+    buffers: dict[int, list[pl.DataFrame]] = {}
+    buffered_bytes = 0
+    flush_index = 0
+
+    for input_file_path in input_file_paths:
+        for output_df in _iter_binary_track_chunks(
+            input_file_path, extrema, boundaries, max(1, chunk_size // 2), columns
+        ):
+            num_rows += len(output_df)
+
+            # Buffer the rows of each bucket and write them once the buffer is full
+            for (bucket,), bucket_df in output_df.partition_by(
+                "bucket", as_dict=True, include_key=False
+            ).items():
+                buffers.setdefault(int(bucket), []).append(bucket_df)
+                buffered_bytes += int(bucket_df.estimated_size())
+            if buffered_bytes >= chunk_size:
+                output_paths += _write_bucket_buffers(
+                    buffers, parquet_path.parent, f"{parquet_path.stem}_{flush_index}"
+                )
+                buffered_bytes = 0
+                flush_index += 1
+    output_paths += _write_bucket_buffers(
+        buffers, parquet_path.parent, f"{parquet_path.stem}_{flush_index}"
     )
 
-    # Sort
-    output_df = output_df.sort(["particle_id", "time"])
+    logger.debug(
+        "Finished with %i files from %s", len(input_file_paths), input_file_paths[0]
+    )
 
-    # Get the unique IDs
-    unique_ids = output_df["particle_id"].unique()
+    return output_paths, num_rows
 
-    # Write to disk
-    output_df.write_parquet(parquet_path)
 
-    logger.debug("finished with %s", parquet_path)
+def _scan_sorted_bucket(bucket_dir: Path) -> pl.LazyFrame:
+    """Lazily merge the sorted files of a bucket into one sorted LazyFrame.
 
-    return unique_ids
+    The files written by `_write_bucket_buffers` are each sorted by particle ID and
+    time, so the bucket is a k-way merge of them, done as a balanced tree of pairwise
+    `merge_sorted` calls on a (particle_id, time) key. With the streaming engine only
+    a window of each file is held in memory instead of the whole bucket.
+
+    Parameters
+    ----------
+    bucket_dir : Path
+        The directory of the bucket
+
+    Returns
+    -------
+    pl.LazyFrame
+        The rows of the bucket sorted by particle ID and time.
+    """
+    sort_key = pl.struct("particle_id", "time").alias("_sort_key")
+    bucket_lfs = [
+        pl.scan_parquet(path).with_columns(sort_key)
+        for path in sorted(bucket_dir.glob("*.parquet"))
+    ]
+    while len(bucket_lfs) > 1:
+        bucket_lfs = [
+            bucket_lfs[i].merge_sorted(bucket_lfs[i + 1], key="_sort_key")
+            if i + 1 < len(bucket_lfs)
+            else bucket_lfs[i]
+            for i in range(0, len(bucket_lfs), 2)
+        ]
+    return bucket_lfs[0].drop("_sort_key")
 
 
 def _collect_particles_and_compute_delta_mu(
-    parquet_paths: tuple[Path, ...], chunk: tuple[int, int]
+    bucket_dir: Path, output_prefix: Path
 ) -> Path:
     """Gather all data points for particles into single files and compute delta mu.
 
-    This function takes a list of parquet files and a range of particle IDs then finds
-    all the data for every particle in that range and collects it all into a single
-    file. It then sorts that data according to particle ID and time and computes the
-    change in mu at each time step. Results are written to new parquet files.
+    This function takes the directory of one ID bucket, which contains sorted files
+    written by `_write_bucket_buffers`, and merges them into a single file sorted by
+    particle ID and time with `_scan_sorted_bucket`. It then computes the change in mu
+    at each time step. The merge runs on Polars' streaming engine so the bucket is
+    never sorted as a whole.
 
     Parameters
     ----------
-    parquet_paths : tuple[Path, ...]
-        The paths to the parquet files
-    chunk : tuple[int, int]
-        The IDs of the particles to collect. The first element is the low limit and the
-        second element is the upper limit, both inclusive.
+    bucket_dir : Path
+        The directory of the bucket
+    output_prefix : Path
+        The path and beginning of the name of the output file. The range of particle
+        IDs is appended to it.
 
     Returns
     -------
@@ -613,34 +1158,157 @@ def _collect_particles_and_compute_delta_mu(
         The path to the file that was written.
     """
     logger = setup_pt_logger()
-    logger.debug("Starting with particle range %i-%i", chunk[0], chunk[1])
 
-    # Filter to find all the particles in the chunk
-    selected_particles = (
-        pl.scan_parquet(parquet_paths)
-        .filter(pl.col("particle_id").is_between(chunk[0], chunk[1]))
-        .collect(engine="streaming")
+    # Get the range of particle IDs in this bucket. This only uses the statistics
+    id_min, id_max = (
+        pl.scan_parquet(bucket_dir / "*.parquet")
+        .select(
+            pl.col("particle_id").min().alias("min"),
+            pl.col("particle_id").max().alias("max"),
+        )
+        .collect()
+        .row(0)
     )
+    logger.debug("Starting with particle range %i-%i", id_min, id_max)
 
-    # Sort the particle data
-    selected_particles = selected_particles.sort(["particle_id", "time"])
-    # Compute delta mu
-    selected_particles = selected_particles.with_columns(
+    # Merge the sorted particle data and compute delta mu
+    output_path = output_prefix.with_name(
+        f"{output_prefix.name}_particles_{id_min}_{id_max}.parquet"
+    )
+    _scan_sorted_bucket(bucket_dir).with_columns(
         delta_mu_abs=pl.when(pl.col("particle_id") == pl.col("particle_id").shift())
         .then((pl.col("mu") - pl.col("mu").shift()).abs())
         .otherwise(None)
+    ).sink_parquet(output_path, engine="streaming")
+
+    logger.debug("Finished with particle range %i-%i", id_min, id_max)
+
+    return output_path
+
+
+def _collect_particles_to_hive(
+    bucket_dir: Path, destination_dir: Path, row_group_size: int
+) -> list[dict[str, Any]]:
+    """Gather the particles in a bucket into a hive partitioned dataset.
+
+    The same as `_collect_particles_and_compute_delta_mu` except that the results are
+    written to 'species=<species>/bucket=<bucket>/data.parquet' in `destination_dir`.
+    The species column is only stored in the directory name. The rows are sorted by
+    particle ID and time and written with small row groups so that filtering on the
+    particle ID only reads the row groups that contain that particle.
+
+    Parameters
+    ----------
+    bucket_dir : Path
+        The directory of the bucket
+    destination_dir : Path
+        The root directory of the hive partitioned dataset
+    row_group_size : int
+        The number of rows in each row group
+
+    Returns
+    -------
+    list[dict[str, Any]]
+        The manifest entries of the files that were written. One per species.
+    """
+    logger = setup_pt_logger()
+    bucket = int(bucket_dir.name.split("_")[-1])
+    bucket_lf = pl.scan_parquet(bucket_dir / "*.parquet")
+    logger.debug("Starting with bucket %i", bucket)
+
+    # Particles never have more than one species so each species can be sorted
+    # separately
+    species_ids = (
+        bucket_lf.select(pl.col("species").unique().sort()).collect().to_series()
     )
+    entries = []
+    for species in species_ids:
+        relative_path = Path(f"species={species}", f"bucket={bucket}", "data.parquet")
+        output_path = destination_dir / relative_path
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Merge the sorted particle data, compute delta mu, and write it
+        _scan_sorted_bucket(bucket_dir).filter(pl.col("species") == species).drop(
+            "species"
+        ).with_columns(
+            delta_mu_abs=pl.when(pl.col("particle_id") == pl.col("particle_id").shift())
+            .then((pl.col("mu") - pl.col("mu").shift()).abs())
+            .otherwise(None)
+        ).sink_parquet(output_path, row_group_size=row_group_size, engine="streaming")
+
+        # Record the contents of the file
+        id_min, id_max, num_rows = (
+            pl.scan_parquet(output_path)
+            .select(
+                pl.col("particle_id").min().alias("min"),
+                pl.col("particle_id").max().alias("max"),
+                pl.len(),
+            )
+            .collect()
+            .row(0)
+        )
+        entries.append(
+            {
+                "path": relative_path.as_posix(),
+                "species": species,
+                "bucket": bucket,
+                "particle_id_min": id_min,
+                "particle_id_max": id_max,
+                "num_rows": num_rows,
+            }
+        )
 
-    # Write the results
-    output_name = (
-        "_".join(parquet_paths[0].stem.split("_")[:-2])
-    ) + f"_particles_{chunk[0]}_{chunk[1]}.parquet"
-    output_path = parquet_paths[0].parent / output_name
-    selected_particles.write_parquet(output_path)
+    logger.debug("Finished with bucket %i", bucket)
 
-    logger.debug("Finished with particle range %i-%i", chunk[0], chunk[1])
+    return entries
 
-    return output_path
+
+def scan_collated_tracks(
+    tracks_dir: Path, particle_ids: typing.Sequence[int] | None = None
+) -> pl.LazyFrame:
+    """Lazily load the tracks written by `collate_tracks_from_binary` in hive mode.
+
+    The manifest is used to only scan the files that contain the requested particles.
+    Since the files are sorted with small row groups, the parquet reader then only
+    reads the row groups that contain those particles.
+
+    Parameters
+    ----------
+    tracks_dir : Path
+        The directory the tracks were collated into
+    particle_ids : typing.Sequence[int] | None, optional
+        The global IDs of the particles to load, by default None which loads all of the
+        particles
+
+    Returns
+    -------
+    pl.LazyFrame
+        The particle tracks, including the species column from the partitioning.
+    """
+    manifest = json.loads((tracks_dir / _HIVE_MANIFEST_NAME).read_text())
+    entries = manifest["files"]
+
+    if particle_ids is None:
+        return pl.scan_parquet(
+            [tracks_dir / entry["path"] for entry in entries], hive_partitioning=True
+        )
+
+    # Find the files whose range of IDs contain at least one of the requested IDs
+    sorted_ids = np.sort(np.asarray(particle_ids, dtype=np.int64))
+    id_min = np.array([entry["particle_id_min"] for entry in entries])
+    id_max = np.array([entry["particle_id_max"] for entry in entries])
+    contains_ids = np.searchsorted(sorted_ids, id_max, side="right") > np.searchsorted(
+        sorted_ids, id_min, side="left"
+    )
+    # Keep one file when nothing matches so that the result has the right schema
+    selected = [
+        entry for entry, keep in zip(entries, contains_ids, strict=True) if keep
+    ]
+    selected = selected or entries[:1]
+
+    return pl.scan_parquet(
+        [tracks_dir / entry["path"] for entry in selected], hive_partitioning=True
+    ).filter(pl.col("particle_id").is_in(sorted_ids.tolist()))
 
 
 def _verify_binary_track_collation(
@@ -668,7 +1336,8 @@ def _verify_binary_track_collation(
     # correct number of files and they have the correct number of rows
     fix_msg = (
         "This is likely caused by insufficient memory leading to a silent crash. "
-        "Try rerunning with at least 90GB of memory per CPU."
+        "Try rerunning with a smaller memory_limit_gb, or with restart_collect=True "
+        "and more memory per CPU."
     )
     # Check for the correct number of files
     missing_files = False
@@ -689,7 +1358,7 @@ def _verify_binary_track_collation(
     # Check for the correct number of rows written
     try:
         n_rows_written = (
-            pl.scan_parquet(collected_paths).select(pl.len()).collect().item()
+            pl.scan_parquet(list(collected_paths)).select(pl.len()).collect().item()
         )
     except pl.exceptions.ComputeError as err:
         msg = f"One or more of the parquet files is corrupt. {fix_msg}"
@@ -702,15 +1371,247 @@ def _verify_binary_track_collation(
         raise RuntimeError(msg)
 
 
+def _collect_binary_buckets(
+    executor: concurrent.futures.Executor,
+    checkpoint: CollationCheckpoint,
+    bucket_dirs: list[Path],
+    output_prefix: Path,
+    output_layout: str,
+    row_group_size: int,
+    n_rows_raw: int,
+) -> list[Path]:
+    """Sort each bucket of particles and write the output files.
+
+    Buckets that the checkpoint records as already collected are skipped.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        The executor to run the work on
+    checkpoint : CollationCheckpoint
+        The checkpoint of the collation
+    bucket_dirs : list[Path]
+        The directories of the buckets
+    output_prefix : Path
+        The path and beginning of the name of the output files. Its parent is the
+        destination directory.
+    output_layout : str
+        The layout of the output, either "files" or "hive"
+    row_group_size : int
+        The number of rows in each row group for the "hive" layout
+    n_rows_raw : int
+        The total number of rows, recorded in the manifest of the "hive" layout
+
+    Returns
+    -------
+    list[Path]
+        The paths to the files that were written.
+    """
+    destination_dir = output_prefix.parent
+
+    if output_layout == "hive":
+        checkpoint.run_stage(
+            executor,
+            "collect",
+            {
+                bucket_dir.name: (
+                    _collect_particles_to_hive,
+                    (bucket_dir, destination_dir, row_group_size),
+                )
+                for bucket_dir in bucket_dirs
+            },
+            lambda entries: (
+                [destination_dir / entry["path"] for entry in entries],
+                sum(entry["num_rows"] for entry in entries),
+                entries,
+            ),
+        )
+
+        # Write the manifest
+        entries = [
+            entry
+            for bucket_dir in bucket_dirs
+            for entry in checkpoint.chunk_result("collect", bucket_dir.name)
+        ]
+        with (destination_dir / _HIVE_MANIFEST_NAME).open("w") as manifest_file:
+            json.dump({"num_rows": n_rows_raw, "files": entries}, manifest_file)
+    else:
+        checkpoint.run_stage(
+            executor,
+            "collect",
+            {
+                bucket_dir.name: (
+                    _collect_particles_and_compute_delta_mu,
+                    (bucket_dir, output_prefix),
+                )
+                for bucket_dir in bucket_dirs
+            },
+            lambda output_path: ([output_path], None, None),
+        )
+
+    return [
+        path
+        for bucket_dir in bucket_dirs
+        for path in checkpoint.chunk_outputs("collect", bucket_dir.name)
+    ]
+
+
+def _binary_prescan_stage(
+    executor: concurrent.futures.Executor,
+    checkpoint: CollationCheckpoint,
+    files_to_read: list[Path],
+    num_buckets: int,
+    batch_size: int = 1,
+) -> dict[str, typing.Any]:
+    """Find the range of IDs and split the particles into buckets of equal size.
+
+    The buckets are chosen from the number of rows of each particle so that they all
+    hold roughly the same number of rows, even if some particles have more samples
+    than others.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        The executor to run the work on
+    checkpoint : CollationCheckpoint
+        The checkpoint of the collation
+    files_to_read : list[Path]
+        The paths to the `.track_mpiio_optimized` files
+    num_buckets : int
+        The number of buckets to split the particles into
+    batch_size : int, optional
+        The number of files to scan in each task submitted to the executor, by default 1
+
+    Returns
+    -------
+    dict[str, typing.Any]
+        The minimum and maximum species ID, the maximum particle ID, the total number of
+        rows, and the first global ID in each bucket, boundaries.
+    """
+    logger = setup_pt_logger()
+    if checkpoint.is_stage_complete("prescan"):
+        logger.info("Using the IDs and buckets from the checkpoint")
+        return typing.cast("dict[str, typing.Any]", checkpoint.stage_result("prescan"))
+
+    # Count the rows of each particle, reading only the ID columns, and sum the
+    # counts of each particle as the files finish so only the unique particles are
+    # held in memory
+    start = default_timer()
+    row_counts = _merge_row_counts(
+        executor.map(_binary_track_prescan, files_to_read, chunksize=batch_size)
+    )
+    logger.info("Scanning IDs complete. Elapsed time: %.2fs", default_timer() - start)
+
+    ids = _get_binary_track_buckets(row_counts, num_buckets)
+    checkpoint.complete_stage("prescan", ids)
+    return ids
+
+
+def _get_binary_track_buckets(
+    row_counts: pl.DataFrame, num_buckets: int
+) -> dict[str, typing.Any]:
+    """Find the range of IDs and the buckets from the number of rows of each particle.
+
+    Parameters
+    ----------
+    row_counts : pl.DataFrame
+        The number of rows of each particle, see `_merge_row_counts`. A particle may
+        appear more than once.
+    num_buckets : int
+        The number of buckets to split the particles into
+
+    Returns
+    -------
+    dict[str, typing.Any]
+        The minimum and maximum species ID, the maximum particle ID, the total number of
+        rows, and the first global ID in each bucket, boundaries.
+    """
+    logger = setup_pt_logger()
+
+    # Compute the min & max IDs
+    extrema = row_counts.select(
+        species_min=pl.col("species").min(),
+        species_max=pl.col("species").max(),
+        particles_max=pl.col("particle_id").max(),
+        num_rows=pl.col("num_rows").sum(),
+    ).row(0, named=True)
+    logger.info("Finished with determining min & max IDs")
+
+    # Balance the buckets by the number of rows of each global ID
+    n_species = extrema["species_max"] - extrema["species_min"] + 1
+    n_particles = extrema["particles_max"] + 1
+    global_counts = (
+        row_counts.group_by(
+            global_id=(pl.col("species") - extrema["species_min"])
+            + (pl.col("particle_id") * n_species)
+            + (pl.col("block_id") * n_species * n_particles)
+        )
+        .agg(pl.col("num_rows").sum())
+        .sort("global_id")
+    )
+    global_ids = global_counts["global_id"].to_numpy()
+    starts = _get_balanced_partitions(
+        global_ids, global_counts["num_rows"].to_numpy(), num_buckets
+    )
+    boundaries = global_ids[starts] if len(global_ids) > 0 else np.zeros(1, np.int64)
+    boundaries[0] = 0
+
+    return {**extrema, "boundaries": boundaries.tolist()}
+
+
+def _get_num_buckets(data_size: int, num_processes: int, memory_limit_gb: float) -> int:
+    """Choose the number of buckets so that sorting a bucket fits in memory.
+
+    Sorting a bucket takes a few times the size of its data.
+
+    Parameters
+    ----------
+    data_size : int
+        The total size, in bytes, of the `.track_mpiio_optimized` files
+    num_processes : int
+        The number of processes, the minimum number of buckets
+    memory_limit_gb : float
+        The approximate amount of memory, in GB, each process can use
+
+    Returns
+    -------
+    int
+        The number of buckets.
+    """
+    return max(
+        num_processes,
+        int(np.ceil(_SORT_MEMORY_FACTOR * data_size / (memory_limit_gb * 1e9))),
+    )
+
+
 def collate_tracks_from_binary(
     num_processes: int,
     source_dir: Path,
     destination_dir: Path,
     *,
     restart_collect: bool = False,
+    memory_limit_gb: float = 4.0,
+    output_layout: typing.Literal["files", "hive"] = "files",
+    row_group_size: int = 16_384,
+    columns: typing.Sequence[str] | None = None,
 ) -> None:
     """Collate the .track_mpiio_optimized files in a directory into ordered files.
 
+    This is an external sort in three stages. First the ID columns of every binary file
+    are scanned to count the rows of each particle, and the global particle IDs are
+    split into buckets that hold roughly the same number of rows. Then each binary file
+    is memory mapped and converted to parquet in chunks, in a single pass that computes
+    a global particle ID and splits the rows into buckets, with one directory per
+    bucket.
+    Finally the files in each bucket are sorted with Polars' streaming engine and
+    written to a single output file. The number of buckets and the size of the chunks
+    are chosen so that each step fits in `memory_limit_gb`.
+
+    The progress is recorded in a checkpoint, '_checkpoint.json' in
+    `destination_dir`, until the collation finishes. Rerunning a failed collation with
+    the same arguments skips every stage, file, and bucket that already finished, see
+    `CollationCheckpoint`.
+
     Parameters
     ----------
     num_processes : int
@@ -723,13 +1624,29 @@ def collate_tracks_from_binary(
     restart_collect : bool, optional
        Only run the final collection stage. Intended to be used to restart if the
        collection step fails due to running out of memory, by default False
+    memory_limit_gb : float, optional
+        The approximate amount of memory, in GB, each process can use when sorting the
+        particles, by default 4.0
+    output_layout : typing.Literal["files", "hive"], optional
+        How to write the output, by default "files". "files" writes one file per bucket
+        named '<prefix>_particles_<first ID>_<last ID>.parquet'. "hive" writes a hive
+        partitioned dataset, 'species=<species>/bucket=<bucket>/data.parquet', with
+        sorted row groups and a manifest, '_manifest.json', of the range of particle IDs
+        in each file. Use `scan_collated_tracks` to load it.
+    row_group_size : int, optional
+        The number of rows in each row group when `output_layout` is "hive", by default
+        16384
+    columns : typing.Sequence[str] | None, optional
+        The columns to keep in addition to the IDs, time, mu, and delta mu, by default
+        None which keeps every column. Only these columns and the ones needed to
+        compute mu are read from the binary files.
     """
     # Setup logging
     logger = setup_pt_logger()
 
-    # Get list of binary files
+    # Get list of binary files and their sizes from the catalog
     logger.info("Gathering list of .track_mpiio_optimized files.")
-    files_to_read = sorted(source_dir.glob("*.track_mpiio_optimized"))
+    files_to_read, file_sizes = _find_output_files(source_dir, "track_binary")
 
     # Create destination directory if it doesn't already exist
     destination_dir.mkdir(parents=True, exist_ok=True)
@@ -739,110 +1656,104 @@ def collate_tracks_from_binary(
         destination_dir / ("_".join(f.stem.split(".")) + "_temp.parquet")
         for f in files_to_read
     )
+    output_prefix = destination_dir / "_".join(parquet_paths[0].stem.split("_")[:-2])
+    bucket_root = destination_dir / "temp_buckets"
 
-    # Spawning new processes instead of forking is required for polars
-    with concurrent.futures.ProcessPoolExecutor(
-        max_workers=num_processes, mp_context=multiprocessing.get_context("spawn")
-    ) as executor:
-        logger.info(
-            "ProcessPoolExecutor launched with %i processes. "
-            "Using %i Polars threads each.",
-            num_processes,
-            pl.thread_pool_size(),
-        )
-        # Convert the binary files to parquet and get the mins & maxes for IDs
+    # Load the checkpoint and check if there's anything to do
+    checkpoint = CollationCheckpoint(
+        destination_dir,
+        "collate_tracks_from_binary",
+        {
+            "source_dir": source_dir.resolve(),
+            "source_files": _hash_file_names(files_to_read),
+            "num_processes": num_processes,
+            "memory_limit_gb": memory_limit_gb,
+            "output_layout": output_layout,
+            "row_group_size": row_group_size,
+            "columns": None if columns is None else list(columns),
+        },
+    )
+    with process_pool(num_processes) as executor:
         start = default_timer()
         if not restart_collect:
-            futures = [
-                executor.submit(
-                    _binary_track_reader,
-                    files_to_read[i],
-                    parquet_paths[i],
-                )
-                for i in range(len(files_to_read))
-            ]
-
-            # Check for errors and collect results
-            extrema = pl.concat([future.result() for future in futures])
-            logger.info(
-                "Initial Conversion complete. Elapsed time: %.2fs",
-                default_timer() - start,
+            # Find the mins & maxes for IDs, the number of rows, and the buckets
+            num_buckets = _get_num_buckets(
+                sum(file_sizes), num_processes, memory_limit_gb
+            )
+            batch_size = get_batch_size(len(files_to_read), num_processes)
+            ids = _binary_prescan_stage(
+                executor, checkpoint, files_to_read, num_buckets, batch_size
+            )
+            n_rows_raw = ids["num_rows"]
+            boundaries = np.array(ids["boundaries"], dtype=np.int64)
+            logger.info("Splitting the particles into %i buckets", len(boundaries))
+
+            # Each chunk of a binary file takes a few times its size to process
+            chunk_size = int(memory_limit_gb * 1e9 / _SORT_MEMORY_FACTOR)
+
+            # Convert the binary files to parquet files split into buckets of the
+            # global IDs. Each batch of files is converted together so that their rows
+            # are buffered and written in a few large files per bucket. There are too
+            # many bucket files to track individually so only the number of rows is
+            # recorded
+            conversion_start = default_timer()
+            batch_starts = range(0, len(files_to_read), batch_size)
+            if not any(
+                checkpoint.is_chunk_complete("convert", files_to_read[i].name)
+                for i in batch_starts
+            ):
+                # Nothing to resume, so remove the buckets of any earlier run
+                shutil.rmtree(bucket_root, ignore_errors=True)
+            checkpoint.run_stage(
+                executor,
+                "convert",
+                {
+                    files_to_read[i].name: (
+                        _binary_track_reader,
+                        (
+                            files_to_read[i : i + batch_size],
+                            bucket_root / parquet_paths[i].name,
+                            (
+                                ids["species_min"],
+                                ids["species_max"],
+                                ids["particles_max"],
+                            ),
+                            boundaries,
+                            chunk_size,
+                            columns,
+                        ),
+                    )
+                    for i in batch_starts
+                },
+                lambda result: (result[0], result[1], None),
             )
-
-            # Compute the min & max IDs
-            mins = extrema.select(pl.col("species_mins")).min()
-            maxes = extrema.select(
-                pl.col("species_maxes"), pl.col("particle_id_maxes")
-            ).max()
-            logger.info("Finished with determining min & max IDs")
-
-            # Compute the new global IDs and get a list of all unique IDs.
-            global_ids_start = default_timer()
-            futures = [
-                executor.submit(
-                    _compute_global_ids,
-                    path,
-                    mins["species_mins"].item(),
-                    maxes["species_maxes"].item(),
-                    maxes["particle_id_maxes"].item(),
-                )
-                for path in parquet_paths
-            ]
-            # Check for errors and wait for it to complete
-            _ = [future.result() for future in futures]
             logger.info(
-                "Computing global IDs and sorting complete. Elapsed time: %.2fs",
-                default_timer() - global_ids_start,
+                "Conversion and bucketing complete. Elapsed time: %.2fs",
+                default_timer() - conversion_start,
             )
-
-            # Compute the number of rows that should be written
-            n_rows_raw = extrema.select(pl.col("num_rows")).sum().item()
         else:
             # if this is a restart run then we need to get the number of rows that
             # should be written from the intermediate parquet files
             logger.info("collecting the number of raw rows")
             n_rows_raw = (
-                pl.scan_parquet(parquet_paths)
+                pl.scan_parquet(bucket_root / "*" / "*.parquet")
                 .select(pl.len())
                 .collect(engine="streaming")
                 .item()
             )
 
-        # Get a sorted Series that consists of all the unique particle IDs
-        logger.info("collecting unique IDs")
-        unique_ids = (
-            pl.scan_parquet(parquet_paths)
-            .select(pl.col("particle_id"))
-            .unique()
-            .collect(engine="streaming")
-            .to_series()
-            .sort()
-        )
-
-        # Determine work group ranges
-        num_chunks = len(parquet_paths)
-        start_idx = 0
-        step = int(np.ceil(len(unique_ids) / num_chunks))
-
-        ranges = []
-        while True:
-            stop = start_idx + step
-            if stop < len(unique_ids):
-                ranges.append((unique_ids[start_idx], unique_ids[stop]))
-                start_idx = stop + 1
-            else:
-                ranges.append((unique_ids[start_idx], unique_ids[-1]))
-                break
-        logger.info("Finished with determining work group ranges")
-
-        # Collect data for each block of particles into a single parquet file
+        # Collect data for each bucket of particles into a single parquet file
+        bucket_dirs = sorted(bucket_root.glob("bucket_*"))
         collect_start = default_timer()
-        futures = [
-            executor.submit(_collect_particles_and_compute_delta_mu, parquet_paths, r)
-            for r in ranges
-        ]
-        # Check for errors and collect results
-        collected_paths = [future.result() for future in futures]
+        collected_paths = _collect_binary_buckets(
+            executor,
+            checkpoint,
+            bucket_dirs,
+            output_prefix,
+            output_layout,
+            row_group_size,
+            n_rows_raw,
+        )
 
         logger.info(
             "Collecting particles into their own files complete. Elapsed time: %.2fs",
@@ -851,13 +1762,14 @@ def collate_tracks_from_binary(
 
     # Now we verify that the results are correct, or that there is at least the
     # correct number of files and they have the correct number of rows
-    _verify_binary_track_collation(collected_paths, len(ranges), n_rows_raw)
+    num_chunks = len(collected_paths) if output_layout == "hive" else len(bucket_dirs)
+    _verify_binary_track_collation(collected_paths, num_chunks, n_rows_raw)
     logger.info("Number of output files and rows verified")
 
     # Clean up the temporary files
     delete_temps_start = default_timer()
-    for path in parquet_paths:
-        path.unlink()
+    shutil.rmtree(bucket_root)
+    checkpoint.remove()
     logger.info(
         "Deleting temporary files complete. Elapsed time: %.2fs",
         default_timer() - delete_temps_start,
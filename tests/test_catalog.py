@@ -0,0 +1,87 @@
+"""Tests for the contents of catalog.py."""
+
+import os
+from pathlib import Path
+
+import numpy as np
+import polars.testing
+
+import pegasustools as pt
+
+
+def test_catalog_directory() -> None:
+    """Test pt.catalog_directory including incremental updates."""
+    # Setup paths
+    directory = Path(__file__).parent.resolve() / "data" / "test_catalog_directory"
+    directory.mkdir(exist_ok=True)
+    catalog_path = directory / ".pegasustools_catalog.parquet"
+    catalog_path.unlink(missing_ok=True)
+
+    # Write a .hst file
+    hst_path = directory / "run.hst"
+    with hst_path.open("w") as hst_file:
+        hst_file.write("# Athena++ history data\n")
+        hst_file.write("# [1]=time     [2]=dt       [3]=mass\n")
+        np.savetxt(hst_file, np.ones((10, 3)))
+
+    # Write a binary trace file with the new header
+    trace_path = directory / "run.00000.trace_mpiio_optimized"
+    num_rows = 7
+    with trace_path.open("wb") as trace_file:
+        trace_file.write(b"Trace output function at time = 12.5\n")
+        trace_file.write(b"Number of variables = 3\n")
+        trace_file.write(b"Variables:   block_id   time   B1\n")
+        np.ones((num_rows, 3)).tofile(trace_file)
+
+    # Write a file that shouldn't be cataloged
+    (directory / "notes.txt").write_text("not an output file")
+
+    # Build the catalog
+    catalog = pt.catalog_directory(directory)
+    assert catalog_path.exists()
+    assert catalog["path"].to_list() == [trace_path.name, hst_path.name]
+
+    hst_entry = catalog.row(1, named=True)
+    assert hst_entry["file_type"] == "hst"
+    assert hst_entry["variables"] == ["time", "dt", "mass"]
+    assert hst_entry["time"] is None
+
+    trace_entry = catalog.row(0, named=True)
+    assert trace_entry["file_type"] == "trace_binary"
+    assert trace_entry["time"] == 12.5
+    assert trace_entry["variables"] == ["block_id", "time", "B1"]
+    assert trace_entry["shape"] == [num_rows, 3]
+    assert trace_entry["data_size"] == num_rows * 3 * 8
+    assert trace_entry["data_offset"] + trace_entry["data_size"] == (
+        trace_path.stat().st_size
+    )
+
+    # Without revalidation the saved catalog is returned as is
+    hst_path.unlink()
+    polars.testing.assert_frame_equal(
+        pt.catalog_directory(directory, revalidate=False), catalog
+    )
+
+    # Revalidating drops removed files and reparses modified files
+    with trace_path.open("ab") as trace_file:
+        np.ones((1, 3)).tofile(trace_file)
+    stat = trace_path.stat()
+    os.utime(trace_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    updated = pt.catalog_directory(directory)
+    assert updated["path"].to_list() == [trace_path.name]
+    assert updated["shape"].to_list() == [[num_rows + 1, 3]]
+
+    # The header of an old .spec file is a single line even if the data after it
+    # decodes as ASCII
+    spec_path = directory / "run.00000.spec"
+    with spec_path.open("wb") as spec_file:
+        spec_file.write(b"Particle distribution function at time = 2.5\n")
+        np.zeros(64).tofile(spec_file)
+    spec_entry = pt.catalog_directory(directory).row(0, named=True)
+    assert spec_entry["file_type"] == "spec"
+    assert spec_entry["time"] == 2.5
+    assert spec_entry["data_size"] == 64 * 8
+
+    # Cleanup the files created
+    for path in (trace_path, spec_path, catalog_path, directory / "notes.txt"):
+        path.unlink()
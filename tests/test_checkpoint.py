@@ -0,0 +1,97 @@
+"""Tests for the contents of checkpoint.py."""
+
+import concurrent.futures
+from pathlib import Path
+
+import polars as pl
+
+from pegasustools.checkpoint import CollationCheckpoint
+
+
+def _write_file(path: Path, text: str) -> Path:
+    path.write_text(text)
+    return path
+
+
+def test_collation_checkpoint() -> None:
+    """Test resuming, invalidating, and removing a CollationCheckpoint."""
+    # Setup paths
+    directory = Path(__file__).parent.resolve() / "data" / "test_collation_checkpoint"
+    directory.mkdir(exist_ok=True)
+    parameters = {"source_dir": directory, "num_processes": 2}
+
+    # Run a stage with three chunks
+    checkpoint = CollationCheckpoint(directory, "job", parameters, save_interval=0)
+    assert not checkpoint.is_stage_complete("convert")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        checkpoint.run_stage(
+            executor,
+            "convert",
+            {
+                name: (_write_file, (directory / f"{name}.txt", name))
+                for name in ("a", "b", "c")
+            },
+            lambda path: ([path], 1, path.name),
+        )
+    checkpoint.complete_stage("prescan", {"num_ids": 10})
+    assert checkpoint.is_stage_complete("convert")
+    assert checkpoint.chunk_result("convert", "b") == "b.txt"
+    assert checkpoint.chunk_outputs("convert", "c") == [directory / "c.txt"]
+
+    # Loading the manifest with the same parameters resumes, and chunks whose output
+    # was removed or modified, even without changing its size, are not complete
+    (directory / "a.txt").unlink()
+    (directory / "b.txt").write_text("modified")
+    (directory / "c.txt").write_text("C")
+    resumed = CollationCheckpoint(directory, "job", parameters)
+    assert resumed.stage_result("prescan") == {"num_ids": 10}
+    assert not resumed.is_chunk_complete("convert", "a")
+    assert not resumed.is_chunk_complete("convert", "b")
+    assert not resumed.is_chunk_complete("convert", "c")
+
+    # Only the incomplete chunks are rerun
+    calls = []
+
+    def record(path: Path) -> tuple[list[Path], None, None]:
+        calls.append(path.name)
+        return [path], None, None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        resumed.run_stage(
+            executor,
+            "convert",
+            {
+                name: (_write_file, (directory / f"{name}.txt", name))
+                for name in ("a", "b", "c")
+            },
+            record,
+        )
+    assert sorted(calls) == ["a.txt", "b.txt", "c.txt"]
+    assert resumed.is_chunk_complete("convert", "c")
+
+    # Parquet outputs are checked with the number of rows in their footer
+    parquet_path = directory / "d.parquet"
+    pl.DataFrame({"x": range(100)}).write_parquet(parquet_path)
+    resumed.complete_chunk("collect", "d", [parquet_path], num_rows=100)
+    assert resumed.is_chunk_complete("collect", "d")
+    with parquet_path.open("r+b") as parquet_file:
+        parquet_file.truncate(parquet_path.stat().st_size - 8)
+    assert not resumed.is_chunk_complete("collect", "d")
+
+    # Different parameters or jobs start from scratch
+    different = CollationCheckpoint(
+        directory, "job", {**parameters, "num_processes": 3}
+    )
+    assert not different.is_stage_complete("prescan")
+    assert not CollationCheckpoint(directory, "other", parameters).is_stage_complete(
+        "prescan"
+    )
+
+    # Removing the manifest
+    resumed.remove()
+    assert not resumed.manifest_path.exists()
+
+    # Cleanup the files created
+    for name in ("a", "b", "c"):
+        (directory / f"{name}.txt").unlink()
+    parquet_path.unlink()
@@ -0,0 +1,137 @@
+"""Tests for the contents of collation_mpi.py.
+
+The collation tests run on however many ranks pytest was launched with.
+`test_collation_mpi_ranks` relaunches them under `mpirun` with several ranks so that
+the communication between ranks is always tested when `mpirun` is available.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import polars as pl
+import polars.testing
+import pytest
+from test_loading_traces import generate_random_trace_binary
+from test_loading_tracks import generate_collated_binary_tracks
+
+import pegasustools as pt
+
+MPI = pytest.importorskip("mpi4py.MPI")
+
+
+def test_collate_tracks_from_binary_mpi() -> None:
+    """Test the collate_tracks_from_binary_mpi function."""
+    # Setup paths
+    comm = MPI.COMM_WORLD
+    source_directory = (
+        Path(__file__).parent.resolve() / "data" / "test_collate_tracks_from_binary_mpi"
+    )
+    parquet_directory = source_directory / "parquet"
+    if comm.Get_rank() == 0:
+        source_directory.mkdir(exist_ok=True)
+        fiducial_data = generate_collated_binary_tracks(source_directory, num_files=5)
+    comm.Barrier()
+
+    # A 30kB memory limit results in many buckets per rank
+    pt.collate_tracks_from_binary_mpi(
+        source_directory, parquet_directory, memory_limit_gb=3e-5
+    )
+
+    # Verify the results against the data and the output of collate_tracks_from_binary
+    if comm.Get_rank() == 0:
+        assert not (parquet_directory / "temp_buckets").exists()
+        output_paths = sorted(parquet_directory.glob("*.parquet"))
+        test_data = pl.concat(pl.read_parquet(path) for path in output_paths).sort(
+            ["particle_id", "time"]
+        )
+        polars.testing.assert_frame_equal(test_data.drop("delta_mu_abs"), fiducial_data)
+
+        reference_directory = source_directory / "reference"
+        pt.collate_tracks_from_binary(
+            1, source_directory, reference_directory, memory_limit_gb=3e-5
+        )
+        reference_data = pl.read_parquet(reference_directory / "*.parquet").sort(
+            ["particle_id", "time"]
+        )
+        polars.testing.assert_frame_equal(test_data, reference_data)
+
+        # Cleanup the files created
+        [f.unlink() for f in source_directory.glob("*.track_mpiio_optimized")]  # type: ignore[func-returns-value]
+        (source_directory / ".pegasustools_catalog.parquet").unlink()
+        [f.unlink() for f in output_paths]  # type: ignore[func-returns-value]
+        shutil.rmtree(reference_directory)
+    comm.Barrier()
+
+
+def test_collate_traces_mpi() -> None:
+    """Test the collate_traces_mpi function."""
+    # Setup paths
+    comm = MPI.COMM_WORLD
+    source_directory = (
+        Path(__file__).parent.resolve() / "data" / "test_collate_traces_mpi"
+    )
+    parquet_directory = source_directory / "parquet"
+    if comm.Get_rank() == 0:
+        source_directory.mkdir(exist_ok=True)
+        fiducial_data = pl.concat(
+            [
+                generate_random_trace_binary(
+                    source_directory / f"test_file_{i}.trace_mpiio_optimized",
+                    seed=42 + i,
+                )
+                for i in range(4)
+            ]
+        ).sort(["block_id", "time"])
+    comm.Barrier()
+
+    # Run the code to test
+    pt.collate_traces_mpi(source_directory, parquet_directory)
+
+    # Verify the results
+    if comm.Get_rank() == 0:
+        test_data = pl.read_parquet(parquet_directory)
+        polars.testing.assert_frame_equal(test_data, fiducial_data)
+
+        # Cleanup the files created
+        [f.unlink() for f in source_directory.glob("*.trace_mpiio_optimized")]  # type: ignore[func-returns-value]
+        (source_directory / ".pegasustools_catalog.parquet").unlink()
+        [f.unlink() for f in parquet_directory.glob("*.parquet")]  # type: ignore[func-returns-value]
+    comm.Barrier()
+
+
+@pytest.mark.parametrize("num_ranks", [2, 4])
+def test_collation_mpi_ranks(num_ranks: int) -> None:
+    """Run the MPI collation tests with several ranks under mpirun."""
+    mpirun = shutil.which("mpirun")
+    if mpirun is None:
+        pytest.skip("mpirun is not available")
+    if MPI.COMM_WORLD.Get_size() > 1:
+        pytest.skip("Already running with several ranks")
+
+    # Launch a fresh pytest on every rank, only running the collation tests
+    result = subprocess.run(  # noqa: S603
+        [
+            mpirun,
+            "-np",
+            str(num_ranks),
+            sys.executable,
+            "-m",
+            "pytest",
+            "-q",
+            "-p",
+            "no:cacheprovider",
+            "-k",
+            "not test_collation_mpi_ranks",
+            __file__,
+        ],
+        capture_output=True,
+        text=True,
+        timeout=600,
+        check=False,
+        cwd=Path(__file__).parent,
+        env={**os.environ, "OMPI_MCA_rmaps_base_oversubscribe": "1"},
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
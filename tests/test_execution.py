@@ -0,0 +1,99 @@
+"""Tests for the contents of execution.py."""
+
+import os
+from pathlib import Path
+from timeit import default_timer
+
+import polars as pl
+import polars.testing
+from test_loading_traces import generate_random_trace_binary
+
+from pegasustools.execution import (
+    get_batch_size,
+    get_threads_per_process,
+    process_pool,
+    run_batch,
+)
+from pegasustools.loading_traces import _trace_reader
+
+
+def test_get_threads_per_process() -> None:
+    """Test get_threads_per_process."""
+    assert get_threads_per_process(4, 16) == 4
+    assert get_threads_per_process(3, 16) == 5
+    assert get_threads_per_process(32, 16) == 1
+    assert get_threads_per_process(1) >= 1
+
+
+def test_get_batch_size() -> None:
+    """Test get_batch_size."""
+    assert get_batch_size(1000, 10) == 25
+    assert get_batch_size(1001, 10) == 26
+    assert get_batch_size(3, 10) == 1
+    assert get_batch_size(0, 10) == 1
+    assert get_batch_size(100, 5, batches_per_process=1) == 20
+
+
+def test_process_pool() -> None:
+    """Test that process_pool splits the thread budget and restores the environment."""
+    previous_max_threads = os.environ.get("POLARS_MAX_THREADS")
+    with process_pool(2, total_threads=2) as executor:
+        thread_pool_sizes = [
+            future.result()
+            for future in [executor.submit(pl.thread_pool_size) for _ in range(4)]
+        ]
+    assert thread_pool_sizes == [1, 1, 1, 1]
+    assert os.environ.get("POLARS_MAX_THREADS") == previous_max_threads
+
+
+def test_run_batch() -> None:
+    """Test run_batch."""
+    assert run_batch([(pow, (2, 3)), (max, (1, 5, 2)), (str, ())]) == [8, 5, ""]
+
+
+def test_process_pool_benchmark(tmp_path: Path) -> None:
+    """Benchmark converting trace files with different process and thread splits."""
+    # Create many small files
+    num_files = 32
+    source_paths = [
+        tmp_path / f"test_file_{i}.trace_mpiio_optimized" for i in range(num_files)
+    ]
+    num_rows = sum(
+        len(generate_random_trace_binary(path, num_meshblocks=16, seed=42 + i))
+        for i, path in enumerate(source_paths)
+    )
+    tasks = [
+        (_trace_reader, (path, path.with_suffix(".parquet"))) for path in source_paths
+    ]
+
+    # Convert the files serially for reference
+    serial_directory = tmp_path / "serial"
+    serial_directory.mkdir()
+    reference_data = [
+        pl.read_parquet(_trace_reader(path, serial_directory / f"{path.stem}.parquet"))
+        for path in source_paths
+    ]
+
+    # Time each split of the same thread budget, batching the files
+    for num_processes, threads_per_process in ((1, 2), (2, 1)):
+        with process_pool(
+            num_processes, total_threads=num_processes * threads_per_process
+        ) as executor:
+            batch_size = get_batch_size(num_files, num_processes)
+            start = default_timer()
+            results = executor.map(
+                run_batch,
+                [tasks[i : i + batch_size] for i in range(0, num_files, batch_size)],
+            )
+            output_paths = [path for batch in results for path in batch]
+            elapsed = default_timer() - start
+        print(
+            f"Trace conversion with {num_processes} processes and "
+            f"{threads_per_process} threads each: {elapsed:.4f}s, "
+            f"{num_rows / elapsed:.3e} rows/s"
+        )
+
+        # The output should be the same as converting the files serially
+        assert output_paths == [path.with_suffix(".parquet") for path in source_paths]
+        for output_path, reference in zip(output_paths, reference_data, strict=True):
+            polars.testing.assert_frame_equal(pl.read_parquet(output_path), reference)
@@ -42,11 +42,103 @@ def test_load_hst_file() -> None:
     schema = [name.split("=")[1] for name in column_header.split()[1:]]
     fiducial_df = pl.from_numpy(hst_arr, schema)
 
-    # Load the data
+    # Load the data, without and with the cache
+    cache_path = hst_path.with_name(hst_path.name + ".parquet")
+    cache_path.unlink(missing_ok=True)
+    uncached_df = pt.load_hst_file(hst_path, use_cache=False)
+    assert not cache_path.exists()
     test_df = pt.load_hst_file(hst_path)
+    assert cache_path.exists()
+    cached_df = pt.load_hst_file(hst_path)
 
     # Verify correctness
+    polars.testing.assert_frame_equal(uncached_df, fiducial_df)
     polars.testing.assert_frame_equal(test_df, fiducial_df)
+    polars.testing.assert_frame_equal(cached_df, fiducial_df)
+
+    # Cleanup the cache
+    cache_path.unlink()
+
+
+def test_load_hst_file_columns_and_cache() -> None:
+    """Test the columns argument, restart handling, and cache invalidation."""
+    # Setup paths
+    hst_path = Path(__file__).parent.resolve() / "data" / "test_load_hst_file.hst"
+    cache_path = hst_path.with_name(hst_path.name + ".parquet")
+    cache_path.unlink(missing_ok=True)
+
+    # Mock up a .hst file with a restart
+    def write_hst(time: np.ndarray) -> None:
+        with hst_path.open("w") as hst_file:
+            hst_file.write("# Pegasus++ history data\n")
+            hst_file.write("# [1]=time     [2]=dt       [3]=mass   \n")
+            hst_arr = np.stack([time, 2 * time, 3 * time], axis=1)
+            np.savetxt(hst_file, hst_arr, delimiter=" ", fmt="% 6.5e")
+
+    write_hst(np.array([0, 1, 2, 3, 2, 3, 4], dtype=np.float32))
+    fiducial_df = pl.DataFrame(
+        {"mass": [0, 3, 6, 9, 12], "time": [0, 1, 2, 3, 4]},
+        schema_overrides={
+            "mass": pl.Float32,
+            "time": pl.Float32,
+        },
+    )
+
+    # Load a subset of the columns, both parsed and from the cache
+    for use_cache in [False, True, True]:
+        test_df = pt.load_hst_file(hst_path, ["mass", "time"], use_cache=use_cache)
+        polars.testing.assert_frame_equal(test_df, fiducial_df)
+
+    # Appending to the file invalidates the cache
+    write_hst(np.array([0, 1, 2, 3, 2, 3, 4, 5], dtype=np.float32))
+    test_df = pt.load_hst_file(hst_path, ["dt"])
+    polars.testing.assert_series_equal(
+        test_df["dt"], pl.Series("dt", [0, 2, 4, 6, 8, 10], dtype=pl.Float32)
+    )
+
+    # Requesting a missing column raises an error
+    with pytest.raises(ValueError, match="energy is not a column in"):
+        pt.load_hst_file(hst_path, ["energy"])
+
+    # Cleanup
+    cache_path.unlink()
+
+
+def test_scan_hst() -> None:
+    """Test scan_hst, with and without the cache."""
+    # Setup paths
+    hst_path = Path(__file__).parent.resolve() / "data" / "test_scan_hst.hst"
+    cache_path = hst_path.with_name(hst_path.name + ".parquet")
+    cache_path.unlink(missing_ok=True)
+
+    # Mock up a .hst file with a restart
+    time = np.array([0, 1, 2, 3, 4, 5, 3, 4, 5, 6, 7], dtype=np.float32)
+    with hst_path.open("w") as hst_file:
+        hst_file.write("# Athena++ history data\n")
+        hst_file.write("# [1]=time     [2]=dt       [3]=1-KE   \n")
+        hst_arr = np.stack([time, np.ones_like(time), 2 * time], axis=1)
+        np.savetxt(hst_file, hst_arr, delimiter=" ", fmt="% 6.5e")
+
+    fiducial_df = pl.DataFrame(
+        {"time": [2, 3, 4, 5], "1-KE": [4, 6, 8, 10]},
+        schema_overrides={"time": pl.Float32, "1-KE": pl.Float32},
+    )
+
+    # Scan and filter a time window
+    for use_cache in [False, True, True]:
+        test_lf = pt.scan_hst(hst_path, use_cache=use_cache)
+        assert isinstance(test_lf, pl.LazyFrame)
+        assert cache_path.exists() == use_cache
+        test_df = (
+            test_lf.filter(pl.col("time").is_between(2, 5))
+            .select("time", "1-KE")
+            .collect()
+        )
+        polars.testing.assert_frame_equal(test_df, fiducial_df)
+
+    # Cleanup
+    cache_path.unlink()
+    hst_path.unlink()
 
 
 def test_load_hst_file_invalid_file() -> None:
@@ -63,3 +155,117 @@ def test_load_hst_file_invalid_file() -> None:
     )
     with pytest.raises(RuntimeError, match=re.escape(err_msg)):
         pt.load_hst_file(hst_path)
+
+
+def test_history_follower() -> None:
+    """Test that HistoryFollower matches load_hst_file as a file is appended to."""
+    # Setup paths
+    hst_path = Path(__file__).parent.resolve() / "data" / "test_history_follower.hst"
+    with hst_path.open("w") as hst_file:
+        hst_file.write("# Pegasus++ history data\n")
+        hst_file.write("# [1]=time     [2]=dt       [3]=mass   \n")
+
+    def append_rows(time: list[float], partial_line: str = "") -> None:
+        with hst_path.open("a") as hst_file:
+            hst_arr = np.stack([time, np.ones(len(time)), np.square(time)], axis=1)
+            np.savetxt(hst_file, hst_arr, delimiter=" ", fmt="% 6.5e")
+            hst_file.write(partial_line)
+
+    follower = pt.HistoryFollower(hst_path, ["mass"])
+    assert follower.update().shape == (0, 1)
+
+    # Append data, a restart that overlaps several steps, and then a partial line
+    for time, partial_line in [
+        ([0.0, 1.0, 2.0, 3.0, 4.0], ""),
+        ([5.0, 6.0], ""),
+        ([3.0, 4.0, 5.0], " 6.0000e+00  1.0000e"),
+        ([], "+00  3.6000e+01\n"),
+        ([6.0, 2.0, 3.0], ""),
+    ]:
+        append_rows(time, partial_line)
+        test_df = follower.update()
+
+        # The partial line is not loaded until it is complete
+        if not partial_line.endswith("\n") and partial_line != "":
+            assert follower.offset == hst_path.stat().st_size - len(partial_line)
+            assert test_df["mass"].to_list() == [0, 1, 4, 9, 16, 25]
+            continue
+
+        fiducial_df = pt.load_hst_file(hst_path, ["mass"], use_cache=False)
+        polars.testing.assert_frame_equal(test_df, fiducial_df)
+        assert follower.offset == hst_path.stat().st_size
+
+    # A replaced file is reloaded from the beginning
+    with hst_path.open("w") as hst_file:
+        hst_file.write("# Pegasus++ history data\n")
+        hst_file.write("# [1]=time     [2]=dt       [3]=mass   \n")
+    append_rows([0, 1])
+    polars.testing.assert_frame_equal(
+        follower.update(), pt.load_hst_file(hst_path, ["mass"], use_cache=False)
+    )
+
+    # Cleanup
+    hst_path.unlink()
+
+
+def test_load_hst_runs() -> None:
+    """Test load_hst_runs."""
+    # Setup paths
+    data_dir = Path(__file__).parent.resolve() / "data"
+    runs = {
+        "slow": data_dir / "test_load_hst_runs_slow.hst",
+        "fast": data_dir / "test_load_hst_runs_fast.hst",
+    }
+
+    # Mock up two .hst files with different cadences and time ranges
+    times = {
+        "slow": np.linspace(0, 10, 11, dtype=np.float32),
+        "fast": np.linspace(1, 12, 45, dtype=np.float32),
+    }
+    slopes = {"slow": 2, "fast": 3}
+    for name, path in runs.items():
+        with path.open("w") as hst_file:
+            hst_file.write("# Athena++ history data\n")
+            hst_file.write("# [1]=time     [2]=dt       [3]=mass   \n")
+            hst_arr = np.stack(
+                [times[name], np.ones_like(times[name]), slopes[name] * times[name]],
+                axis=1,
+            )
+            np.savetxt(hst_file, hst_arr, delimiter=" ", fmt="% 6.5e")
+
+    # Default grid covers the common time range
+    test_df = pt.load_hst_runs(runs, ["mass"], num_processes=2)
+    assert test_df.columns == ["run", "time", "mass"]
+    assert test_df["run"].to_list() == ["slow"] * 45 + ["fast"] * 45
+    time_grid = np.linspace(1, 10, 45, dtype=np.float32)
+    for name in runs:
+        run_df = test_df.filter(pl.col("run") == name)
+        np.testing.assert_allclose(run_df["time"].to_numpy(), time_grid, rtol=1e-6)
+        np.testing.assert_allclose(
+            run_df["mass"].to_numpy(), slopes[name] * time_grid, rtol=1e-5
+        )
+
+    # User provided grid
+    time_grid = np.array([2.5, 3.5])
+    test_df = pt.load_hst_runs(runs, time_grid=time_grid)
+    assert test_df.columns == ["run", "time", "dt", "mass"]
+    np.testing.assert_allclose(test_df["mass"].to_numpy(), [5, 7, 7.5, 10.5], rtol=1e-5)
+
+    # Times outside of the range of a run are NaN, not extrapolated
+    test_df = pt.load_hst_runs(runs, ["mass"], time_grid=np.array([0.5, 11.0]))
+    np.testing.assert_allclose(
+        test_df["mass"].to_numpy(), [1, np.nan, np.nan, 33], rtol=1e-5
+    )
+
+    # Runs that don't overlap in time raise an error
+    with runs["fast"].open("w") as hst_file:
+        hst_file.write("# Athena++ history data\n")
+        hst_file.write("# [1]=time     [2]=dt       [3]=mass   \n")
+        hst_file.write("2.0e+01 1.0e+00 1.0e+00\n3.0e+01 1.0e+00 1.0e+00\n")
+    with pytest.raises(ValueError, match="do not overlap in time"):
+        pt.load_hst_runs(runs)
+
+    # Cleanup
+    for path in runs.values():
+        path.unlink()
+        path.with_name(path.name + ".parquet").unlink()
@@ -3,8 +3,10 @@
 import re
 import struct
 from pathlib import Path
+from timeit import default_timer
 
 import numpy as np
+import polars.testing
 import pytest
 
 import pegasustools as pt
@@ -44,6 +46,286 @@ def test_PegasusNBFData(dims: int) -> None:
         np.testing.assert_array_max_ulp(np.squeeze(fid_field), test_field, maxulp=0)
 
 
+@pytest.mark.parametrize("dims", [1, 2, 3])
+def test_PegasusNBFData_mmap(dims: int) -> None:
+    """Test pt.PegasusNBFData with mmap=True for 1D, 2D, & 3D data."""
+    # Setup paths
+    file_path = (
+        Path(__file__).parent.resolve()
+        / "data"
+        / f"test_PegasusNBFData_mmap_{dims}d.nbf"
+    )
+
+    # Create test file & nbf_data
+    fiducial_data = generate_random_nbf_file(file_path, seed=42, dims=dims)
+
+    # Load file
+    test_data = pt.PegasusNBFData(file_path, mmap=True)
+
+    # Compare header data
+    np.testing.assert_array_max_ulp(fiducial_data.time, test_data.time, maxulp=3)
+    assert fiducial_data.list_of_variables == list(test_data.data)
+    assert fiducial_data.mesh_params == test_data.mesh_params
+
+    # Compare field data
+    for key in test_data.data:
+        fid_field = np.squeeze(fiducial_data.data[key])
+        test_field = test_data.data[key]
+
+        assert fid_field.shape == test_field.shape
+        np.testing.assert_array_max_ulp(fid_field, test_field, maxulp=0)
+
+    # Cleanup the file created
+    del test_data
+    file_path.unlink()
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_PegasusNBFData_load_subvolume(*, mmap: bool) -> None:
+    """Test pt.PegasusNBFData.load_subvolume with and without mmap."""
+    # Setup paths
+    file_path = (
+        Path(__file__).parent.resolve() / "data" / "test_PegasusNBFData_subvolume.nbf"
+    )
+
+    # Create test file & nbf_data
+    fiducial_data = generate_random_nbf_file(file_path, seed=42, dims=3)
+
+    # Load file
+    test_data = pt.PegasusNBFData(file_path, mmap=mmap)
+
+    # Pick a region that crosses meshblock boundaries in every direction
+    region = ((5, 40), (3, 20), (60, 100))
+    fid_field = fiducial_data.data["Bcc2"][5:40, 3:20, 60:100]
+    test_field = test_data.load_subvolume("Bcc2", region)
+
+    assert fid_field.shape == test_field.shape
+    np.testing.assert_array_max_ulp(fid_field, test_field, maxulp=0)
+
+    # Check that bad requests are caught
+    with pytest.raises(KeyError):
+        test_data.load_subvolume("not_a_field", region)
+    with pytest.raises(ValueError, match="is not contained within the mesh"):
+        test_data.load_subvolume("Bcc2", ((0, 65), (0, 1), (0, 1)))
+
+    # Cleanup the file created
+    del test_data
+    file_path.unlink()
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_PegasusNBFData_fields_and_region(*, mmap: bool) -> None:
+    """Test loading a subset of the fields and a region with pt.PegasusNBFData."""
+    # Setup paths
+    file_path = (
+        Path(__file__).parent.resolve() / "data" / "test_PegasusNBFData_region.nbf"
+    )
+
+    # Create test file & nbf_data
+    fiducial_data = generate_random_nbf_file(file_path, seed=42, dims=3)
+
+    # Load file
+    fields = ["Bcc1", "Bcc2", "Bcc3"]
+    region = ((10, 50), (0, 17), (64, 128))
+    test_data = pt.PegasusNBFData(file_path, mmap=mmap, fields=fields, region=region)
+
+    # The header still describes the whole file
+    assert fiducial_data.list_of_variables == test_data.list_of_variables
+    assert test_data.region == region
+
+    # Compare field data
+    assert list(test_data.data) == fields
+    for key in fields:
+        fid_field = fiducial_data.data[key][10:50, 0:17, 64:128]
+        test_field = test_data.data[key]
+
+        assert fid_field.shape == test_field.shape
+        np.testing.assert_array_max_ulp(fid_field, test_field, maxulp=0)
+
+    # Sub-volumes are relative to the whole mesh
+    np.testing.assert_array_max_ulp(
+        np.squeeze(fiducial_data.data["Bcc3"][20:30, 5:6, 70:80]),
+        test_data.load_subvolume("Bcc3", ((20, 30), (5, 6), (70, 80))),
+        maxulp=0,
+    )
+
+    # Check that bad requests are caught
+    with pytest.raises(ValueError, match="not_a_field is not a variable in"):
+        pt.PegasusNBFData(file_path, mmap=mmap, fields=["not_a_field"])
+
+    # Cleanup the file created
+    del test_data
+    file_path.unlink()
+
+
+@pytest.mark.parametrize("num_workers", [2, 3, 16])
+def test_PegasusNBFData_num_workers(num_workers: int) -> None:
+    """Test reading meshblocks concurrently with pt.PegasusNBFData."""
+    # Setup paths
+    file_path = (
+        Path(__file__).parent.resolve() / "data" / "test_PegasusNBFData_workers.nbf"
+    )
+
+    # Create test file & nbf_data
+    fiducial_data = generate_random_nbf_file(file_path, seed=42, dims=3)
+
+    # Load file
+    test_data = pt.PegasusNBFData(file_path, num_workers=num_workers)
+
+    # Compare field data
+    for key in fiducial_data.list_of_variables:
+        np.testing.assert_array_max_ulp(
+            fiducial_data.data[key], test_data.data[key], maxulp=0
+        )
+
+    # Check that truncated files are caught
+    with file_path.open("r+b") as nbf_file:
+        nbf_file.truncate(file_path.stat().st_size - 4)
+    with pytest.raises(OSError, match="is truncated"):
+        pt.PegasusNBFData(file_path, num_workers=num_workers)
+
+    # Cleanup the file created
+    file_path.unlink()
+
+
+def test_PegasusNBFData_header_only() -> None:
+    """Test that pt.PegasusNBFData only loads the header when fields is empty."""
+    # Setup paths
+    file_path = (
+        Path(__file__).parent.resolve() / "data" / "test_PegasusNBFData_header.nbf"
+    )
+
+    # Create test file & nbf_data
+    fiducial_data = generate_random_nbf_file(file_path, seed=42, dims=2)
+
+    # Load file
+    test_data = pt.PegasusNBFData(file_path, fields=[])
+
+    assert len(test_data.data) == 0
+    assert fiducial_data.num_meshblocks == test_data.num_meshblocks
+    assert fiducial_data.mesh_params == test_data.mesh_params
+
+    # Loading a region outside of what was loaded isn't possible
+    with pytest.raises(ValueError, match="is not contained within the loaded region"):
+        pt.PegasusNBFData(file_path, region=((0, 2), (0, 2), (0, 1))).load_subvolume(
+            "dens", ((0, 3), (0, 2), (0, 1))
+        )
+
+    # Cleanup the file created
+    file_path.unlink()
+
+
+def test_PegasusNBFData_benchmark() -> None:
+    """Benchmark pt.PegasusNBFData against a per-meshblock reference loader."""
+    # Setup paths
+    file_path = (
+        Path(__file__).parent.resolve() / "data" / "test_PegasusNBFData_benchmark.nbf"
+    )
+
+    # Create a test file with many small meshblocks
+    fiducial_data = generate_random_nbf_file(
+        file_path, seed=42, dims=3, meshblock_size=(8, 8, 8), meshblock_per_side=8
+    )
+
+    # Time both loaders, keeping the best of several runs
+    num_runs = 5
+    reference_times = []
+    test_times = []
+    for _ in range(num_runs):
+        start = default_timer()
+        reference_data = reference_nbf_loader(file_path)
+        reference_times.append(default_timer() - start)
+
+        start = default_timer()
+        test_data = pt.PegasusNBFData(file_path)
+        test_times.append(default_timer() - start)
+
+    print(
+        f"NBF loading: reference {min(reference_times):.4f}s, "
+        f"pt.PegasusNBFData {min(test_times):.4f}s, "
+        f"speedup {min(reference_times) / min(test_times):.2f}x"
+    )
+
+    # Both loaders should match the data that was written
+    assert list(reference_data) == list(test_data.data)
+    for key, reference_field in reference_data.items():
+        fid_field = np.squeeze(fiducial_data.data[key])
+        np.testing.assert_array_max_ulp(fid_field, reference_field, maxulp=0)
+        np.testing.assert_array_max_ulp(fid_field, test_data.data[key], maxulp=0)
+
+    # Cleanup the file created
+    file_path.unlink()
+
+
+def test_PegasusNBFSeries() -> None:
+    """Test pt.PegasusNBFSeries."""
+    # Setup paths
+    directory = Path(__file__).parent.resolve() / "data" / "test_PegasusNBFSeries"
+    directory.mkdir(exist_ok=True)
+
+    # Create test files, the seeds are chosen so the files aren't in time order
+    num_files = 4
+    fiducial_data = [
+        generate_random_nbf_file(directory / f"series.{i:05}.nbf", seed=42 + i, dims=2)
+        for i in range(num_files)
+    ]
+    fiducial_data = sorted(fiducial_data, key=lambda nbf: nbf.time)
+
+    # Index the files
+    series = pt.PegasusNBFSeries(directory, cache_size=2)
+    assert len(series) == num_files
+    # The times are written with 15 significant figures
+    np.testing.assert_allclose(
+        np.array([nbf.time for nbf in fiducial_data]), series.times, rtol=1e-14
+    )
+
+    # The index is built from the catalog, reopening the series reuses it
+    catalog_path = directory / ".pegasustools_catalog.parquet"
+    assert catalog_path.exists()
+    for nbf, row in zip(fiducial_data, series.index.iter_rows(named=True), strict=True):
+        assert row["num_meshblocks"] == nbf.num_meshblocks
+        assert row["list_of_variables"] == nbf.list_of_variables
+        assert [row["nx1"], row["nx2"], row["nx3"]] == [
+            nbf.mesh_params[f"nx{i}"] for i in (1, 2, 3)
+        ]
+    polars.testing.assert_frame_equal(
+        pt.PegasusNBFSeries(directory).index, series.index
+    )
+
+    # Access a field lazily
+    bcc1 = series.field("Bcc1")
+    assert bcc1.shape == (num_files, *np.squeeze(fiducial_data[0].data["Bcc1"]).shape)
+    np.testing.assert_array_max_ulp(
+        np.squeeze(fiducial_data[2].data["Bcc1"]), bcc1[2], maxulp=0
+    )
+    np.testing.assert_array_max_ulp(
+        np.stack([np.squeeze(nbf.data["Bcc1"])[3:9, 7] for nbf in fiducial_data[1:]]),
+        bcc1[1:, 3:9, 7],
+        maxulp=0,
+    )
+    with pytest.raises(KeyError):
+        series.field("not_a_field")
+    with pytest.raises(IndexError):
+        _ = bcc1[num_files]
+
+    # Iterate with prefetching
+    for fiducial, snapshot in zip(
+        fiducial_data, series.iter_snapshots(fields=["dens"], prefetch=2), strict=True
+    ):
+        assert list(snapshot.data) == ["dens"]
+        np.testing.assert_array_max_ulp(
+            np.squeeze(fiducial.data["dens"]), snapshot.data["dens"], maxulp=0
+        )
+
+    # Check that an empty directory is caught
+    with pytest.raises(FileNotFoundError, match="No files matching"):
+        pt.PegasusNBFSeries(directory, pattern="*.not_nbf")
+
+    # Cleanup the files created
+    [f.unlink() for f in directory.glob("*.nbf")]  # type: ignore[func-returns-value]
+    catalog_path.unlink()
+
+
 def test_PegasusNBFData_too_small() -> None:
     """Test for the exception that should appear if the file is too small."""
     # Setup paths
@@ -123,7 +405,11 @@ class MockPegasusNBFData:
 
 
 def generate_random_nbf_file(
-    path: Path, seed: int | None = None, dims: int = 3
+    path: Path,
+    seed: int | None = None,
+    dims: int = 3,
+    meshblock_size: tuple[int, int, int] = (32, 16, 64),
+    meshblock_per_side: int = 2,
 ) -> MockPegasusNBFData:
     """Create a MockPegasusNBFData object filled with random data & write it to a file.
 
@@ -138,6 +424,10 @@ def generate_random_nbf_file(
         entropy
     dims : int, optional
         The number of dimensions of the data, by default 3
+    meshblock_size : tuple[int, int, int], optional
+        The size of each meshblock in (x1, x2, x3), by default (32, 16, 64)
+    meshblock_per_side : int, optional
+        The number of meshblocks along each dimension, by default 2
 
     Returns
     -------
@@ -148,13 +438,16 @@ def generate_random_nbf_file(
     rng = np.random.default_rng(seed)
 
     # Determine the number of dimensions
-    meshblock_params = {"nx1": 32, "nx2": 16, "nx3": 64}
+    meshblock_params = {
+        "nx1": meshblock_size[0],
+        "nx2": meshblock_size[1],
+        "nx3": meshblock_size[2],
+    }
     if dims < 3:
         meshblock_params["nx3"] = 1
     if dims < 2:
         meshblock_params["nx2"] = 1
 
-    meshblock_per_side = 2
     size = meshblock_per_side * np.array(
         (meshblock_params["nx1"], meshblock_params["nx2"], meshblock_params["nx3"])
     )
@@ -288,3 +581,68 @@ def create_nbf(filepath: Path, nbf_data: MockPegasusNBFData) -> None:
                         ]
                         subset = np.swapaxes(subset, 0, 2)
                         subset.flatten().tofile(nbf_file)
+
+
+def reference_nbf_loader(file_path: Path) -> dict[str, np.typing.NDArray[np.float32]]:
+    """Load an NBF file one meshblock and one variable at a time.
+
+    This is the original loading algorithm and is only used as a baseline for
+    benchmarks.
+
+    Parameters
+    ----------
+    file_path : Path
+        The path to the NBF file
+
+    Returns
+    -------
+    dict[str, np.typing.NDArray[np.float32]]
+        The fields in the file formatted as (Nx1, Nx2, Nx3)
+    """
+    with file_path.open(mode="rb") as nbf_file:
+        header = [next(nbf_file).decode("ascii") for _ in range(9)]
+        header_size = nbf_file.tell()
+
+        num_meshblocks = int(header[2].split()[-1])
+        list_of_variables = header[4].split()[1:]
+        mesh = dict(
+            element.split("=")
+            for element in (header[5] + header[6] + header[7]).split()[1:]
+        )
+        meshblock = dict(element.split("=") for element in header[8].split()[1:])
+        meshblock_shape = (
+            int(meshblock["nx3"]),
+            int(meshblock["nx2"]),
+            int(meshblock["nx1"]),
+        )
+        block_size = int(np.prod(meshblock_shape))
+        meshblock_header_size = 48
+        meshblock_size = meshblock_header_size + 4 * len(list_of_variables) * block_size
+
+        data = {
+            key: np.empty(
+                (int(mesh["nx3"]), int(mesh["nx2"]), int(mesh["nx1"])),
+                dtype=np.float32,
+            )
+            for key in list_of_variables
+        }
+
+        for meshblock_id in range(num_meshblocks):
+            nbf_file.seek(header_size + meshblock_id * meshblock_size)
+            coords = struct.unpack("@4i2fi2fi2f", nbf_file.read(meshblock_header_size))
+            i_start = coords[0] * meshblock_shape[2]
+            j_start = coords[1] * meshblock_shape[1]
+            k_start = coords[2] * meshblock_shape[0]
+
+            block = np.fromfile(
+                nbf_file, dtype=np.float32, count=block_size * len(list_of_variables)
+            ).reshape(len(list_of_variables), *meshblock_shape)
+
+            for nv, key in enumerate(list_of_variables):
+                data[key][
+                    k_start : k_start + meshblock_shape[0],
+                    j_start : j_start + meshblock_shape[1],
+                    i_start : i_start + meshblock_shape[2],
+                ] = block[nv]
+
+    return {key: np.squeeze(np.swapaxes(field, 0, 2)) for key, field in data.items()}
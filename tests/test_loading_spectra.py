@@ -119,6 +119,52 @@ def test_PegasusSpectralData_reduce_spectra() -> None:
     assert test.max_w_prp == max_w_prp
 
 
+def test_PegasusSpectralData_mmap() -> None:
+    """Test pt.PegasusSpectralData with mmap=True."""
+    # Setup path
+    file_path = (
+        Path(__file__).parent.resolve() / "data" / "test_PegasusSpectralData_mmap.spec"
+    )
+
+    for header_type in (True, False):
+        # Create the file
+        time, fiducial_data, meshblock_locations = generate_random_spec_file(
+            file_path,
+            seed=42,
+            num_meshblocks=7,
+            new_header=header_type,
+        )
+
+        # Load test data
+        test = pt.PegasusSpectralData(file_path, mmap=True)
+
+        # Verify the metadata, spectra, and meshblock locations
+        assert time == test.time
+        assert isinstance(test.data, np.memmap)
+        assert test.data.shape == (7, 200, 400)
+        np.testing.assert_array_max_ulp(fiducial_data, test.data, maxulp=0)
+        polars.testing.assert_frame_equal(
+            meshblock_locations, test.meshblock_locations, abs_tol=0.0
+        )
+
+        # Streaming the reduction in chunks gives the same result as loading the file
+        test.reduce_spectra(chunk_size=3)
+        fiducial = pt.PegasusSpectralData(file_path)
+        fiducial.reduce_spectra()
+        np.testing.assert_array_max_ulp(
+            fiducial.spectra_prp, test.spectra_prp, maxulp=0
+        )
+        np.testing.assert_array_max_ulp(
+            fiducial.spectra_prl, test.spectra_prl, maxulp=0
+        )
+        del test
+
+    # Files of the wrong size are still rejected
+    with pytest.raises(ValueError, match="does not have the right number of elements"):
+        _ = pt.PegasusSpectralData(file_path, n_prp=17, mmap=True)
+    file_path.unlink()
+
+
 def test_PegasusSpectralData_specav() -> None:
     """Test that pt.PegasusSpectralData can open specav files with multiple species."""
     # Setup path
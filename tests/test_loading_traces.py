@@ -1,12 +1,17 @@
 """Tests for the contents of loading_traces.py."""
 
+import logging
 from pathlib import Path
 
 import numpy as np
 import polars as pl
 import polars.testing
+import pytest
 
 import pegasustools as pt
+from pegasustools.checkpoint import CollationCheckpoint
+from pegasustools.loading_traces import _trace_reader
+from pegasustools.loading_tracks import _hash_file_names
 
 
 def test_collate_tracks_from_binary() -> None:
@@ -46,10 +51,354 @@ def test_collate_tracks_from_binary() -> None:
     polars.testing.assert_frame_equal(test_data, fiducial_data)
 
     # Cleanup the files created
-    [f.unlink() for f in source_directory.glob("*.track_mpiio_optimized")]  # type: ignore[func-returns-value]
+    [f.unlink() for f in source_directory.glob("*.trace_mpiio_optimized")]  # type: ignore[func-returns-value]
+    (source_directory / ".pegasustools_catalog.parquet").unlink()
     [f.unlink() for f in parquet_directory.glob("*.parquet")]  # type: ignore[func-returns-value]
 
 
+def test_collate_traces_resume(caplog: pytest.LogCaptureFixture) -> None:
+    """Test that collate_traces resumes from a checkpoint."""
+    # Setup paths
+    source_directory = (
+        Path(__file__).parent.resolve() / "data" / "test_collate_traces_resume"
+    )
+    parquet_directory = source_directory / "parquet"
+    source_directory.mkdir(exist_ok=True)
+    parquet_directory.mkdir(exist_ok=True)
+
+    # Generate test data
+    num_files = 3
+    source_paths = [
+        source_directory / f"test_file_{i}.trace_mpiio_optimized"
+        for i in range(num_files)
+    ]
+    fiducial_data = pl.concat(
+        [
+            generate_random_trace_binary(path, seed=42 + i)
+            for i, path in enumerate(source_paths)
+        ]
+    ).sort(["block_id", "time"])
+
+    # Simulate a run that failed after converting the first file
+    num_procs = 2
+    checkpoint = CollationCheckpoint(
+        parquet_directory,
+        "collate_traces",
+        {
+            "source_dir": source_directory,
+            "source_files": _hash_file_names(source_paths),
+            "num_processes": num_procs,
+            "columns": None,
+            "float32_columns": None,
+            "time_stride": 1,
+            "cadence": None,
+        },
+    )
+    first_temp_path = _trace_reader(
+        source_paths[0], parquet_directory / "test_file_0_temp.parquet"
+    )
+    checkpoint.complete_chunk("convert", source_paths[0].name, [first_temp_path])
+    checkpoint.save()
+
+    # Run the code to test
+    caplog.set_level(logging.INFO, logger="pt.logger")
+    pt.collate_traces(
+        num_processes=num_procs,
+        source_dir=source_directory,
+        destination_dir=parquet_directory,
+    )
+    test_data = pl.read_parquet(parquet_directory)
+
+    # Verify the results, that the first file wasn't converted again, and that the
+    # checkpoint was removed
+    polars.testing.assert_frame_equal(test_data, fiducial_data)
+    assert "Stage 'convert': 1 of 3 chunks already complete" in caplog.text
+    assert not checkpoint.manifest_path.exists()
+
+    # Cleanup the files created
+    [f.unlink() for f in source_paths]  # type: ignore[func-returns-value]
+    (source_directory / ".pegasustools_catalog.parquet").unlink()
+    [f.unlink() for f in parquet_directory.glob("*.parquet")]  # type: ignore[func-returns-value]
+
+
+def test_collate_traces_reduction() -> None:
+    """Test collate_traces with column projection, downcasting, and decimation."""
+    # Setup paths
+    source_directory = (
+        Path(__file__).parent.resolve() / "data" / "test_collate_traces_reduction"
+    )
+    parquet_directory = source_directory / "parquet"
+    source_directory.mkdir(exist_ok=True)
+
+    # Generate test data
+    num_files = 3
+    source_paths = [
+        source_directory / f"test_file_{i}.trace_mpiio_optimized"
+        for i in range(num_files)
+    ]
+    raw_data = [
+        generate_random_trace_binary(path, seed=42 + i)
+        for i, path in enumerate(source_paths)
+    ]
+
+    # Keep every other sample of each trace in each file, then the earliest sample of
+    # each trace in each cadence interval across all the files
+    time_stride = 2
+    cadence = 2.5
+    columns = ["B1", "B2", "B3"]
+    fiducial_data = (
+        pl.concat(
+            [
+                df.sort(["block_id", "time"])
+                .group_by("block_id", maintain_order=True)
+                .agg(pl.all().gather_every(time_stride))
+                .explode([name for name in df.columns if name != "block_id"])
+                for df in raw_data
+            ]
+        )
+        .sort(["block_id", "time"])
+        .with_columns(interval=(pl.col("time") / cadence).floor())
+        .unique(["block_id", "interval"], keep="first", maintain_order=True)
+        .select(["block_id", "time", *columns])
+        .with_columns(pl.col(columns).cast(pl.Float32))
+    )
+
+    # Run the code to test
+    pt.collate_traces(
+        num_processes=2,
+        source_dir=source_directory,
+        destination_dir=parquet_directory,
+        columns=columns,
+        float32_columns=columns,
+        time_stride=time_stride,
+        cadence=cadence,
+    )
+    test_data = pl.read_parquet(parquet_directory)
+
+    # Verify the results
+    polars.testing.assert_frame_equal(test_data, fiducial_data)
+
+    # Invalid options
+    with pytest.raises(ValueError, match="time_stride must be at least 1"):
+        pt.collate_traces(2, source_directory, parquet_directory, time_stride=0)
+    with pytest.raises(ValueError, match="cadence must be positive"):
+        pt.collate_traces(2, source_directory, parquet_directory, cadence=0.0)
+    with pytest.raises(ValueError, match="not_a_column is not a column"):
+        _trace_reader(
+            source_paths[0],
+            parquet_directory / "test_file_0_temp.parquet",
+            columns=["not_a_column"],
+        )
+
+    # Cleanup the files created
+    [f.unlink() for f in source_paths]  # type: ignore[func-returns-value]
+    (source_directory / ".pegasustools_catalog.parquet").unlink()
+    [f.unlink() for f in parquet_directory.glob("*.parquet")]  # type: ignore[func-returns-value]
+
+
+def test_PegasusTraceStore() -> None:
+    """Test pt.PegasusTraceStore."""
+    # Setup paths
+    source_directory = (
+        Path(__file__).parent.resolve() / "data" / "test_PegasusTraceStore"
+    )
+    parquet_directory = source_directory / "parquet"
+    source_directory.mkdir(exist_ok=True)
+
+    # Generate and collate test data
+    num_files = 3
+    source_paths = [
+        source_directory / f"test_file_{i}.trace_mpiio_optimized"
+        for i in range(num_files)
+    ]
+    fiducial_data = pl.concat(
+        [
+            generate_random_trace_binary(path, seed=42 + i)
+            for i, path in enumerate(source_paths)
+        ]
+    ).sort(["block_id", "time"])
+    pt.collate_traces(
+        num_processes=2,
+        source_dir=source_directory,
+        destination_dir=parquet_directory,
+    )
+
+    # Read single traces and several traces across files
+    store = pt.PegasusTraceStore(parquet_directory)
+    assert len(store.paths) == num_files
+    polars.testing.assert_frame_equal(
+        store.get(37), fiducial_data.filter(pl.col("block_id") == 37)
+    )
+    block_ids = [95, 0, 3, 50, 51]
+    traces = store.get_many(block_ids)
+    assert list(traces) == block_ids
+    for block_id in block_ids:
+        polars.testing.assert_frame_equal(
+            traces[block_id], fiducial_data.filter(pl.col("block_id") == block_id)
+        )
+    with pytest.raises(KeyError, match="no trace with block ID 96"):
+        store.get(96)
+
+    # Files without the index in their metadata are indexed from their contents
+    for path in store.paths:
+        pl.read_parquet(path).write_parquet(path)
+    polars.testing.assert_frame_equal(
+        pt.PegasusTraceStore(parquet_directory).get(70),
+        fiducial_data.filter(pl.col("block_id") == 70),
+    )
+
+    # Cleanup the files created
+    [f.unlink() for f in source_paths]  # type: ignore[func-returns-value]
+    (source_directory / ".pegasustools_catalog.parquet").unlink()
+    [f.unlink() for f in parquet_directory.glob("*.parquet")]  # type: ignore[func-returns-value]
+
+
+def test_transpose_traces() -> None:
+    """Test pt.transpose_traces and pt.PegasusTimeMajorTraces."""
+    # Setup paths
+    source_directory = (
+        Path(__file__).parent.resolve() / "data" / "test_transpose_traces"
+    )
+    parquet_directory = source_directory / "parquet"
+    time_major_directory = source_directory / "time_major"
+    source_directory.mkdir(exist_ok=True)
+
+    # Generate and collate test data
+    num_files = 3
+    source_paths = [
+        source_directory / f"test_file_{i}.trace_mpiio_optimized"
+        for i in range(num_files)
+    ]
+    fiducial_data = pl.concat(
+        [
+            generate_random_trace_binary(path, num_meshblocks=16, seed=42 + i)
+            for i, path in enumerate(source_paths)
+        ]
+    ).sort(["block_id", "time"])
+    pt.collate_traces(
+        num_processes=2,
+        source_dir=source_directory,
+        destination_dir=parquet_directory,
+    )
+
+    # Run the code to test
+    variables = ["B1", "B2", "B3"]
+    pt.transpose_traces(
+        2,
+        parquet_directory,
+        time_major_directory,
+        columns=variables,
+        times_per_chunk=100,
+    )
+    traces = pt.PegasusTimeMajorTraces(time_major_directory)
+    data = traces.load()
+
+    # Verify the results, every probe has the samples of its trace at its times and
+    # NaN at every other time
+    assert traces.variables == variables
+    assert traces.num_time_chunks == 5
+    np.testing.assert_array_equal(traces.times, fiducial_data["time"].unique().sort())
+    np.testing.assert_array_equal(traces.block_ids, np.arange(16))
+    assert data.shape == (len(fiducial_data), 16, len(variables))
+    for probe, block_id in enumerate(traces.block_ids):
+        trace = fiducial_data.filter(pl.col("block_id") == block_id)
+        has_sample = ~np.isnan(data[:, probe, 0])
+        np.testing.assert_array_equal(traces.times[has_sample], trace["time"])
+        np.testing.assert_array_equal(
+            data[has_sample, probe], trace.select(variables).to_numpy()
+        )
+    np.testing.assert_array_equal(traces.load(150, 420), data[150:420])
+
+    # Cleanup the files created
+    [f.unlink() for f in source_paths]  # type: ignore[func-returns-value]
+    (source_directory / ".pegasustools_catalog.parquet").unlink()
+    [f.unlink() for f in parquet_directory.glob("*.parquet")]  # type: ignore[func-returns-value]
+    [f.unlink() for f in time_major_directory.iterdir()]  # type: ignore[func-returns-value]
+
+
+def test_trace_frequency_spectra() -> None:
+    """Test pt.trace_frequency_spectra against a per-probe reference."""
+    # Setup paths
+    directory = (
+        Path(__file__).parent.resolve() / "data" / "test_trace_frequency_spectra"
+    )
+    directory.mkdir(exist_ok=True)
+
+    # Generate collated traces of a sinusoid with noise, split between two files
+    rng = np.random.default_rng(42)
+    dt = 0.1
+    frequency = 1.25
+    num_probes = 8
+    traces = []
+    for block_id in range(num_probes):
+        time = dt * np.arange(1000 + 37 * block_id)
+        if block_id == 1:
+            # A restart that rewrote some of the samples
+            time = np.concatenate([time[:600], time[550:]])
+        elif block_id == 2:
+            # A section with half the cadence
+            time = np.concatenate([time[:300], time[300:500:2], time[500:]])
+        traces.append(
+            pl.DataFrame(
+                {
+                    "block_id": block_id,
+                    "time": time,
+                    "B1": np.sin(2 * np.pi * frequency * time + block_id),
+                    "B2": rng.normal(size=len(time)),
+                }
+            )
+        )
+    for lo, hi in ((0, 3), (4, 7)):
+        pl.concat(traces[lo : hi + 1]).write_parquet(
+            directory / f"test_traces_{lo}_{hi}.parquet"
+        )
+
+    # Run the code to test
+    nperseg = 128
+    fields = ["B1", "B2"]
+    test_data = pt.trace_frequency_spectra(
+        directory, fields, nperseg=nperseg, overlap=0.5, num_processes=2
+    )
+
+    # Compute the reference one probe and one segment at a time
+    window = np.hanning(nperseg + 1)[:-1]
+    reference_power = np.zeros((len(fields), nperseg // 2 + 1))
+    num_segments = 0
+    for trace in traces:
+        time, unique_idx = np.unique(trace["time"].to_numpy(), return_index=True)
+        grid = time[0] + dt * np.arange(round((time[-1] - time[0]) / dt) + 1)
+        for i, field in enumerate(fields):
+            values = np.interp(grid, time, trace[field].to_numpy()[unique_idx])
+            for start in range(0, len(grid) - nperseg + 1, nperseg // 2):
+                segment = values[start : start + nperseg]
+                spectrum = np.fft.rfft((segment - segment.mean()) * window)
+                reference_power[i] += np.abs(spectrum) ** 2
+                num_segments += i == 0
+    reference_power *= 2 * dt / (np.sum(window**2) * num_segments)
+    reference_power[:, [0, -1]] /= 2
+
+    # Verify the results
+    np.testing.assert_allclose(test_data["frequency"], np.fft.rfftfreq(nperseg, dt))
+    for i, field in enumerate(fields):
+        np.testing.assert_allclose(test_data[field], reference_power[i], rtol=1e-10)
+    peak_index = test_data["B1"].arg_max()
+    assert peak_index is not None
+    assert test_data["frequency"][peak_index] == pytest.approx(frequency)
+    with pytest.raises(ValueError, match="No trace has at least"):
+        pt.trace_frequency_spectra(directory, fields, nperseg=4096)
+
+    # The cadence can't be determined from traces with a single sample
+    [f.unlink() for f in directory.glob("*.parquet")]  # type: ignore[func-returns-value]
+    pl.concat([trace.head(1) for trace in traces]).write_parquet(
+        directory / f"test_traces_0_{num_probes - 1}.parquet"
+    )
+    with pytest.raises(ValueError, match="Pass dt instead"):
+        pt.trace_frequency_spectra(directory, fields)
+
+    # Cleanup the files created
+    [f.unlink() for f in directory.glob("*.parquet")]  # type: ignore[func-returns-value]
+
+
 def generate_random_trace_binary(
     file_path: Path,
     num_meshblocks: int = 96,
@@ -1,6 +1,8 @@
 """Tests for the contents of loading_tracks.py."""
 
+import json
 import re
+import shutil
 from pathlib import Path
 
 import numpy as np
@@ -11,6 +13,143 @@ import pytest
 import pegasustools as pt
 
 
+def test_remove_restart_overlaps() -> None:
+    """Test _remove_restart_overlaps and its Polars expression version."""
+    # Generate data with several restarts and a NaN in the time column
+    rng = np.random.default_rng(42)
+    times = np.concatenate(
+        (np.arange(0, 100), np.arange(50, 120), [np.nan], np.arange(110, 115))
+    ).astype(np.float64)
+    data = np.column_stack((rng.random(times.size), times, rng.random(times.size)))
+
+    # Compute the fiducial result with the original loop based algorithm
+    mask = np.ones(data.shape[0], dtype="bool")
+    current_min_time = np.inf
+    for i, time in reversed(list(enumerate(data[:, 1]))):
+        if time < current_min_time:
+            current_min_time = time
+        else:
+            mask[i] = False
+    fiducial_data = data[mask]
+
+    # Check the numpy version
+    test_data = pt.loading_tracks._remove_restart_overlaps(data, time_idx=1)
+    np.testing.assert_array_equal(fiducial_data, test_data)
+
+    # Check the Polars version on a lazy frame
+    test_df = (
+        pl.from_numpy(data, schema=["a", "t", "b"])
+        .lazy()
+        .filter(pt.loading_tracks._remove_restart_overlaps_expr("t"))
+        .collect()
+    )
+    np.testing.assert_array_equal(fiducial_data, test_df.to_numpy())
+
+    # Empty arrays are allowed
+    assert pt.loading_tracks._remove_restart_overlaps(data[:0], time_idx=1).size == 0
+
+
+def test_scan_ascii_table() -> None:
+    """Test _scan_ascii_table with single and irregularly spaced tables."""
+    fiducial_data = pl.DataFrame(
+        {"a": [1.0, 4.0], "b": [2.0, 5.0], "c": [3.0, None]},
+        schema={"a": pl.Float32, "b": pl.Float32, "c": pl.Float32},
+    )
+    for table in (b"# a b c\n1 2 3\n4 5\n", b"# a b c\n  1   2 3 \n 4  5\n"):
+        test_data = pt.loading_tracks._scan_ascii_table(table, ["a", "b", "c"])
+        polars.testing.assert_frame_equal(test_data.collect(), fiducial_data)
+
+
+def test_merge_row_counts() -> None:
+    """Test that _merge_row_counts sums the rows of each particle across tables."""
+    rng = np.random.default_rng(42)
+    tables = [
+        pl.DataFrame(
+            {
+                "species": rng.integers(0, 2, size=50),
+                "particle_id": rng.integers(0, 20, size=50),
+                "block_id": rng.integers(0, 3, size=50),
+                "num_rows": rng.integers(1, 10, size=50),
+            }
+        )
+        for _ in range(30)
+    ]
+    id_names = ["species", "particle_id", "block_id"]
+    polars.testing.assert_frame_equal(
+        pt.loading_tracks._merge_row_counts(iter(tables)).sort(id_names),
+        pl.concat(tables)
+        .group_by(id_names)
+        .agg(pl.col("num_rows").sum())
+        .sort(id_names),
+    )
+
+
+def test_scan_sorted_bucket() -> None:
+    """Test that _scan_sorted_bucket merges the sorted files of a bucket."""
+    # Setup paths
+    bucket_root = Path(__file__).parent.resolve() / "data" / "test_scan_sorted_bucket"
+    shutil.rmtree(bucket_root, ignore_errors=True)
+
+    # Write several flushes of unsorted rows to the same bucket
+    rng = np.random.default_rng(42)
+    tables = [
+        pl.DataFrame(
+            {
+                "particle_id": rng.integers(0, 20, size=size),
+                "time": rng.random(size),
+                "mu": rng.random(size),
+            }
+        )
+        for size in (50, 0, 17, 120, 3)
+    ]
+    for i, table in enumerate(tables):
+        pt.loading_tracks._write_bucket_buffers({0: [table]}, bucket_root, f"flush_{i}")
+
+    # The merged bucket is sorted the same as sorting all the rows
+    bucket_dir = pt.loading_tracks._get_bucket_dir(bucket_root, 0)
+    polars.testing.assert_frame_equal(
+        pt.loading_tracks._scan_sorted_bucket(bucket_dir).collect(engine="streaming"),
+        pl.concat(tables).sort(["particle_id", "time"]),
+    )
+
+    # Cleanup the files created
+    shutil.rmtree(bucket_root)
+
+
+def test_get_balanced_partitions() -> None:
+    """Test that _get_balanced_partitions balances the number of rows."""
+    # IDs with very different numbers of rows
+    rng = np.random.default_rng(42)
+    ids = np.sort(rng.choice(10_000, size=1000, replace=False))
+    counts = rng.integers(1, 10, size=ids.size)
+    counts[:100] = 100
+
+    num_partitions = 8
+    starts = pt.loading_tracks._get_balanced_partitions(ids, counts, num_partitions)
+    assert starts[0] == 0
+    assert len(starts) == num_partitions
+    assert np.all(np.diff(starts) > 0)
+
+    # Each partition is within one ID of an equal share of the rows
+    rows = np.add.reduceat(counts, starts)
+    assert rows.sum() == counts.sum()
+    assert np.abs(rows - counts.sum() / num_partitions).max() <= counts.max()
+
+    # A single ID can't be split
+    np.testing.assert_array_equal(
+        pt.loading_tracks._get_balanced_partitions(
+            np.array([1, 2, 3]), np.array([1, 100, 1]), 3
+        ),
+        [0, 1, 2],
+    )
+    np.testing.assert_array_equal(
+        pt.loading_tracks._get_balanced_partitions(
+            np.array([1, 2, 3]), np.array([100, 1, 1]), 3
+        ),
+        [0, 1],
+    )
+
+
 def test_no_track_dat_found() -> None:
     """Test that collate_tracks_from_ascii raises when no .track.dat file is found."""
     source_directory = Path(__file__).parent.resolve()
@@ -86,6 +225,7 @@ def test_collate_tracks_from_ascii_no_species() -> None:
 
     # Cleanup the files created
     [f.unlink() for f in source_directory.glob("*.track.dat")]  # type: ignore[func-returns-value]
+    (source_directory / ".pegasustools_catalog.parquet").unlink()
     [f.unlink() for f in parquet_directory.glob("*.parquet")]  # type: ignore[func-returns-value]
 
 
@@ -162,6 +302,7 @@ def test_collate_tracks_from_ascii_with_species() -> None:
 
     # Cleanup the files created
     [f.unlink() for f in source_directory.glob("*.track.dat")]  # type: ignore[func-returns-value]
+    (source_directory / ".pegasustools_catalog.parquet").unlink()
     [f.unlink() for f in parquet_directory.glob("*.parquet")]  # type: ignore[func-returns-value]
 
 
@@ -228,9 +369,254 @@ def test_collate_tracks_from_binary() -> None:
 
             # Cleanup the files created
             [f.unlink() for f in source_directory.glob("*.track_mpiio_optimized")]  # type: ignore[func-returns-value]
+            (source_directory / ".pegasustools_catalog.parquet").unlink()
             [f.unlink() for f in parquet_directory.glob("*.parquet")]  # type: ignore[func-returns-value]
 
 
+def test_collate_tracks_from_binary_memory_limit() -> None:
+    """Test that collate_tracks_from_binary is correct with many small buckets."""
+    # Setup paths
+    source_directory = (
+        Path(__file__).parent.resolve() / "data" / "test_collate_tracks_from_binary"
+    )
+    parquet_directory = source_directory / "parquet"
+    source_directory.mkdir(exist_ok=True)
+    parquet_directory.mkdir(exist_ok=True)
+
+    # Generate test data
+    num_files = 2
+    fiducial_data = generate_collated_binary_tracks(source_directory, num_files)
+
+    # A 30kB memory limit results in roughly a hundred buckets
+    pt.collate_tracks_from_binary(
+        num_processes=2,
+        source_dir=source_directory,
+        destination_dir=parquet_directory,
+        memory_limit_gb=3e-5,
+    )
+    output_paths = sorted(parquet_directory.glob("*.parquet"))
+    assert len(output_paths) > num_files
+    assert not (parquet_directory / "temp_buckets").exists()
+
+    # Every particle is in exactly one file and the files are sorted
+    output_dfs = [pl.read_parquet(path) for path in output_paths]
+    for output_df in output_dfs:
+        polars.testing.assert_frame_equal(
+            output_df, output_df.sort(["particle_id", "time"])
+        )
+    test_data = pl.concat(
+        output_df.with_columns(file=pl.lit(i)) for i, output_df in enumerate(output_dfs)
+    )
+    assert (
+        test_data.group_by("particle_id").agg(pl.col("file").n_unique())["file"].max()
+        == 1
+    )
+    test_data = test_data.drop("file")
+    test_data = test_data.sort(["particle_id", "time"])
+    polars.testing.assert_frame_equal(test_data.drop("delta_mu_abs"), fiducial_data)
+
+    # Cleanup the files created
+    [f.unlink() for f in source_directory.glob("*.track_mpiio_optimized")]  # type: ignore[func-returns-value]
+    (source_directory / ".pegasustools_catalog.parquet").unlink()
+    [f.unlink() for f in output_paths]  # type: ignore[func-returns-value]
+
+
+def test_collate_tracks_from_binary_hive() -> None:
+    """Test the hive output layout of collate_tracks_from_binary."""
+    # Setup paths
+    source_directory = (
+        Path(__file__).parent.resolve() / "data" / "test_collate_tracks_from_binary"
+    )
+    hive_directory = source_directory / "hive"
+    source_directory.mkdir(exist_ok=True)
+
+    # Generate test data
+    fiducial_data = generate_collated_binary_tracks(source_directory, 2)
+    fiducial_data = fiducial_data.with_columns(
+        delta_mu_abs=pl.when(pl.col("particle_id") == pl.col("particle_id").shift())
+        .then((pl.col("mu") - pl.col("mu").shift()).abs())
+        .otherwise(None)
+    )
+
+    pt.collate_tracks_from_binary(
+        num_processes=2,
+        source_dir=source_directory,
+        destination_dir=hive_directory,
+        output_layout="hive",
+        row_group_size=100,
+    )
+
+    # Check the layout and the manifest
+    manifest = json.loads((hive_directory / "_manifest.json").read_text())
+    assert manifest["num_rows"] == len(fiducial_data)
+    assert sum(entry["num_rows"] for entry in manifest["files"]) == len(fiducial_data)
+    for entry in manifest["files"]:
+        assert entry["path"] == (
+            f"species={entry['species']}/bucket={entry['bucket']}/data.parquet"
+        )
+
+    # Load everything
+    columns = fiducial_data.columns
+    test_data = (
+        pt.scan_collated_tracks(hive_directory)
+        .select(columns)
+        .collect()
+        .sort(["particle_id", "time"])
+    )
+    polars.testing.assert_frame_equal(test_data, fiducial_data)
+
+    # Load a few particles, including one that doesn't exist
+    particle_ids = fiducial_data["particle_id"].unique().sort()[[0, 7, -1]].to_list()
+    test_data = (
+        pt.scan_collated_tracks(hive_directory, [*particle_ids, -5])
+        .select(columns)
+        .collect()
+    )
+    polars.testing.assert_frame_equal(
+        test_data, fiducial_data.filter(pl.col("particle_id").is_in(particle_ids))
+    )
+    assert pt.scan_collated_tracks(hive_directory, [-5]).collect().height == 0
+
+    # Cleanup the files created
+    [f.unlink() for f in source_directory.glob("*.track_mpiio_optimized")]  # type: ignore[func-returns-value]
+    (source_directory / ".pegasustools_catalog.parquet").unlink()
+    shutil.rmtree(hive_directory)
+
+
+def test_collate_tracks_from_binary_columns() -> None:
+    """Test selecting columns in collate_tracks_from_binary."""
+    # Setup paths
+    source_directory = (
+        Path(__file__).parent.resolve() / "data" / "test_collate_tracks_from_binary"
+    )
+    parquet_directory = source_directory / "parquet"
+    source_directory.mkdir(exist_ok=True)
+    parquet_directory.mkdir(exist_ok=True)
+
+    # Generate test data
+    fiducial_data = generate_collated_binary_tracks(source_directory, 2)
+    fiducial_data = fiducial_data.select(
+        "particle_id", "block_id", "species", "time", "x1", "B3", "mu"
+    )
+
+    # Small chunks so that every file is converted in several pieces
+    pt.collate_tracks_from_binary(
+        num_processes=2,
+        source_dir=source_directory,
+        destination_dir=parquet_directory,
+        memory_limit_gb=1e-4,
+        columns=["B3", "x1"],
+    )
+    output_paths = sorted(parquet_directory.glob("*.parquet"))
+    test_data = pl.concat([pl.read_parquet(path) for path in output_paths])
+    test_data = test_data.sort(["particle_id", "time"])
+    polars.testing.assert_frame_equal(test_data.drop("delta_mu_abs"), fiducial_data)
+
+    # Requesting a missing column raises an error
+    with pytest.raises(ValueError, match="forcing1 is not a column in"):
+        pt.collate_tracks_from_binary(
+            num_processes=1,
+            source_dir=source_directory,
+            destination_dir=parquet_directory,
+            columns=["forcing1"],
+        )
+
+    # Cleanup the files created
+    [f.unlink() for f in source_directory.glob("*.track_mpiio_optimized")]  # type: ignore[func-returns-value]
+    (source_directory / ".pegasustools_catalog.parquet").unlink()
+    [f.unlink() for f in parquet_directory.glob("*.parquet")]  # type: ignore[func-returns-value]
+    shutil.rmtree(parquet_directory / "temp_buckets", ignore_errors=True)
+    (parquet_directory / "_checkpoint.json").unlink(missing_ok=True)
+
+
+def test_binary_track_reader_batches() -> None:
+    """Test that _binary_track_reader writes one file per bucket for a batch."""
+    # Setup paths
+    source_directory = (
+        Path(__file__).parent.resolve() / "data" / "test_binary_track_reader_batches"
+    )
+    bucket_root = source_directory / "temp_buckets"
+    source_directory.mkdir(exist_ok=True)
+    shutil.rmtree(bucket_root, ignore_errors=True)
+
+    # Generate test data and choose the buckets
+    fiducial_data = generate_collated_binary_tracks(source_directory, 4)
+    source_paths = sorted(source_directory.glob("*.track_mpiio_optimized"))
+    ids = pt.loading_tracks._get_binary_track_buckets(
+        pt.loading_tracks._merge_row_counts(
+            pt.loading_tracks._binary_track_prescan(path) for path in source_paths
+        ),
+        num_buckets=5,
+    )
+
+    # Convert every file in one batch with a buffer that holds all of them
+    output_paths, num_rows = pt.loading_tracks._binary_track_reader(
+        source_paths,
+        bucket_root / "test_file_0_temp.parquet",
+        (ids["species_min"], ids["species_max"], ids["particles_max"]),
+        np.array(ids["boundaries"]),
+        chunk_size=int(1e9),
+    )
+
+    # Verify the results
+    assert num_rows == len(fiducial_data)
+    bucket_dirs = sorted(bucket_root.glob("bucket_*"))
+    assert len(bucket_dirs) == len(ids["boundaries"])
+    assert all(len(list(bucket_dir.iterdir())) == 1 for bucket_dir in bucket_dirs)
+    assert sorted(output_paths) == sorted(bucket_root.glob("*/*.parquet"))
+    test_data = pl.read_parquet(bucket_root / "*" / "*.parquet").sort(
+        ["particle_id", "time"]
+    )
+    polars.testing.assert_frame_equal(
+        test_data, fiducial_data, check_column_order=False
+    )
+
+    # Cleanup the files created
+    [f.unlink() for f in source_paths]  # type: ignore[func-returns-value]
+    shutil.rmtree(bucket_root)
+
+
+def generate_collated_binary_tracks(
+    source_directory: Path, num_files: int
+) -> pl.DataFrame:
+    """Generate binary track files and the sorted data with global IDs.
+
+    Parameters
+    ----------
+    source_directory : Path
+        The directory to write the .track_mpiio_optimized files to
+    num_files : int
+        The number of files to write
+
+    Returns
+    -------
+    pl.DataFrame
+        The data with global particle IDs, sorted by particle ID and time. It doesn't
+        include delta mu.
+    """
+    fiducial_data = pl.concat(
+        [
+            generate_random_track_binary(
+                source_directory / f"test_file_{i}.track_mpiio_optimized",
+                num_columns=20,
+                seed=42 + i,
+                new_header=True,
+            )
+            for i in range(num_files)
+        ]
+    )
+
+    # Compute global IDs
+    species_min = fiducial_data["species"].min()
+    n_species = len(fiducial_data["species"].unique())
+    n_particles = len(fiducial_data["particle_id"].unique())
+    return fiducial_data.with_columns(
+        particle_id=(pl.col("species") - species_min)
+        + (pl.col("particle_id") * n_species)
+        + (pl.col("block_id") * n_species * n_particles)
+    ).sort(["particle_id", "time"])
+
+
 def generate_random_track_ascii(
     target_dir_path: Path,
     particle_id: int,